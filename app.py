@@ -8,7 +8,7 @@ import streamlit as st
 from pathlib import Path
 from collections import defaultdict
 
-from google.cloud import bigquery
+from src.backends import DEFAULT_BACKEND, default_project
 from src.requirement_builder import HealthcareStoryExtractor
 from src.testcase_generator import TestCaseGenerator
 from src.coverage_analyzer import CoverageAnalyzer
@@ -23,8 +23,7 @@ for p in [OUTPUT_DIR, FEATURE_DIR, STEPS_DIR]:
 
 # -------------------- Helpers --------------------
 async def run_extraction(file_path, dedupe, dup_threshold, batch_size, inner_batch, test_mode):
-    bq_client = bigquery.Client()
-    extractor = HealthcareStoryExtractor(project_id=bq_client.project)
+    extractor = HealthcareStoryExtractor(project_id=default_project(DEFAULT_BACKEND), backend=DEFAULT_BACKEND)
     stories = await extractor.extract_from_file(
         file_path,
         dedupe=dedupe,
@@ -93,8 +92,9 @@ def run_compliance(stories_file: Path, testcases_file: Path):
         testcases_path=str(testcases_file),
         out_csv=str(OUTPUT_DIR / "compliance_evidence.csv"),
         out_xlsx=str(OUTPUT_DIR / "compliance_evidence.xlsx"),
-        project_id=bigquery.Client().project,
-        use_embeddings=True
+        project_id=default_project(DEFAULT_BACKEND),
+        use_embeddings=True,
+        backend=DEFAULT_BACKEND,
     )
 
 def run_coverage():
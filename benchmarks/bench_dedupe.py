@@ -0,0 +1,56 @@
+"""
+Dedupe benchmark: exact vs LSH near-duplicate scan
+--------------------------------------------------
+Builds synthetic story embeddings with planted near-duplicate clusters and
+reports wall time and recall of the LSH mode against the exact mode.
+
+Run:
+  python -m benchmarks.bench_dedupe --stories 5000 --tables 4 8 16
+"""
+
+import time
+import argparse
+import numpy as np
+
+from src.requirement_builder import _similar_pairs, _lsh_similar_pairs
+
+
+def synthetic_stories(n: int, dim: int = 768, dup_rate: float = 0.2, noise: float = 0.04, seed: int = 0):
+    """n stories; roughly dup_rate of them are noisy copies of another story from a different requirement."""
+    rng = np.random.default_rng(seed)
+    embs = rng.standard_normal((n, dim))
+    n_dup = int(n * dup_rate)
+    src = rng.integers(0, n - n_dup, size=n_dup)
+    embs[n - n_dup:] = embs[src] + noise * rng.standard_normal((n_dup, dim))
+    stories = [{"story_id": f"S{i}", "source_requirement_ids": [f"REQ-{i}"]} for i in range(n)]
+    return stories, embs
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--stories", type=int, default=3000)
+    ap.add_argument("--dim", type=int, default=768)
+    ap.add_argument("--threshold", type=float, default=0.99)
+    ap.add_argument("--tables", type=int, nargs="+", default=[2, 4, 8, 16])
+    ap.add_argument("--bits", type=int, default=12)
+    args = ap.parse_args()
+
+    stories, embs = synthetic_stories(args.stories, dim=args.dim)
+
+    t0 = time.perf_counter()
+    exact = {(i, j) for i, j, _ in _similar_pairs(stories, embs, args.threshold)}
+    t_exact = time.perf_counter() - t0
+    print(f"exact      pairs={len(exact):6d}  time={t_exact:7.3f}s")
+
+    for tables in args.tables:
+        t0 = time.perf_counter()
+        approx = {(i, j) for i, j, _ in _lsh_similar_pairs(stories, embs, args.threshold,
+                                                           n_tables=tables, n_bits=args.bits)}
+        t_lsh = time.perf_counter() - t0
+        recall = len(approx & exact) / len(exact) if exact else 1.0
+        print(f"lsh t={tables:<3d} pairs={len(approx):6d}  time={t_lsh:7.3f}s  "
+              f"recall={recall:.4f}  speedup={t_exact / t_lsh if t_lsh else float('inf'):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+End-to-end pipeline benchmark
+-----------------------------
+Generates a synthetic SRS (txt, docx or pdf), runs every pipeline stage on
+the offline backend (FakeLLM + HashingEmbeddings, see src/backends.py) and
+reports wall time, throughput and peak memory per stage:
+
+  parse → normalize → segment → index → generate → align → dedupe →
+  testgen → exports → compliance → coverage
+
+normalize and index only apply to PDFs, as in extract_from_file.
+Peak memory is the tracemalloc peak of Python allocations during the stage
+(numpy included); rss_max_mb is the process high-water mark so far.
+Results are written as JSON; --baseline prints the time ratio per stage
+against an earlier results file.
+
+--quota-rpm/--quota-tpm put a Vertex-like quota on the fake LLM (calls over
+it raise ResourceExhausted), so the client-side limiter can be checked: with
+--rate-limit the limiter is set to the same quota and should see no rejections.
+
+Run:
+  python -m benchmarks.bench_pipeline --format pdf --pages 200 --llm-latency 0.05 --out pipeline.json
+  python -m benchmarks.bench_pipeline --format pdf --pages 200 --baseline pipeline.json --out new.json
+  python -m benchmarks.bench_pipeline --pages 60 --quota-rpm 600 --quota-window 10 --out quota_off.json
+  python -m benchmarks.bench_pipeline --pages 60 --quota-rpm 600 --quota-window 10 --rate-limit --out quota_on.json
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import resource
+import subprocess
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from benchmarks.synthetic_srs import write_synthetic_srs
+from src.requirement_builder import (
+    HealthcareStoryExtractor, STORY_GLOSSARY, STORY_ACTORS,
+    parse_file_text_or_pages, normalize_page_text, scan_document, open_retriever,
+)
+from src.testcase_generator import TestCaseGenerator
+from src.toolchain_connector import ToolChainConnector
+from src.coverage_analyzer import CoverageAnalyzer
+from src.compliance_validator import build_compliance_report
+from src.backends import FakeQuota
+from src.rate_limiter import QuotaLimiter
+from src.instrumentation import METRICS
+from src.usage import USAGE
+
+def _rss_max_mb() -> float:
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return kb / 1024 if sys.platform != "darwin" else kb / 1024 / 1024  # bytes on macOS
+
+
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class StageTimer:
+    """Collects one record per stage: seconds, items, items/s, tracemalloc peak and RSS high-water mark."""
+
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.records: List[Dict[str, Any]] = []
+
+    @contextmanager
+    def stage(self, name: str, unit: str):
+        rec: Dict[str, Any] = {"stage": name, "unit": unit, "items": 0}
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        try:
+            yield rec
+        finally:
+            rec["seconds"] = round(time.perf_counter() - t0, 6)
+            rec["items_per_s"] = round(rec["items"] / rec["seconds"], 3) if rec["seconds"] > 0 else None
+            if self.trace_memory:
+                rec["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1e6, 3)
+            rec["rss_max_mb"] = round(_rss_max_mb(), 1)
+            self.records.append(rec)
+            print(f"⏱️ {name:<10} {rec['seconds']:9.3f}s  {rec['items']:7d} {unit:<12} "
+                  f"{rec['items_per_s'] or 0:10.1f}/s  peak={rec.get('peak_mb', '-')} MB")
+
+    def skip(self, name: str, reason: str):
+        self.records.append({"stage": name, "skipped": reason})
+        print(f"⏭️ {name:<10} skipped ({reason})")
+
+
+async def _generate(extractor, requirements, retriever, batch_llm_size: int, pack_size: int):
+    """Generation as in extract_from_file: one pipeline over all requirements, batch_llm_size per retrieval chunk."""
+    by_req = await extractor._generate_by_requirement(
+        requirements, STORY_GLOSSARY, STORY_ACTORS, "HIPAA, FDA 21 CFR Part 11",
+        retriever=retriever, pack_size=pack_size, chunk_size=batch_llm_size,
+    )
+    return [s for s in by_req if s is not None]
+
+
+def run(args) -> Dict[str, Any]:
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="bench_pipeline_"))
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)  # relative default cache dirs (e.g. the compliance KB cache) land here, not in the repo
+    doc = write_synthetic_srs(
+        os.path.join(workdir, f"srs.{args.format}"), target_bytes=int(args.mb * 1_000_000),
+        pages=args.pages, requirements=args.requirements, heading_depth=args.heading_depth, seed=args.seed,
+    )
+    print(f"📄 Synthetic SRS: {doc}")
+
+    cache_root = os.path.join(workdir, ".cache") if args.warm else None
+    extractor = HealthcareStoryExtractor(
+        project_id="offline", backend="fake",
+        llm_concurrency=args.concurrency, llm_retries=args.retries, rate_limit=args.rate_limit,
+        embedding_cache_dir=cache_root and os.path.join(cache_root, "embeddings"),
+        llm_cache_dir=cache_root and os.path.join(cache_root, "llm"),
+        rag_index_dir=cache_root and os.path.join(cache_root, "rag"),
+        retrieval_mode=args.retrieval_mode, chunking=args.chunking, stream_responses=args.stream_responses,
+    )
+    extractor.llm.latency = args.llm_latency
+    extractor.llm.failure_rate = args.failure_rate
+    extractor.llm.invalid_rate = args.invalid_rate
+    if args.quota_rpm or args.quota_tpm:
+        extractor.llm.quota = FakeQuota(args.quota_rpm, args.quota_tpm, window=args.quota_window)
+        if args.rate_limit:
+            # Client-side limiter sized to the same quota (instead of the VERTEX_LLM_* defaults)
+            limiter = QuotaLimiter(args.quota_rpm, args.quota_tpm, name="bench-quota")
+            extractor.scheduler.limiter = extractor.repair_scheduler.limiter = limiter
+    out = os.path.join(workdir, "outputs")
+    os.makedirs(out, exist_ok=True)
+
+    if args.trace_memory:
+        tracemalloc.start()
+    timer = StageTimer(trace_memory=args.trace_memory)
+    METRICS.reset()
+    USAGE.reset()
+
+    with timer.stage("parse", "pages") as rec:
+        parsed = parse_file_text_or_pages(doc["path"])
+        rec["items"] = len(parsed.get("pages") or [1])
+
+    norm_pages = None
+    if "pages" in parsed:
+        with timer.stage("normalize", "pages") as rec:
+            norm_pages = normalize_page_text(parsed["pages"])
+            rec["items"] = len(norm_pages)
+        pages = norm_pages
+    else:
+        timer.skip("normalize", "not a PDF")
+        pages = [{"page": 1, "text": parsed["text"]}]
+
+    with timer.stage("segment", "requirements") as rec:
+        requirements = scan_document(pages, normalize=False)["requirements"]
+        if args.max_requirements:
+            requirements = requirements[:args.max_requirements]
+        rec["items"] = len(requirements)
+
+    retriever = None
+    if norm_pages is not None:
+        with timer.stage("index", "chunks") as rec:
+            retriever = open_retriever(extractor.embedder, norm_pages, extractor.rag_index, extractor.embedding_model,
+                                       mode=extractor.retrieval_mode, chunking=extractor.chunking)
+            rec["items"] = len(retriever)
+    else:
+        timer.skip("index", "not a PDF")
+
+    with timer.stage("generate", "requirements") as rec:
+        stories = asyncio.run(_generate(extractor, requirements, retriever, args.batch_llm_size, args.pack_size))
+        rec["items"] = len(requirements)
+        rec["stories"] = len(stories)
+
+    with timer.stage("align", "stories") as rec:
+        stories = extractor._postprocess(stories, requirements, False, args.dup_threshold, 0.15, args.dedupe_mode)
+        rec["items"] = len(stories)
+
+    with timer.stage("dedupe", "stories") as rec:
+        rec["items"] = len(stories)
+        _, stories = extractor.find_near_duplicates(stories, threshold=args.dup_threshold, mode=args.dedupe_mode)
+        rec["kept"] = len(stories)
+
+    reqs_path = os.path.join(out, "requirements.json")
+    stories_path = os.path.join(out, "stories.json")
+    testcases_path = os.path.join(out, "testcases.csv")
+
+    with timer.stage("testgen", "stories") as rec:
+        TestCaseGenerator().generate(
+            stories, feature_dir=os.path.join(out, "features"), steps_dir=os.path.join(out, "steps"),
+            framework="pytest-bdd", feature_per_epic=True, traceability_csv=testcases_path,
+        )
+        rec["items"] = len(stories)
+
+    with timer.stage("exports", "stories") as rec:
+        with open(reqs_path, "w", encoding="utf-8") as f:
+            json.dump(requirements, f, ensure_ascii=False)
+        with open(stories_path, "w", encoding="utf-8") as f:
+            json.dump(stories, f, ensure_ascii=False)
+        connector = ToolChainConnector()
+        connector.export_to_jira_csv(stories, path=os.path.join(out, "jira_testcases.csv"))
+        connector.export_to_ado_csv(stories, path=os.path.join(out, "ado_testcases.csv"))
+        rec["items"] = len(stories)
+
+    with timer.stage("compliance", "stories") as rec:
+        build_compliance_report(
+            stories_path=stories_path, testcases_path=testcases_path,
+            out_csv=os.path.join(out, "compliance_evidence.csv"), out_xlsx=None,
+            project_id="offline", use_embeddings=True, backend="fake", rate_limit=args.rate_limit,
+        )
+        rec["items"] = len(stories)
+
+    with timer.stage("coverage", "requirements") as rec:
+        CoverageAnalyzer(reqs_path, stories_path, testcases_path).run_analysis(
+            coverage_output=os.path.join(out, "coverage_matrix.csv"),
+            epic_output=os.path.join(out, "epic_coverage.csv"),
+        )
+        rec["items"] = len(requirements)
+
+    if args.trace_memory:
+        tracemalloc.stop()
+    sched = extractor.scheduler
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")},
+        },
+        "document": doc,
+        "stages": timer.records,
+        "total_seconds": round(sum(r.get("seconds", 0) for r in timer.records), 6),
+        "counters": {
+            "llm_calls": extractor.llm.calls,
+            "llm_failures_injected": extractor.llm.failures,
+            "llm_quota_rejections": extractor.llm.quota.rejected,
+            "scheduler_calls": sched.calls,
+            "scheduler_retried": sched.retried,
+            "scheduler_timeouts": sched.timeouts,
+            "scheduler_failures": sched.failures,
+            "scheduler_aborted": sched.aborted,
+            "repair_calls": extractor.repair_scheduler.calls,
+            "failed_requirements": len(extractor.failed_requirements),
+        },
+        "metrics": METRICS.report(),  # the pipeline's own spans/counters/histograms
+        "usage": {k: v for k, v in USAGE.report(requirements, stories).items() if k != "by_requirement"},
+    }
+
+
+def compare(result: Dict[str, Any], baseline_path: str):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        base = {r["stage"]: r for r in json.load(f)["stages"] if "seconds" in r}
+    print(f"\n📊 vs {baseline_path} (new / baseline time)")
+    for r in result["stages"]:
+        b = base.get(r["stage"])
+        if "seconds" in r and b and b["seconds"] > 0:
+            print(f"  {r['stage']:<10} {r['seconds']:9.3f}s vs {b['seconds']:9.3f}s  x{r['seconds'] / b['seconds']:.2f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--format", choices=("txt", "docx", "pdf"), default="pdf")
+    ap.add_argument("--mb", type=float, default=1000.0, help="size cap in MB (pages/requirements usually bind first)")
+    ap.add_argument("--pages", type=int, default=50)
+    ap.add_argument("--requirements", type=int)
+    ap.add_argument("--heading-depth", type=int, default=2)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--max-requirements", type=int, help="cap requirements sent to the LLM (like TEST mode)")
+    ap.add_argument("--llm-latency", type=float, default=0.05)
+    ap.add_argument("--failure-rate", type=float, default=0.0)
+    ap.add_argument("--invalid-rate", type=float, default=0.0, help="share of fake stories failing validation")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--retries", type=int, default=2)
+    ap.add_argument("--rate-limit", action="store_true", help="apply the Vertex quota limiters")
+    ap.add_argument("--quota-rpm", type=float, default=0.0, help="fake LLM quota, requests/minute (0 = none)")
+    ap.add_argument("--quota-tpm", type=float, default=0.0, help="fake LLM quota, prompt tokens/minute (0 = none)")
+    ap.add_argument("--quota-window", type=float, default=60.0, help="seconds the fake quota is enforced over")
+    ap.add_argument("--batch-llm-size", type=int, default=20)
+    ap.add_argument("--pack-size", type=int, default=1)
+    ap.add_argument("--retrieval-mode", choices=("dense", "hybrid", "lexical"), default="dense")
+    ap.add_argument("--chunking", choices=("sentence", "window"), default="sentence")
+    ap.add_argument("--stream-responses", action="store_true", help="stream and validate stories as they arrive")
+    ap.add_argument("--dedupe-mode", choices=("exact", "lsh"), default="exact")
+    ap.add_argument("--dup-threshold", type=float, default=0.99)
+    ap.add_argument("--warm", action="store_true", help="enable embedding/LLM/RAG caches under --workdir")
+    ap.add_argument("--no-trace-memory", dest="trace_memory", action="store_false",
+                    help="skip tracemalloc (cleaner timings, no peak_mb)")
+    ap.add_argument("--workdir", help="where the document and outputs go (default: a temp dir)")
+    ap.add_argument("--out", default="bench_pipeline.json")
+    ap.add_argument("--baseline", help="earlier results JSON to compare against")
+    args = ap.parse_args()
+    args.out = os.path.abspath(args.out)
+    args.baseline = args.baseline and os.path.abspath(args.baseline)
+
+    result = run(args)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"\n✅ {result['total_seconds']:.3f}s total → {args.out}")
+    if args.baseline:
+        compare(result, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Segmentation benchmark: single-pass scan vs separate passes
+-----------------------------------------------------------
+Runs scan_document (normalize + headings + requirements in one scan) on a
+synthetic SRS against
+  baseline     the multi-pass code it replaced (normalize → extract_headings →
+               split, with per-line re.match calls), frozen below
+  multi-pass   the same three passes built from today's helpers
+and reports MB/s for each, checking all three give the same requirements.
+
+Run:
+  python -m benchmarks.bench_segmentation --mb 5 20
+"""
+
+import re
+import time
+import argparse
+from typing import Any, Dict, List
+
+from benchmarks.synthetic_srs import synthetic_srs_pages
+from src.requirement_builder import (
+    scan_document, normalize_page_text, extract_headings, iter_requirements_with_epics,
+    EpicIndex, BULLET_RE, REQ_ID_RE, HEADING_RE, GENERIC_HEADINGS,
+)
+
+
+# ---------------- baseline: the multi-pass segmentation, as it was ----------------
+# (epics through EpicIndex, as today: the old longest-prefix search is quadratic
+# and would swamp the comparison of the passes themselves)
+
+def _baseline_normalize(text: str) -> str:
+    out = []
+    buf = ""
+    for raw in text.splitlines():
+        line = raw.rstrip()
+        if not line.strip():
+            if buf:
+                out.append(buf)
+                buf = ""
+            out.append("")
+            continue
+        if BULLET_RE.match(line) or REQ_ID_RE.match(line):
+            if buf:
+                out.append(buf)
+            buf = line.strip()
+            continue
+        if buf and not buf.endswith((".", ":", ";")):
+            buf += " " + line.strip()
+        else:
+            if buf:
+                out.append(buf)
+            buf = line.strip()
+    if buf:
+        out.append(buf)
+    cleaned = []
+    for s in out:
+        if s == "" and cleaned and cleaned[-1] == "":
+            continue
+        cleaned.append(s)
+    return "\n".join(cleaned)
+
+
+def _baseline_headings(text: str) -> Dict[str, str]:
+    headings = {}
+    for line in text.splitlines():
+        m = HEADING_RE.match(line.strip())
+        if m:
+            title = m.group(2).strip()
+            if title.lower() not in GENERIC_HEADINGS:
+                headings[m.group(1)] = title
+    return headings
+
+
+def _baseline_split(text: str, headings: Dict[str, str]) -> List[Dict[str, str]]:
+    epics = EpicIndex(headings)
+    reqs, cur, count = [], None, 0
+
+    def flush():
+        nonlocal cur, count
+        if cur and cur["text"].strip():
+            cur["text"] = re.sub(r"\s+", " ", cur["text"]).strip()
+            cur["epic"] = epics.lookup(cur["req_id"])
+            count += 1
+            reqs.append(cur)
+        cur = None
+
+    for raw in text.split("\n"):
+        line = raw.strip()
+        if not line:
+            continue
+        m = re.match(r"^(REQ[-\s]?\d+|[0-9]+(?:\.[0-9]+)*)\b", line)
+        if m:
+            flush()
+            cur = {"req_id": m.group(0), "text": line[m.end():].strip() or line}
+        elif re.match(r"^\s*[-*•]\s+", line):
+            flush()
+            cur = {"req_id": f"AUTO-{count + 1}", "text": line}
+        elif cur:
+            cur["text"] += " " + line
+        else:
+            cur = {"req_id": f"AUTO-{count + 1}", "text": line}
+    flush()
+    return reqs
+
+
+def multi_pass(pages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    norm = [{"page": p["page"], "text": _baseline_normalize(p["text"])} for p in pages]
+    full_text = "\n".join(p["text"] for p in norm)
+    return _baseline_split(full_text, _baseline_headings(full_text))
+
+
+def multi_pass_today(pages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """The same three passes built from today's helpers (what scan_document fuses)."""
+    norm = normalize_page_text(pages)
+    full_text = "\n".join(p["text"] for p in norm)
+    return list(iter_requirements_with_epics([full_text], headings=extract_headings(full_text)))
+
+
+def best_of(fn, arg, repeat):
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(arg)
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--mb", type=float, nargs="+", default=[1, 5, 20])
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    for mb in args.mb:
+        pages = synthetic_srs_pages(int(mb * 1_000_000))
+        size_mb = sum(len(p["text"].encode("utf-8")) for p in pages) / 1e6
+        t_multi, reqs_multi = best_of(multi_pass, pages, args.repeat)
+        t_today, reqs_today = best_of(multi_pass_today, pages, args.repeat)
+        t_scan, scan = best_of(lambda p: scan_document(p)["requirements"], pages, args.repeat)
+        same = reqs_multi == scan and reqs_today == scan
+        print(f"{size_mb:7.1f} MB  reqs={len(scan):7d}  "
+              f"baseline={size_mb / t_multi:6.1f} MB/s  multi-pass={size_mb / t_today:6.1f} MB/s  "
+              f"single-pass={size_mb / t_scan:6.1f} MB/s  "
+              f"speedup={t_multi / t_scan:.2f}x (vs multi-pass {t_today / t_scan:.2f}x)  same={same}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Synthetic SRS generator
+-----------------------
+Produces SRS-shaped text (numbered sections, headings, "shall" requirements,
+bullets, soft-wrapped lines and page breaks) of any size, for benchmarks,
+and writes it as .txt, .docx or .pdf.
+
+Size is bounded by whichever limit is hit first: target_bytes, pages or
+requirements. heading_depth sets how deep sections nest (2 → "3.1 Title"
+headings with "3.1.4 ..." requirements).
+
+Run:
+  python -m benchmarks.synthetic_srs --pages 200 --heading-depth 3 --out /tmp/srs.pdf
+"""
+
+import random
+import argparse
+from typing import Any, Dict, List, Optional
+
+_AREAS = ["Patient Registration", "Clinician Portal", "Medication Management", "Audit Logging",
+          "Lab Results", "Appointment Scheduling", "Consent Management", "Billing Integration"]
+_ACTORS = ["The system", "The clinician portal", "The EHR module", "The audit service", "The scheduler"]
+_VERBS = ["shall record", "shall validate", "must encrypt", "shall display", "should notify", "shall retain"]
+_OBJECTS = ["patient demographics", "e-signatures with reason for signing", "lab results within 24 hours",
+            "medication orders", "access attempts to PHI", "appointment reminders", "consent revocations"]
+_TAILS = ["in accordance with HIPAA", "per FDA 21 CFR Part 11", "for at least six years",
+          "and expose them through the FHIR API", "with a complete audit trail", "for authorized users only"]
+
+
+def _sentence(rng: random.Random) -> str:
+    return f"{rng.choice(_ACTORS)} {rng.choice(_VERBS)} {rng.choice(_OBJECTS)} {rng.choice(_TAILS)}."
+
+
+def _wrap(text: str, width: int = 80) -> List[str]:
+    lines, cur = [], ""
+    for word in text.split():
+        if cur and len(cur) + 1 + len(word) > width:
+            lines.append(cur)
+            cur = word
+        else:
+            cur = f"{cur} {word}" if cur else word
+    if cur:
+        lines.append(cur)
+    return lines
+
+
+def _requirement_block(rng: random.Random, req_id: str) -> List[str]:
+    body = " ".join(_sentence(rng) for _ in range(rng.randint(1, 3)))
+    block = _wrap(f"{req_id} {body}")
+    if rng.random() < 0.3:
+        block += [f"- {_sentence(rng)}" for _ in range(rng.randint(1, 3))]
+    block.append("")
+    return block
+
+
+def _section(rng: random.Random, number: str, depth: int, heading_depth: int) -> List[str]:
+    """Heading for section `number`, then subsections or (at the deepest level) requirements."""
+    title = f"{rng.choice(_AREAS)} Requirements" if depth == 1 else rng.choice(_AREAS)
+    block = [f"{number} {title}", ""]
+    if depth < heading_depth:
+        for sub in range(1, rng.randint(3, 6)):
+            block += _section(rng, f"{number}.{sub}", depth + 1, heading_depth)
+    else:
+        for req in range(1, rng.randint(4, 9)):
+            block += _requirement_block(rng, f"{number}.{req}")
+    return block
+
+
+def synthetic_srs_pages(target_bytes: int = 1_000_000, lines_per_page: int = 60, seed: int = 0,
+                        pages: Optional[int] = None, requirements: Optional[int] = None,
+                        heading_depth: int = 2) -> List[Dict[str, Any]]:
+    """Raw (un-normalized) pages, stopping at roughly target_bytes, `pages` pages or `requirements` requirements."""
+    rng = random.Random(seed)
+    heading_depth = max(1, heading_depth)
+    max_lines = pages * lines_per_page if pages is not None else None
+    lines: List[str] = []
+    size = 0
+    n_reqs = 0
+    sec = 0
+    while size < target_bytes:
+        sec += 1
+        block = _section(rng, str(sec), 1, heading_depth)
+        lines += block
+        size += sum(len(l) + 1 for l in block)
+        n_reqs += sum(1 for l in block if l and l[0].isdigit() and l.split(" ", 1)[0].count(".") == heading_depth)
+        if requirements is not None and n_reqs >= requirements:
+            break
+        if max_lines is not None and len(lines) >= max_lines:
+            lines = lines[:max_lines]
+            break
+    return [{"page": i // lines_per_page + 1, "text": "\n".join(lines[i:i + lines_per_page])}
+            for i in range(0, len(lines), lines_per_page)]
+
+
+def synthetic_srs_text(target_bytes: int = 1_000_000, seed: int = 0, **kwargs) -> str:
+    return "\n".join(p["text"] for p in synthetic_srs_pages(target_bytes, seed=seed, **kwargs))
+
+
+# ------------------------------ Writers ------------------------------
+
+def write_txt(pages: List[Dict[str, Any]], path: str) -> str:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(p["text"] for p in pages))
+    return path
+
+
+def write_docx(pages: List[Dict[str, Any]], path: str) -> str:
+    import docx  # python-docx, already a pipeline dependency
+    doc = docx.Document()
+    for n, p in enumerate(pages):
+        if n:
+            doc.add_page_break()
+        for line in p["text"].split("\n"):
+            doc.add_paragraph(line)
+    doc.save(path)
+    return path
+
+
+def _pdf_escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(pages: List[Dict[str, Any]], path: str, font_size: int = 9, leading: int = 12) -> str:
+    """Minimal text-only PDF (one Helvetica text object per page); no extra dependency."""
+    objects: List[bytes] = []
+    page_ids: List[int] = []
+    n_pages = len(pages)
+    # 1: catalog, 2: page tree, 3: font; then (page, content) pairs
+    for i, p in enumerate(pages):
+        page_id, content_id = 4 + 2 * i, 5 + 2 * i
+        page_ids.append(page_id)
+        ops = [f"BT /F1 {font_size} Tf {leading} TL 40 760 Td"]
+        ops += [f"({_pdf_escape(line)}) Tj T*" for line in p["text"].split("\n")]
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1", errors="replace")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>".encode())
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    head = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {n_pages} >>".encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, body in enumerate(head + objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % num + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(offsets) + 1)
+    out += b"".join(b"%010d 00000 n \n" % off for off in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(offsets) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+    return path
+
+
+WRITERS = {"txt": write_txt, "docx": write_docx, "pdf": write_pdf}
+
+
+def write_synthetic_srs(path: str, fmt: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+    """Generate a synthetic SRS (kwargs as synthetic_srs_pages) and write it; returns its stats."""
+    fmt = fmt or path.rsplit(".", 1)[-1].lower()
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown format: {fmt!r} (expected one of {tuple(WRITERS)})")
+    pages = synthetic_srs_pages(**kwargs)
+    WRITERS[fmt](pages, path)
+    return {
+        "path": path,
+        "format": fmt,
+        "pages": len(pages),
+        "bytes": sum(len(p["text"].encode("utf-8")) for p in pages),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--out", required=True, help="output path; format from extension (.txt, .docx, .pdf)")
+    ap.add_argument("--mb", type=float, default=1.0)
+    ap.add_argument("--pages", type=int)
+    ap.add_argument("--requirements", type=int)
+    ap.add_argument("--heading-depth", type=int, default=2)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    stats = write_synthetic_srs(args.out, target_bytes=int(args.mb * 1_000_000), pages=args.pages,
+                                requirements=args.requirements, heading_depth=args.heading_depth, seed=args.seed)
+    print(stats)
+
+
+if __name__ == "__main__":
+    main()
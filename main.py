@@ -4,10 +4,6 @@ import asyncio
 import pandas as pd
 from typing import List, Iterable, Dict, Any, Optional
 
-# Core libraries
-from google.cloud import bigquery
-from langchain_google_vertexai import VertexAIEmbeddings, VertexAI
-
 # Project modules from the 'src' directory
 # These are external dependencies and their mock implementations are provided below for demonstration.
 from src.requirement_builder import HealthcareStoryExtractor
@@ -15,6 +11,9 @@ from src.testcase_generator import TestCaseGenerator
 from src.toolchain_connector import ToolChainConnector
 from src.coverage_analyzer import CoverageAnalyzer
 from src.compliance_validator import build_compliance_report
+from src.backends import DEFAULT_BACKEND, default_project
+from src.instrumentation import METRICS
+from src.usage import USAGE
 
 
 # ========================== Main Workflow ==========================
@@ -26,9 +25,11 @@ async def main():
     # ========================== Configuration ==========================
     LLM_MODEL = "gemini-2.0-flash"  # e.g., "gemini-1.5-pro"
     
+    # "vertex", or "fake" for offline runs (deterministic LLM + embeddings, no GCP calls)
+    BACKEND = os.environ.get("MODEL_BACKEND", DEFAULT_BACKEND)
+
     # Auto-detect project from your auth context
-    bq_client = bigquery.Client()
-    PROJECT_ID = bq_client.project
+    PROJECT_ID = default_project(BACKEND)
     TEST = True  # set this to False for full run
     
     # Configs (override via env)
@@ -36,24 +37,47 @@ async def main():
     OUTPUT_JSON = os.environ.get("OUTPUT_JSON", "generated_user_stories.json")
     DEDUPE = os.environ.get("DEDUPE", "true").lower() in {"1", "true", "yes"}
     DUP_THRESHOLD = float(os.environ.get("DUP_THRESHOLD", "0.99"))
+    DEDUPE_MODE = os.environ.get("DEDUPE_MODE", "exact")  # "exact" or "lsh" (approximate, for very large runs)
+    LSH_TABLES = int(os.environ.get("LSH_TABLES", "8"))  # DEDUPE_MODE=lsh: more tables = more recall
+    LSH_BITS = int(os.environ.get("LSH_BITS", "12"))     # DEDUPE_MODE=lsh: more bits = smaller buckets
     EXPORT = os.environ.get("EXPORT_TO_BQ", "false").lower() in {"1", "true", "yes"}
     BATCH_LLM_SIZE = int(os.environ.get("BATCH_LLM_SIZE", "20"))
     LLM_INNER_BATCH = int(os.environ.get("LLM_INNER_BATCH", "5"))
+    LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "8"))
+    PROMPT_PACK_SIZE = int(os.environ.get("PROMPT_PACK_SIZE", "1"))  # requirements per LLM prompt
+    STREAMING = os.environ.get("STREAMING", "false").lower() in {"1", "true", "yes"}  # overlap PDF parsing with LLM
+    INCREMENTAL = os.environ.get("INCREMENTAL", "false").lower() in {"1", "true", "yes"}  # reuse unchanged requirements
+    RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "dense")  # "dense", "hybrid" (BM25 + embeddings) or "lexical" (offline)
+    CHUNKING = os.environ.get("CHUNKING", "sentence")  # RAG chunks: "sentence" (deduplicated) or "window" (fixed 1500 chars)
+    STREAM_RESPONSES = os.environ.get("STREAM_RESPONSES", "false").lower() in {"1", "true", "yes"}  # validate stories as they stream
+    # Client-side Vertex quota limiting; the fake backend has no quota unless FAKE_*_RPM/TPM are set
+    RATE_LIMIT = os.environ.get("RATE_LIMIT", "false" if BACKEND == "fake" else "true").lower() in {"1", "true", "yes"}
 
     # Create the outputs directory if it doesn't exist
     OUTPUT_DIR = "outputs"
     os.makedirs(OUTPUT_DIR, exist_ok=True)
+    METRICS.reset()  # timings/counters for this run → outputs/run_report.json
+    USAGE.reset()    # tokens/characters/cost for this run → outputs/cost_report.json
     
     # ========================== Step 1: Extract Requirements and Generate Stories ==========================
     print("🚀 Step 1: Extracting requirements and generating user stories...")
-    extractor = HealthcareStoryExtractor(project_id=PROJECT_ID)
+    extractor = HealthcareStoryExtractor(
+        project_id=PROJECT_ID, llm_concurrency=LLM_CONCURRENCY, retrieval_mode=RETRIEVAL_MODE,
+        chunking=CHUNKING, backend=BACKEND, stream_responses=STREAM_RESPONSES, rate_limit=RATE_LIMIT,
+    )
     stories = await extractor.extract_from_file(
         FILE_PATH,
         dedupe=DEDUPE,
         dup_threshold=DUP_THRESHOLD,
         batch_llm_size=BATCH_LLM_SIZE,
         llm_inner_batch=LLM_INNER_BATCH,
-        TEST=TEST
+        TEST=TEST,
+        dedupe_mode=DEDUPE_MODE,
+        lsh_tables=LSH_TABLES,
+        lsh_bits=LSH_BITS,
+        pack_size=PROMPT_PACK_SIZE,
+        streaming=STREAMING,
+        incremental=INCREMENTAL,
     )
     
     # Save the raw output to JSON files in the outputs directory
@@ -65,6 +89,10 @@ async def main():
     
     with open(os.path.join(OUTPUT_DIR, "stories.json"), "w", encoding="utf-8") as f:
         json.dump(stories, f, indent=2, ensure_ascii=False)
+
+    # Requirements whose story was still rejected after the repair pass (empty list = none)
+    with open(os.path.join(OUTPUT_DIR, "failed_requirements.json"), "w", encoding="utf-8") as f:
+        json.dump(extractor.failed_requirements, f, indent=2, ensure_ascii=False)
     
     print("✅ Requirements and stories saved to 'outputs' folder.")
 
@@ -106,7 +134,9 @@ async def main():
         out_csv=os.path.join(OUTPUT_DIR, "compliance_evidence.csv"),
         out_xlsx=os.path.join(OUTPUT_DIR, "compliance_evidence.xlsx"),
         project_id=PROJECT_ID,
-        use_embeddings=True
+        use_embeddings=True,
+        backend=BACKEND,
+        rate_limit=RATE_LIMIT,
     )
     
     # ========================== Step 5: Generate Coverage Reports ==========================
@@ -123,6 +153,17 @@ async def main():
     )
     print("✅ Coverage reports generated.")
 
+    # Per-stage timings, LLM/cache counters and latency histograms for this run
+    METRICS.write_report(
+        os.path.join(OUTPUT_DIR, "run_report.json"),
+        config={"backend": BACKEND, "retrieval_mode": RETRIEVAL_MODE, "chunking": CHUNKING,
+                "llm_concurrency": LLM_CONCURRENCY, "batch_llm_size": BATCH_LLM_SIZE,
+                "pack_size": PROMPT_PACK_SIZE, "streaming": STREAMING, "stream_responses": STREAM_RESPONSES},
+    )
+    # Tokens, embedded characters and cost per requirement, epic and run
+    USAGE.write_report(os.path.join(OUTPUT_DIR, "cost_report.json"),
+                       requirements=extractor._last_requirements, stories=stories)
+
     # ========================== Optional: Export to BigQuery ==========================
     if EXPORT:
         print("\n🚀 Optional: Exporting to BigQuery...")
@@ -0,0 +1,340 @@
+"""
+Model & Client Backends
+-----------------------
+Pluggable construction of the LLM, embeddings client and project id, so the
+pipeline can run against Vertex AI or fully offline for profiling and load
+tests.
+
+Backends:
+  vertex   VertexAI / VertexAIEmbeddings / bigquery (default)
+  fake     deterministic, network-free stand-ins:
+             HashingEmbeddings  feature-hashed bag of words + bigrams, L2-normalized
+             FakeLLM            schema-valid UserStory JSON (single or packed
+                                prompts) with configurable latency and failure rate
+             FakeQuota          optional per-minute request/token quota on either
+                                fake; calls over it raise ResourceExhausted like Vertex
+
+Both fakes are deterministic: the same text always embeds to the same vector,
+and the same prompt always gets the same answer (failures depend on the prompt
+and its attempt number, so runs reproduce regardless of completion order).
+
+Config (env):
+  MODEL_BACKEND          "vertex" or "fake" (default: vertex)
+  FAKE_LLM_LATENCY       mean seconds per fake LLM call (default: 0.05)
+  FAKE_LLM_JITTER        +/- fraction of latency, uniform (default: 0.5)
+  FAKE_LLM_FAILURE_RATE  share of fake calls raising a transient error (default: 0.0)
+  FAKE_LLM_INVALID_RATE  share of fake stories missing a required field (default: 0.0)
+  FAKE_EMBED_DIM         fake embedding width (default: 768)
+  FAKE_EMBED_LATENCY     seconds per fake embedding request (default: 0.0)
+  FAKE_STREAM_CHUNK      characters per fake streamed chunk (default: 32)
+  FAKE_LLM_RPM / FAKE_LLM_TPM       fake LLM quota, 0 = unlimited (default: 0 / 0)
+  FAKE_EMBED_RPM / FAKE_EMBED_TPM   fake embedding quota, 0 = unlimited (default: 0 / 0)
+  FAKE_QUOTA_WINDOW      seconds the per-minute quotas are enforced over, scaled (default: 60)
+"""
+
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import random
+import threading
+import numpy as np
+from collections import deque
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+try:
+    from google.api_core.exceptions import ResourceExhausted
+except ImportError:  # offline installs without the Google client libraries
+    class ResourceExhausted(Exception):
+        """Stand-in for google.api_core.exceptions.ResourceExhausted (HTTP 429)."""
+
+from src.rate_limiter import estimate_tokens
+
+BACKENDS = ("vertex", "fake")
+DEFAULT_BACKEND = os.environ.get("MODEL_BACKEND", "vertex")
+
+FAKE_LLM_LATENCY = float(os.environ.get("FAKE_LLM_LATENCY", "0.05"))
+FAKE_LLM_JITTER = float(os.environ.get("FAKE_LLM_JITTER", "0.5"))
+FAKE_LLM_FAILURE_RATE = float(os.environ.get("FAKE_LLM_FAILURE_RATE", "0.0"))
+FAKE_LLM_INVALID_RATE = float(os.environ.get("FAKE_LLM_INVALID_RATE", "0.0"))
+FAKE_EMBED_DIM = int(os.environ.get("FAKE_EMBED_DIM", "768"))
+FAKE_EMBED_LATENCY = float(os.environ.get("FAKE_EMBED_LATENCY", "0.0"))
+FAKE_STREAM_CHUNK = int(os.environ.get("FAKE_STREAM_CHUNK", "32"))
+FAKE_LLM_RPM = float(os.environ.get("FAKE_LLM_RPM", "0"))
+FAKE_LLM_TPM = float(os.environ.get("FAKE_LLM_TPM", "0"))
+FAKE_EMBED_RPM = float(os.environ.get("FAKE_EMBED_RPM", "0"))
+FAKE_EMBED_TPM = float(os.environ.get("FAKE_EMBED_TPM", "0"))
+FAKE_QUOTA_WINDOW = float(os.environ.get("FAKE_QUOTA_WINDOW", "60"))
+
+_TOKEN_RE = re.compile(r"\w+")
+_REQ_RE = re.compile(r"REQUIREMENT \(ID: ([^)]*)\): ([^\n]*)")
+_CONTEXT_RE = re.compile(r"CONTEXT SNIPPETS: ([^\n]*)")  # json.dumps output is one line
+_ROLES = ("clinician", "nurse", "patient", "administrator", "auditor")
+_PRIORITIES = ("Must", "Should", "Could")
+
+
+def _seed(*parts: Any) -> int:
+    h = hashlib.blake2b("\0".join(map(str, parts)).encode("utf-8"), digest_size=8)
+    return int.from_bytes(h.digest(), "little")
+
+
+@lru_cache(maxsize=1 << 18)
+def _feature_slot(feat: str, dim: int):
+    """(bucket, sign) of one hashed feature; vocabularies repeat, so this is memoized."""
+    h = _seed(feat)
+    return h % dim, 1.0 if (h >> 32) & 1 else -1.0
+
+
+def _check_backend(backend: str):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown model backend: {backend!r} (expected one of {BACKENDS})")
+
+
+# -------------------------------- Fake quota --------------------------------
+
+class FakeQuota:
+    """
+    Server-side quota as Vertex enforces it: at most requests_per_minute calls
+    and tokens_per_minute tokens in any sliding window of `window` seconds
+    (limits scaled to the window). A call over either limit is rejected with
+    ResourceExhausted and, as on the real API, does not count against the quota.
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 window: float = FAKE_QUOTA_WINDOW, clock=time.monotonic):
+        self.window = float(window)
+        self.max_requests = requests_per_minute * self.window / 60.0
+        self.max_tokens = tokens_per_minute * self.window / 60.0
+        self.rejected = 0
+        self._clock = clock
+        self._calls: deque = deque()  # (time, tokens) of accepted calls inside the window
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_requests > 0 or self.max_tokens > 0
+
+    def charge(self, tokens: int = 0):
+        if not self.enabled:
+            return
+        with self._lock:
+            now = self._clock()
+            while self._calls and self._calls[0][0] <= now - self.window:
+                self._tokens -= self._calls.popleft()[1]
+            if ((self.max_requests and len(self._calls) + 1 > self.max_requests)
+                    or (self.max_tokens and self._tokens + tokens > self.max_tokens)):
+                self.rejected += 1
+                raise ResourceExhausted("Fake quota exceeded (429)")
+            self._calls.append((now, tokens))
+            self._tokens += tokens
+
+
+# ------------------------------ Fake embeddings ------------------------------
+
+class HashingEmbeddings:
+    """
+    Deterministic embeddings: signed feature hashing of lowercased words and
+    word bigrams into `dim` buckets. Texts sharing terms get high cosine
+    similarity, which is enough for retrieval and dedupe to behave realistically.
+    """
+
+    def __init__(self, dim: int = FAKE_EMBED_DIM, model: str = "hashing-embedding", latency: float = FAKE_EMBED_LATENCY,
+                 quota: Optional[FakeQuota] = None):
+        self.dim = dim
+        self.model = model
+        self.latency = latency
+        self.quota = quota if quota is not None else FakeQuota(FAKE_EMBED_RPM, FAKE_EMBED_TPM)
+        self.calls = 0
+        self.texts = 0
+        self._lock = threading.Lock()
+
+    def _vector(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        words = _TOKEN_RE.findall(text.lower())
+        for feat in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            slot, sign = _feature_slot(feat, self.dim)
+            vec[slot] += sign
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def embed_documents(self, texts: List[str], **kwargs) -> List[List[float]]:
+        self.quota.charge(sum(estimate_tokens(t) for t in texts))
+        with self._lock:
+            self.calls += 1
+            self.texts += len(texts)
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._vector(t).tolist() for t in texts]
+
+    def embed_query(self, text: str, **kwargs) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.to_thread(self.embed_query, text)
+
+
+# --------------------------------- Fake LLM ---------------------------------
+
+class FakeLLM:
+    """
+    Offline stand-in for VertexAI: answers story-generation prompts with
+    UserStory JSON built from the requirement text, after a simulated latency.
+    Packed prompts (several REQUIREMENT blocks) get a JSON array carrying each
+    req_id. With probability failure_rate a call raises ConnectionError, which
+    the LLMScheduler treats as transient and retries; with probability
+    invalid_rate a story lacks acceptance_criteria and fails UserStory
+    validation. Calls over `quota` raise ResourceExhausted. astream() spreads the
+    latency over the chunks, so closing a stream early saves time like it
+    saves output tokens on a real model.
+    """
+
+    def __init__(self, model_name: str = "fake-llm", latency: float = FAKE_LLM_LATENCY,
+                 jitter: float = FAKE_LLM_JITTER, failure_rate: float = FAKE_LLM_FAILURE_RATE,
+                 invalid_rate: float = FAKE_LLM_INVALID_RATE, seed: int = 0,
+                 quota: Optional[FakeQuota] = None):
+        self.model_name = model_name
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.invalid_rate = invalid_rate
+        self.seed = seed
+        self.quota = quota if quota is not None else FakeQuota(FAKE_LLM_RPM, FAKE_LLM_TPM)
+        self.calls = 0
+        self.failures = 0
+        self._attempts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _draw(self, prompt: str) -> random.Random:
+        key = hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+        with self._lock:
+            self.calls += 1
+            attempt = self._attempts.get(key, 0)
+            self._attempts[key] = attempt + 1
+        return random.Random(_seed(self.seed, key, attempt))
+
+    def _delay(self, rng: random.Random) -> float:
+        return max(0.0, self.latency * (1 + self.jitter * rng.uniform(-1, 1)))
+
+    def _fail(self, rng: random.Random) -> bool:
+        if rng.random() < self.failure_rate:
+            with self._lock:
+                self.failures += 1
+            return True
+        return False
+
+    def _story(self, req_id: str, text: str, snippets: List[Dict[str, Any]], rng: random.Random) -> Dict[str, Any]:
+        words = _TOKEN_RE.findall(text)
+        capability = " ".join(words[:12]).lower() or "the described capability"
+        role = _ROLES[_seed(req_id) % len(_ROLES)]
+        citations = [{"page": int(s.get("page", 0) or 0), "snippet": str(s.get("snippet", ""))[:200]}
+                     for s in snippets[:2]]
+        story = {
+            "epic": "",
+            "story_id": "",
+            "user_story": f"As a {role}, I want {capability} so that requirement {req_id} is met.",
+            "acceptance_criteria": [{
+                "given": f"the {role} is authenticated",
+                "when": f"they use: {capability}",
+                "then": f"the system behaves as stated in {req_id}: {text[:160]}",
+            }],
+            "priority": rng.choice(_PRIORITIES),
+            "dependencies": [],
+            "non_functional": [],
+            "source_requirement_ids": [req_id],
+            "assumptions": [],
+            "open_questions": [],
+            "citations": citations,
+        }
+        if rng.random() < self.invalid_rate:
+            del story["acceptance_criteria"]
+        return story
+
+    def _answer(self, prompt: str, rng: random.Random) -> str:
+        reqs = _REQ_RE.findall(prompt)
+        contexts = []
+        for raw in _CONTEXT_RE.findall(prompt):
+            try:
+                contexts.append(json.loads(raw))
+            except json.JSONDecodeError:
+                contexts.append([])
+        if "JSON array" in prompt:  # packed prompt: one CONTEXT SNIPPETS line per requirement block
+            items = []
+            for i, (rid, text) in enumerate(reqs):
+                story = self._story(rid, text, contexts[i] if i < len(contexts) else [], rng)
+                items.append(dict(story, req_id=rid))
+            return json.dumps(items)
+        rid, text = reqs[-1] if reqs else ("", prompt[-200:])
+        return json.dumps(self._story(rid, text, contexts[-1] if contexts else [], rng))
+
+    async def ainvoke(self, prompt: str, **kwargs) -> str:
+        self.quota.charge(estimate_tokens(prompt))
+        rng = self._draw(prompt)
+        await asyncio.sleep(self._delay(rng))
+        if self._fail(rng):
+            raise ConnectionError("FakeLLM: simulated transient failure")
+        return self._answer(prompt, rng)
+
+    async def astream(self, prompt: str, **kwargs):
+        self.quota.charge(estimate_tokens(prompt))
+        rng = self._draw(prompt)
+        delay = self._delay(rng)
+        if self._fail(rng):
+            await asyncio.sleep(delay)
+            raise ConnectionError("FakeLLM: simulated transient failure")
+        answer = self._answer(prompt, rng)
+        step = max(1, FAKE_STREAM_CHUNK)
+        n_chunks = max(1, -(-len(answer) // step))
+        for i in range(0, len(answer), step):
+            await asyncio.sleep(delay / n_chunks)
+            yield answer[i:i + step]
+
+    def invoke(self, prompt: str, **kwargs) -> str:
+        self.quota.charge(estimate_tokens(prompt))
+        rng = self._draw(prompt)
+        time.sleep(self._delay(rng))
+        if self._fail(rng):
+            raise ConnectionError("FakeLLM: simulated transient failure")
+        return self._answer(prompt, rng)
+
+
+# --------------------------------- Factories ---------------------------------
+
+def make_llm(backend: str, model_name: str, project: Optional[str], location: str, **params) -> Any:
+    _check_backend(backend)
+    if backend == "fake":
+        return FakeLLM(model_name=model_name)
+    from langchain_google_vertexai import VertexAI
+    return VertexAI(model_name=model_name, project=project, location=location, **params)
+
+
+def make_embedder(backend: str, model: str, project: Optional[str], location: str) -> Any:
+    _check_backend(backend)
+    if backend == "fake":
+        return HashingEmbeddings(model=model)
+    from langchain_google_vertexai import VertexAIEmbeddings
+    return VertexAIEmbeddings(model=model, project=project, location=location)
+
+
+def is_completion_llm(llm: Any) -> bool:
+    """True for LangChain text-completion LLMs (VertexAI): their agenerate() returns token usage."""
+    try:
+        from langchain_core.language_models.llms import BaseLLM
+    except ImportError:
+        return False
+    return isinstance(llm, BaseLLM)
+
+
+def default_project(backend: str = DEFAULT_BACKEND) -> str:
+    """GCP project from the auth context; offline backends never touch BigQuery."""
+    _check_backend(backend)
+    if backend == "fake":
+        return os.environ.get("GOOGLE_CLOUD_PROJECT", "offline")
+    from google.cloud import bigquery
+    return bigquery.Client().project
@@ -0,0 +1,243 @@
+"""
+Sentence-aware RAG Chunking
+---------------------------
+Chunks normalized pages for the RAG index on sentence and bullet
+boundaries instead of fixed character windows, so no word or sentence is
+cut in half and fewer, denser chunks get embedded.
+
+On the way it drops:
+  - running headers/footers ("Page 3 of 40", document title): lines among
+    the first/last EDGE_LINES of a page that repeat at a page edge on many
+    pages; digits are masked in short lines before counting;
+  - table-of-contents rows ("Scope ........ 12");
+  - exact and near-duplicate chunks (same word shingles, Jaccard >= 0.9).
+
+A sentence left unfinished at the bottom of a page is completed with the
+first line of the next page (when that line continues it in lower case)
+and goes into a chunk of the page it started on, after the rest of that
+page has already been emitted.
+
+Config (env):
+  CHUNK_BOILERPLATE_MIN_PAGES   pages a line must repeat on to count as boilerplate (default: 3)
+"""
+
+import os
+import re
+import hashlib
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+BOILERPLATE_MIN_PAGES = int(os.environ.get("CHUNK_BOILERPLATE_MIN_PAGES", "3"))
+NEAR_DUP_JACCARD = 0.9
+EDGE_LINES = 3  # headers/footers live in the first/last few lines of a page
+MASK_DIGITS_MAX_CHARS = 40  # page counters, dates, revision stamps
+
+SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?;])\s+(?=[\"'(\[]?[A-Z0-9•\-*])")
+DIGITS_RE = re.compile(r"\d+")
+DOT_LEADER_RE = re.compile(r"(?:\.\s?){4,}\s*\d+\s*$")  # "Scope ........ 12"
+WORD_RE = re.compile(r"\w+")
+_SENTENCE_END = (".", "!", "?", ":", ";")
+
+
+def line_signature(line: str) -> str:
+    """
+    Whitespace/case-insensitive form of a line; short lines are digit-insensitive
+    too, so 'Page 3 of 40' == 'Page 4 of 40' but numbered requirements stay distinct.
+    """
+    sig = " ".join(line.lower().split())
+    return DIGITS_RE.sub("#", sig) if len(sig) <= MASK_DIGITS_MAX_CHARS else sig
+
+
+def _edge_lines(lines: List[str]) -> List[str]:
+    return lines if len(lines) <= 2 * EDGE_LINES else lines[:EDGE_LINES] + lines[-EDGE_LINES:]
+
+
+def find_boilerplate(pages: Iterable[Dict[str, Any]], min_pages: int = BOILERPLATE_MIN_PAGES) -> Set[str]:
+    """Signatures of page-edge lines that appear at a page edge on at least min_pages distinct pages."""
+    seen = Counter()
+    for p in pages:
+        lines = [l.strip() for l in p["text"].split("\n") if l.strip()]
+        seen.update({line_signature(l) for l in _edge_lines(lines)})
+    return {sig for sig, n in seen.items() if n >= max(2, min_pages)}
+
+
+def split_units(line: str, max_chars: int) -> List[str]:
+    """Sentences of one line; a sentence longer than max_chars is cut on word boundaries."""
+    units = []
+    for sent in SENTENCE_SPLIT_RE.split(line):
+        sent = sent.strip()
+        while len(sent) > max_chars:
+            cut = sent.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            units.append(sent[:cut])
+            sent = sent[cut:].strip()
+        if sent:
+            units.append(sent)
+    return units
+
+
+def _stable_hash(s: str) -> int:
+    """64-bit hash that, unlike hash(), is the same in every process (PYTHONHASHSEED)."""
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _shingles(text: str, n: int = 3) -> Set[int]:
+    words = WORD_RE.findall(text.lower())
+    if len(words) < n:
+        return {_stable_hash(" ".join(words))}
+    return {_stable_hash(" ".join(words[i:i + n])) for i in range(len(words) - n + 1)}
+
+
+class PageChunker:
+    """
+    Incremental sentence-aware chunker: feed() normalized pages in order, get
+    chunks back as soon as they are complete, then close() for the rest.
+    Pass the document's boilerplate signatures (find_boilerplate) when all
+    pages are known; without them (streaming) lines are learned as
+    boilerplate once they have been seen on min_pages pages.
+    """
+
+    def __init__(self, max_chars: int = 1500, overlap: int = 200,
+                 boilerplate: Optional[Set[str]] = None, min_pages: int = BOILERPLATE_MIN_PAGES):
+        self.max_chars = max_chars
+        self.overlap = overlap
+        self.boilerplate: Set[str] = set(boilerplate) if boilerplate is not None else set()
+        self._learn = boilerplate is None
+        self._min_pages = max(2, min_pages)
+        self._line_pages: Counter = Counter()
+        self._exact: Set[str] = set()
+        self._buckets: Dict[int, List[Set[int]]] = defaultdict(list)
+        self._page: Any = None
+        self._units: List[str] = []
+        self._size = 0
+        self._tail = ""  # unfinished last sentence of the previous page
+        self._tail_page: Any = None
+        self.dropped_lines = 0
+        self.dropped_chunks = 0
+
+    def _is_boilerplate(self, line: str, at_edge: bool) -> bool:
+        if DOT_LEADER_RE.search(line):
+            return True
+        return at_edge and line_signature(line) in self.boilerplate
+
+    def _learn_page(self, lines: List[str]):
+        for sig in {line_signature(l) for l in _edge_lines(lines)}:
+            self._line_pages[sig] += 1
+            if self._line_pages[sig] >= self._min_pages:
+                self.boilerplate.add(sig)
+
+    def _is_duplicate(self, text: str) -> bool:
+        """Exact (normalized) or near (shingle Jaccard) duplicate of an earlier chunk."""
+        key = hashlib.sha1(" ".join(WORD_RE.findall(text.lower())).encode("utf-8")).hexdigest()
+        if key in self._exact:
+            return True
+        self._exact.add(key)
+        sh = _shingles(text)
+        # Candidates share one of the 2 smallest shingle hashes (a bottom-k sketch)
+        sketch = sorted(sh)[:2]
+        for b in sketch:
+            for other in self._buckets[b]:
+                if len(sh & other) >= NEAR_DUP_JACCARD * len(sh | other):
+                    return True
+        for b in sketch:
+            self._buckets[b].append(sh)
+        return False
+
+    def _emit(self) -> Optional[Dict[str, Any]]:
+        """Close the current chunk; keep its last units (up to `overlap` chars) to start the next one."""
+        if not self._units:
+            return None
+        text = "\n".join(self._units)
+        page = self._page
+        keep: List[str] = []
+        size = 0
+        for u in reversed(self._units):
+            if size + len(u) > self.overlap:
+                break
+            keep.insert(0, u)
+            size += len(u) + 1
+        if len(keep) == len(self._units):
+            keep = []  # chunk too small to overlap with itself
+        self._units, self._size = keep, size if keep else 0
+        if self._is_duplicate(text):
+            self.dropped_chunks += 1
+            return None
+        return {"page": page, "text": text}
+
+    def _add(self, unit: str, page: Any) -> Optional[Dict[str, Any]]:
+        done = None
+        if self._units and self._size + len(unit) + 1 > self.max_chars:
+            done = self._emit()
+        if not self._units:
+            self._page = page
+        self._units.append(unit)
+        self._size += len(unit) + 1
+        return done
+
+    def _add_line(self, line: str, page: Any) -> Iterator[Dict[str, Any]]:
+        for unit in split_units(line, self.max_chars):
+            done = self._add(unit, page)
+            if done:
+                yield done
+
+    def _flush_page(self) -> Optional[Dict[str, Any]]:
+        done = self._emit()
+        self._units, self._size = [], 0
+        return done
+
+    def _flush_tail(self) -> Iterator[Dict[str, Any]]:
+        if self._tail:
+            yield from self._add_line(self._tail, self._tail_page)
+            self._tail = ""
+            done = self._flush_page()
+            if done:
+                yield done
+
+    def feed(self, page: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        lines = [l.strip() for l in page["text"].split("\n") if l.strip()]
+        if self._learn:
+            self._learn_page(lines)
+        body = []
+        n_lines = len(lines)
+        for n, line in enumerate(lines):
+            if self._is_boilerplate(line, n < EDGE_LINES or n >= n_lines - EDGE_LINES):
+                self.dropped_lines += 1
+            else:
+                body.append(line)
+
+        if self._tail and body and body[0][:1].islower():
+            # Sentence continues on this page: finish it in the previous page's open chunk
+            self._tail = f"{self._tail} {body.pop(0)}"
+        yield from self._flush_tail()
+
+        for n, line in enumerate(body):
+            if n == len(body) - 1 and not line.endswith(_SENTENCE_END):
+                # May continue on the next page: hold only this line. The open chunk goes out
+                # now, so streaming retrieval over this page never waits on the next one;
+                # its overlap units stay to lead the tail's chunk.
+                done = self._emit()
+                if done:
+                    yield done
+                self._tail, self._tail_page = line, page["page"]
+                return
+            yield from self._add_line(line, page["page"])
+        # Overlap never crosses pages: the page's last chunk is complete now
+        done = self._flush_page()
+        if done:
+            yield done
+
+    def close(self) -> Iterator[Dict[str, Any]]:
+        yield from self._flush_tail()
+
+
+def iter_sentence_chunks(pages: Iterable[Dict[str, Any]], max_chars: int = 1500, overlap: int = 200,
+                         boilerplate: Optional[Set[str]] = None) -> Iterator[Dict[str, Any]]:
+    chunker = PageChunker(max_chars=max_chars, overlap=overlap, boilerplate=boilerplate)
+    for p in pages:
+        yield from chunker.feed(p)
+    yield from chunker.close()
+
+
+def sentence_chunks(pages: List[Dict[str, Any]], max_chars: int = 1500, overlap: int = 200) -> List[Dict[str, Any]]:
+    """Sentence-aware, boilerplate-free, deduplicated chunks with page provenance."""
+    return list(iter_sentence_chunks(pages, max_chars, overlap, boilerplate=find_boilerplate(pages)))
@@ -26,7 +26,11 @@ import math
 import pandas as pd
 import numpy as np
 from typing import List, Dict, Any, Optional
-from langchain_google_vertexai import VertexAIEmbeddings
+from src.backends import DEFAULT_BACKEND, make_embedder
+from src.embedding_cache import CachedEmbeddings, DEFAULT_CACHE_DIR
+from src.rate_limiter import RateLimitedEmbeddings, embedding_limiter
+from src.instrumentation import span, timed, incr
+from src.usage import MeteredEmbeddings, attribute_to
 
 # ------------------------------- Controls & KB -------------------------------
 
@@ -123,7 +127,10 @@ class ComplianceRetriever:
     """
 
     def __init__(self, project_id: Optional[str] = None, location: str = "us-central1",
-                 embedding_model: str = "text-embedding-005", use_embeddings: bool = True):
+                 embedding_model: str = "text-embedding-005", use_embeddings: bool = True,
+                 embedding_cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+                 rate_limit: bool = True,
+                 backend: str = DEFAULT_BACKEND):
         self.use_embeddings = use_embeddings
         self.kb = COMPLIANCE_KB
         self.embedder = None
@@ -131,7 +138,16 @@ class ComplianceRetriever:
         self.kb_embs = None
         if use_embeddings:
             try:
-                self.embedder = VertexAIEmbeddings(model=embedding_model, project=project_id, location=location)
+                if backend == "fake":
+                    embedding_model = f"fake:{embedding_model}"  # own cache namespace
+                self.embedder = MeteredEmbeddings(make_embedder(backend, embedding_model, project_id, location))
+                if rate_limit:
+                    # Same per-model quota bucket as the story extractor
+                    self.embedder = RateLimitedEmbeddings(self.embedder, embedding_limiter(embedding_model))
+                if embedding_cache_dir:
+                    # COMPLIANCE_KB is static: after the first report its embeddings come from disk
+                    self.embedder = CachedEmbeddings(self.embedder, model_name=embedding_model,
+                                                     cache_dir=embedding_cache_dir)
                 self.kb_embs = self.embedder.embed_documents(self.kb_texts)
             except Exception as e:
                 print(f"⚠️ Embeddings disabled (fallback to keyword-only). Reason: {e}")
@@ -221,6 +237,7 @@ def compliance_gap(expected: List[str], detected: List[str]) -> (List[str], List
 
 # ------------------------------ Report Generator ------------------------------
 
+@timed("compliance.report")
 def build_compliance_report(
     stories_path: str = "stories.json",
     testcases_path: str = "testcases.csv",
@@ -229,6 +246,8 @@ def build_compliance_report(
     project_id: Optional[str] = None,
     location: str = "us-central1",
     use_embeddings: bool = True,
+    backend: str = DEFAULT_BACKEND,
+    rate_limit: bool = True,
 ) -> pd.DataFrame:
     """
     Generate Compliance Evidence Report:
@@ -241,7 +260,8 @@ def build_compliance_report(
         stories = json.load(f)
     tcs = pd.read_csv(testcases_path)
 
-    retriever = ComplianceRetriever(project_id=project_id, location=location, use_embeddings=use_embeddings)
+    retriever = ComplianceRetriever(project_id=project_id, location=location, use_embeddings=use_embeddings,
+                                    backend=backend, rate_limit=rate_limit)
 
     rows = []
     for s in stories:
@@ -256,7 +276,8 @@ def build_compliance_report(
         evidence = story_full_text(s, tcs)
 
         # RAG: retrieve likely clauses
-        top_clauses = retriever.retrieve(evidence, top_k=4)
+        with span("compliance.retrieve"), attribute_to(src_ids[:1]):
+            top_clauses = retriever.retrieve(evidence, top_k=4)
         expected_controls = expected_controls_from_clauses(top_clauses)
 
         # Detected controls from actual text
@@ -301,4 +322,6 @@ def build_compliance_report(
     total = len(df)
     with_gaps = int((df["Missing Controls"].str.len() > 0).sum())
     print(f"   Stories analyzed: {total} | Stories with missing controls: {with_gaps}")
+    incr("compliance.stories", total)
+    incr("compliance.stories_with_gaps", with_gaps)
     return df
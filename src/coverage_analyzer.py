@@ -4,6 +4,8 @@ import numpy as np
 from typing import List, Dict, Any
 from pathlib import Path
 
+from src.instrumentation import timed, incr
+
 class CoverageAnalyzer:
     """
     Analyzes and reports on requirement, story, and test case coverage.
@@ -20,6 +22,7 @@ class CoverageAnalyzer:
         self.matrix = None
         self.epic_rollup = None
 
+    @timed("coverage.load")
     def _load_data(self):
         """Loads and initializes data from JSON and CSV files."""
         try:
@@ -61,6 +64,7 @@ class CoverageAnalyzer:
         
         self.df_stories["Citations"] = self.df_stories["citations"].apply(format_citations)
 
+    @timed("coverage.matrix")
     def _create_coverage_matrix(self):
         """Generates the main coverage matrix."""
         # Explode stories by requirement ID, creating a row for each requirement
@@ -93,6 +97,8 @@ class CoverageAnalyzer:
             "⚠️ No stories"
         ]
         self.matrix["Coverage Status"] = np.select(conditions, choices, default="❌ Missing everything")
+        uncovered = self.matrix.loc[self.matrix["Story Id"].isna(), "Requirement ID"].nunique()
+        incr("coverage.requirements_without_stories", int(uncovered))
 
     def _create_epic_rollup(self):
         """Calculates epic-level coverage metrics."""
@@ -108,6 +114,7 @@ class CoverageAnalyzer:
         self.epic_rollup["% Story Coverage"] = (self.epic_rollup["with_stories"] / self.epic_rollup["total_reqs"] * 100).round(1)
         self.epic_rollup["% Test Coverage"] = (self.epic_rollup["with_tests"] / self.epic_rollup["total_reqs"] * 100).round(1)
 
+    @timed("coverage.analysis")
     def run_analysis(self, coverage_output: str = "coverage_matrix.csv", epic_output: str = "epic_coverage.csv"):
         """
         Runs the full coverage analysis and saves the reports.
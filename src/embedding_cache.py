@@ -0,0 +1,264 @@
+"""
+Persistent Embedding Cache
+--------------------------
+Content-addressed, disk-backed cache in front of an embeddings client
+(VertexAIEmbeddings or anything with the same embed_* methods).
+
+Layout (one directory per embedding model):
+  <cache_dir>/<model>/vectors.sqlite   key -> float32 vector blob + last access time
+
+Keys are sha256(model, task type, text), so unchanged texts are never
+re-embedded across runs. Size is bounded by max_entries with LRU eviction.
+Every wrapper on the same directory in a process shares one store, and
+separate processes can use the same directory concurrently.
+
+Config (env):
+  EMBED_CACHE_DIR          cache root (default: .cache/embeddings)
+  EMBED_CACHE_MAX_ENTRIES  max cached vectors per model (default: 200000)
+"""
+
+import os
+import re
+import time
+import atexit
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from typing import List, Dict, Any, Optional
+
+from src.instrumentation import incr
+
+DEFAULT_CACHE_DIR = os.environ.get("EMBED_CACHE_DIR", os.path.join(".cache", "embeddings"))
+DEFAULT_MAX_ENTRIES = int(os.environ.get("EMBED_CACHE_MAX_ENTRIES", "200000"))
+
+_SAFE = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+def _model_name(embedder: Any) -> str:
+    for attr in ("model_name", "model"):
+        val = getattr(embedder, attr, None)
+        if isinstance(val, str) and val:
+            return val
+    return type(embedder).__name__
+
+
+def text_key(model: str, text: str, task_type: str = "") -> str:
+    h = hashlib.sha256()
+    h.update(model.encode("utf-8"))
+    h.update(b"\0")
+    h.update(task_type.encode("utf-8"))
+    h.update(b"\0")
+    h.update(text.encode("utf-8"))
+    return h.hexdigest()
+
+
+class EmbeddingStore:
+    """
+    LRU-bounded key -> vector store in one SQLite file. Thread-safe, and safe
+    to share between processes (SQLite's file locking serializes writers;
+    INSERT OR IGNORE on the key means no entry is lost or written twice).
+
+    Lookups never write: access times are buffered in memory and persisted
+    with the next write, every TOUCH_FLUSH lookups, or on close(). The entry
+    count is tracked incrementally, so eviction only queries the table once
+    the store may be over max_entries.
+    """
+
+    TOUCH_FLUSH = 512
+    _CHUNK = 500  # keys per IN (...) query, below SQLite's variable limit
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.db_path = os.path.join(path, "vectors.sqlite")
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(path, exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            " key TEXT PRIMARY KEY, vec BLOB NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS vectors_accessed ON vectors(accessed)")
+        self._db.commit()
+        row = self._db.execute("SELECT length(vec) FROM vectors LIMIT 1").fetchone()
+        self._dim: Optional[int] = row[0] // 4 if row else None
+        self._count = self._db.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+    # ---------------------------- persistence ----------------------------
+    def _write_touched(self):
+        if self._touched:
+            self._db.executemany("UPDATE vectors SET accessed = ? WHERE key = ?",
+                                 [(t, k) for k, t in self._touched.items()])
+            self._touched = {}
+
+    def _evict(self):
+        self._count = self._db.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+        overflow = self._count - self.max_entries
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM vectors WHERE key IN "
+                "(SELECT key FROM vectors ORDER BY accessed ASC LIMIT ?)",
+                (overflow,),
+            )
+            self.evictions += overflow
+            self._count -= overflow
+
+    def flush(self):
+        """Persist buffered access times and enforce max_entries."""
+        with self._lock:
+            self._write_touched()
+            self._evict()
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is None:
+                return
+            self._write_touched()
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    # ------------------------------ access ------------------------------
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        out = {}
+        now = time.time()
+        with self._lock:
+            uniq = list(dict.fromkeys(keys))
+            for i in range(0, len(uniq), self._CHUNK):
+                part = uniq[i:i + self._CHUNK]
+                rows = self._db.execute(
+                    f"SELECT key, vec FROM vectors WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for k, blob in rows:
+                    out[k] = np.frombuffer(blob, dtype=np.float32).copy()
+                    self._touched[k] = now
+            if len(self._touched) >= self.TOUCH_FLUSH:
+                self._write_touched()
+                self._db.commit()
+        return out
+
+    def put_many(self, items: Dict[str, Any]):
+        if not items:
+            return
+        vecs = {k: np.asarray(v, dtype=np.float32) for k, v in items.items()}
+        dim = len(next(iter(vecs.values())))
+        now = time.time()
+        with self._lock:
+            if self._dim is None:
+                self._dim = dim
+            elif self._dim != dim:
+                raise ValueError(f"Embedding dim changed ({self._dim} -> {dim}); clear {self.path}")
+            before = self._db.total_changes
+            self._db.executemany(
+                "INSERT OR IGNORE INTO vectors (key, vec, accessed) VALUES (?, ?, ?)",
+                [(k, v.tobytes(), now) for k, v in vecs.items()],
+            )
+            self._count += self._db.total_changes - before
+            self._write_touched()
+            if self._count > self.max_entries:
+                self._evict()
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+# One store per cache directory per process: the extractor and the compliance
+# retriever embed with the same model, so they share a connection and counters.
+_STORES: Dict[str, EmbeddingStore] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def open_store(path: str, max_entries: int = DEFAULT_MAX_ENTRIES) -> EmbeddingStore:
+    """Process-wide EmbeddingStore for `path` (created on first use, closed at exit)."""
+    key = os.path.abspath(path)
+    with _STORES_LOCK:
+        store = _STORES.get(key)
+        if store is None or store._db is None:
+            store = _STORES[key] = EmbeddingStore(path, max_entries=max_entries)
+        else:
+            store.max_entries = max(store.max_entries, int(max_entries))
+        return store
+
+
+@atexit.register
+def _close_stores():
+    with _STORES_LOCK:
+        for store in _STORES.values():
+            store.close()
+        _STORES.clear()
+
+
+class CachedEmbeddings:
+    """
+    Drop-in wrapper for VertexAIEmbeddings that serves repeated texts from
+    an EmbeddingStore. Only cache misses reach the wrapped embedder.
+    """
+
+    def __init__(self, embedder: Any, model_name: Optional[str] = None,
+                 cache_dir: str = DEFAULT_CACHE_DIR, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.embedder = embedder
+        self.model_name = model_name or _model_name(embedder)
+        self.store = open_store(os.path.join(cache_dir, _SAFE.sub("_", self.model_name)), max_entries=max_entries)
+
+    def __getattr__(self, name):
+        # Anything we don't wrap goes straight to the underlying client
+        return getattr(self.__dict__["embedder"], name)
+
+    @property
+    def hits(self) -> int:
+        return self.store.hits
+
+    @property
+    def misses(self) -> int:
+        return self.store.misses
+
+    def stats(self) -> Dict[str, int]:
+        return self.store.stats()
+
+    def _embed(self, texts: List[str], task_type: str, call, **kwargs) -> List[List[float]]:
+        if not texts:
+            return []
+        keys = [text_key(self.model_name, t, task_type) for t in texts]
+        found = self.store.get_many(keys)
+        missing: Dict[str, str] = {}
+        for k, t in zip(keys, texts):
+            if k not in found and k not in missing:
+                missing[k] = t
+        hits = len(texts) - sum(1 for k in keys if k in missing)
+        self.store.hits += hits
+        self.store.misses += len(missing)
+        incr("embedding_cache.hits", hits)
+        incr("embedding_cache.misses", len(missing))
+        if missing:
+            fresh = call(list(missing.values()), **kwargs)
+            new = dict(zip(missing.keys(), fresh))
+            self.store.put_many(new)
+            found.update({k: np.asarray(v, dtype=np.float32) for k, v in new.items()})
+        return [found[k].tolist() for k in keys]
+
+    def embed_documents(self, texts: List[str], **kwargs) -> List[List[float]]:
+        task = kwargs.get("embeddings_task_type", "RETRIEVAL_DOCUMENT")
+        return self._embed(list(texts), task, self.embedder.embed_documents, **kwargs)
+
+    def embed_query(self, text: str, **kwargs) -> List[float]:
+        task = kwargs.get("embeddings_task_type", "RETRIEVAL_QUERY")
+        return self._embed([text], task, lambda ts, **kw: [self.embedder.embed_query(ts[0], **kw)], **kwargs)[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.to_thread(self.embed_query, text)
@@ -0,0 +1,156 @@
+"""
+Pipeline instrumentation
+------------------------
+Lightweight, dependency-free timings and counters for a pipeline run:
+
+  spans       span("stage") context manager / @timed("stage") decorator (sync
+              or async); per name: count, total and max seconds
+  counters    incr("llm.calls"), incr("llm.prompt_tokens", n), ...
+  histograms  observe("llm.latency_s", seconds); reported as count/mean/p50/p90/p99/max
+
+Everything records into one process-wide registry (METRICS), so components
+need no extra wiring; reset() it at the start of a run and write_report()
+at the end for a machine-readable JSON next to the other outputs.
+
+Config (env):
+  METRICS_ENABLED   "false" turns every call into a no-op (default: true)
+"""
+
+import os
+import json
+import time
+import threading
+import functools
+import asyncio
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() in {"1", "true", "yes"}
+HISTOGRAM_MAX_SAMPLES = 100_000  # per histogram; later samples only update count/sum/max
+
+
+def _percentile(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    k = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[k]
+
+
+class Metrics:
+    """Thread-safe registry of spans, counters and histograms for one run."""
+
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self._t0 = time.perf_counter()
+            self.spans: Dict[str, Dict[str, float]] = defaultdict(lambda: {"count": 0, "seconds": 0.0, "max_s": 0.0})
+            self.counters: Dict[str, float] = defaultdict(int)
+            self._hist: Dict[str, Dict[str, Any]] = {}
+
+    # ------------------------------ recording ------------------------------
+
+    def incr(self, name: str, value: float = 1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += value
+
+    def observe(self, name: str, value: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            h = self._hist.setdefault(name, {"count": 0, "sum": 0.0, "max": float("-inf"), "samples": []})
+            h["count"] += 1
+            h["sum"] += value
+            h["max"] = max(h["max"], value)
+            if len(h["samples"]) < HISTOGRAM_MAX_SAMPLES:
+                h["samples"].append(value)
+
+    def add_span(self, name: str, seconds: float):
+        if self.enabled:
+            with self._lock:
+                s = self.spans[name]
+                s["count"] += 1
+                s["seconds"] += seconds
+                s["max_s"] = max(s["max_s"], seconds)
+
+    @contextmanager
+    def span(self, name: str):
+        """Time the enclosed block under `name` (recorded even if it raises)."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, time.perf_counter() - t0)
+
+    def timed(self, name: Optional[str] = None) -> Callable:
+        """Decorator: time every call of a function or coroutine function (default name: its qualname)."""
+        def deco(fn):
+            label = name or fn.__qualname__
+            if asyncio.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def awrapper(*args, **kwargs):
+                    with self.span(label):
+                        return await fn(*args, **kwargs)
+                return awrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(label):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return deco
+
+    # ------------------------------ reporting ------------------------------
+
+    def histograms(self) -> Dict[str, Dict[str, float]]:
+        out = {}
+        with self._lock:
+            hists = {k: dict(v, samples=sorted(v["samples"])) for k, v in self._hist.items()}
+        for name, h in hists.items():
+            vals = h["samples"]
+            out[name] = {
+                "count": h["count"],
+                "mean": round(h["sum"] / h["count"], 6) if h["count"] else 0.0,
+                "p50": round(_percentile(vals, 0.50), 6),
+                "p90": round(_percentile(vals, 0.90), 6),
+                "p99": round(_percentile(vals, 0.99), 6),
+                "max": round(h["max"], 6),
+            }
+        return out
+
+    def report(self, **extra) -> Dict[str, Any]:
+        with self._lock:
+            spans = {k: {"count": int(v["count"]), "seconds": round(v["seconds"], 6), "max_s": round(v["max_s"], 6)}
+                     for k, v in self.spans.items()}
+            counters = {k: (round(v, 6) if isinstance(v, float) else v) for k, v in sorted(self.counters.items())}
+        report = {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "wall_seconds": round(time.perf_counter() - self._t0, 6),
+            "spans": spans,
+            "counters": counters,
+            "histograms": self.histograms(),
+        }
+        report.update(extra)
+        return report
+
+    def write_report(self, path: str, **extra) -> str:
+        """Write report() (plus any extra top-level fields) as JSON."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(**extra), f, indent=2, ensure_ascii=False)
+        print(f"📈 Run report: {path}")
+        return path
+
+
+# Process-wide registry and shortcuts
+METRICS = Metrics()
+span = METRICS.span
+timed = METRICS.timed
+incr = METRICS.incr
+observe = METRICS.observe
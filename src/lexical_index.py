@@ -0,0 +1,139 @@
+"""
+Lexical (BM25) Chunk Index
+--------------------------
+In-memory inverted index over RAG chunks. Requirement text and the chunks
+that contain it share exact domain terms (e.g. "e-signature", "audit trail",
+"21 CFR"), so BM25 finds the right context locally, with no embedding call.
+
+Besides scores, a query reports idf coverage: the share of the query's idf
+mass present in each chunk. A top hit with high coverage is a confident
+lexical match, so hybrid retrieval can skip the dense lookup for it.
+
+Config (env):
+  LEXICAL_CONFIDENCE   coverage at which hybrid mode skips query embedding (default: 0.8)
+"""
+
+import os
+import re
+import math
+import threading
+import numpy as np
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+LEXICAL_CONFIDENCE = float(os.environ.get("LEXICAL_CONFIDENCE", "0.8"))
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-.][a-z0-9]+)*")
+STOPWORDS = {
+    "the", "a", "an", "and", "or", "of", "to", "in", "on", "for", "with", "by", "be", "is", "are",
+    "as", "at", "from", "that", "this", "it", "its", "shall", "should", "must", "will", "can", "may",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25View:
+    """
+    BM25 state as of one freeze: the first n documents. Safe to query from any
+    thread while the index keeps growing, since postings only ever get longer
+    and doc ids are ascending, so each term is cut back to ids < n.
+    """
+
+    def __init__(self, postings: Dict[str, Tuple[np.ndarray, np.ndarray]], norm: np.ndarray, k1: float):
+        self._postings = postings
+        self._norm = norm
+        self.k1 = k1
+        self.n = len(norm)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def scores(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(bm25 score per doc, idf coverage per doc in [0, 1]) for one query."""
+        n = self.n
+        scores = np.zeros(n, dtype=np.float32)
+        covered = np.zeros(n, dtype=np.float32)
+        total_idf = 0.0
+        unseen_idf = math.log(1 + (n + 0.5) / 0.5)
+        for term in set(tokenize(query)):
+            hit = self._postings.get(term)
+            df = int(np.searchsorted(hit[0], n)) if hit is not None else 0
+            if df == 0:
+                total_idf += unseen_idf  # no chunk has it: counts against every chunk's coverage
+                continue
+            ids, tfs = hit[0][:df], hit[1][:df]
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + self._norm[ids])
+            covered[ids] += idf
+            total_idf += idf
+        if total_idf > 0:
+            covered /= total_idf
+        return scores, covered
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a growing list of documents (chunk texts).
+    add() buffers new postings; the next query folds only the touched terms
+    into their numpy arrays and publishes a BM25View, so queries cost one
+    vectorized scatter-add per query term. add() and snapshot() are
+    thread-safe: streaming appends on the event loop while retrieval
+    queries run in worker threads.
+    """
+
+    def __init__(self, texts: Iterable[str] = (), k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._pending: Dict[str, Tuple[List[int], List[int]]] = {}
+        self._lengths: List[int] = []
+        self._view: Optional[BM25View] = None
+        self.add(texts)
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, texts: Iterable[str]):
+        docs = [Counter(tokenize(t)) for t in texts]  # tokenize outside the lock
+        if not docs:
+            return
+        with self._lock:
+            for tf in docs:
+                doc = len(self._lengths)
+                self._lengths.append(sum(tf.values()))
+                for term, n in tf.items():
+                    ids, tfs = self._pending.setdefault(term, ([], []))
+                    ids.append(doc)
+                    tfs.append(n)
+            self._view = None
+
+    def _freeze(self) -> BM25View:
+        """Fold pending postings into their term arrays (touched terms only); caller holds the lock."""
+        for term, (ids, tfs) in self._pending.items():
+            new_ids = np.asarray(ids, dtype=np.int32)
+            new_tfs = np.asarray(tfs, dtype=np.float32)
+            old = self._postings.get(term)
+            if old is not None:
+                new_ids, new_tfs = np.concatenate([old[0], new_ids]), np.concatenate([old[1], new_tfs])
+            self._postings[term] = (new_ids, new_tfs)  # one atomic swap per term; views cut it at their n
+        self._pending = {}
+        lengths = np.asarray(self._lengths, dtype=np.float32)
+        avg = float(lengths.mean()) if len(lengths) else 1.0
+        norm = self.k1 * (1 - self.b + self.b * lengths / max(avg, 1e-9))
+        return BM25View(self._postings, norm, self.k1)
+
+    def snapshot(self) -> BM25View:
+        view = self._view
+        if view is None:
+            with self._lock:
+                if self._view is None:
+                    self._view = self._freeze()
+                view = self._view
+        return view
+
+    def scores(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(bm25 score per doc, idf coverage per doc in [0, 1]) for one query."""
+        return self.snapshot().scores(query)
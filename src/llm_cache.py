@@ -0,0 +1,146 @@
+"""
+LLM Response Cache
+------------------
+On-disk cache of raw LLM responses, keyed by sha256 of the model name,
+generation parameters and the full prompt. Re-running extraction on the
+same SRS (e.g. while iterating on test generation, compliance or coverage)
+then skips every Gemini call whose prompt did not change.
+
+Backed by a single SQLite file (stdlib, safe across threads), with
+TTL expiry and LRU eviction down to max_entries. Lookups only read: access
+times are buffered and written in batches, and expiry/eviction run once the
+tracked size passes max_entries or every EVICT_EVERY writes. Async code uses
+aget()/aput(), which run the SQLite I/O in a worker thread.
+
+Config (env):
+  LLM_CACHE_DIR          cache root (default: .cache/llm)
+  LLM_CACHE_TTL_HOURS    entry lifetime (default: 168 = one week; 0 = never expire)
+  LLM_CACHE_MAX_ENTRIES  max cached responses (default: 50000)
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import asyncio
+import threading
+from typing import Any, Dict, Optional
+
+from src.instrumentation import incr
+
+DEFAULT_LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", os.path.join(".cache", "llm"))
+DEFAULT_TTL_SECONDS = float(os.environ.get("LLM_CACHE_TTL_HOURS", "168")) * 3600
+DEFAULT_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "50000"))
+
+
+def prompt_key(model: str, params: Dict[str, Any], prompt: str) -> str:
+    payload = json.dumps({"model": model, "params": params, "prompt": prompt}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Persistent prompt -> raw response store with TTL and size-based (LRU) eviction."""
+
+    TOUCH_FLUSH = 256   # buffered access times written per batch
+    EVICT_EVERY = 1000  # writes between TTL purges
+
+    def __init__(self, cache_dir: str = DEFAULT_LLM_CACHE_DIR, ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "responses.sqlite")
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, int(max_entries))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}
+        self._writes = 0
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, response TEXT NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+        self._db.commit()
+        self._evict(time.time())
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl_seconds and now - row[1] > self.ttl_seconds):
+                # expired rows are left to the next purge
+                self.misses += 1
+                incr("llm_cache.misses")
+                return None
+            self._touched[key] = now
+            if len(self._touched) >= self.TOUCH_FLUSH:
+                self._write_touched()
+                self._db.commit()
+            self.hits += 1
+            incr("llm_cache.hits")
+            return row[0]
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        with self._lock:
+            before = self._db.total_changes
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self._count += self._db.total_changes - before  # replaces count too; _evict() recounts
+            self._touched.pop(key, None)
+            self._writes += 1
+            self._write_touched()
+            if self._count > self.max_entries or self._writes >= self.EVICT_EVERY:
+                self._evict(now)
+            self._db.commit()
+
+    async def aget(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, response: str):
+        await asyncio.to_thread(self.put, key, response)
+
+    def _write_touched(self):
+        if self._touched:
+            self._db.executemany("UPDATE responses SET accessed = ? WHERE key = ?",
+                                 [(t, k) for k, t in self._touched.items()])
+            self._touched = {}
+
+    def _evict(self, now: float):
+        self._writes = 0
+        if self.ttl_seconds:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+        (count,) = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count > self.max_entries:
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY accessed ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            count = self.max_entries
+        self._count = count
+
+    def flush(self):
+        """Write buffered access times."""
+        with self._lock:
+            self._write_touched()
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self), "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._write_touched()
+            self._db.commit()
+            self._db.close()
@@ -0,0 +1,192 @@
+"""
+Bounded-concurrency LLM scheduler
+---------------------------------
+Keeps up to N `llm.ainvoke` calls in flight (semaphore), applies a timeout to
+each request, retries transient failures with jittered exponential backoff,
+and hands results back as they complete.
+
+A failed request never raises out of the scheduler: its final exception is
+returned in place of the response (same contract as
+`asyncio.gather(..., return_exceptions=True)`), so callers can keep
+treating it as an empty/invalid generation.
+
+Streaming: invoke(prompt, consumer_factory=...) uses `llm.astream` instead
+and feeds every chunk to a fresh consumer per attempt; when the consumer
+returns False the stream is closed early (the rest of the output is never
+generated) and the text received so far is returned.
+
+Every answered attempt is recorded in a UsageLedger (prompt/completion
+tokens from the response's usage metadata, estimated when there is none,
+e.g. for streamed or plain-text answers).
+"""
+
+import time
+import random
+import asyncio
+from typing import Any, AsyncIterator, Callable, List, Optional, Tuple
+
+from src.rate_limiter import QuotaLimiter, estimate_tokens, DEFAULT_OUTPUT_TOKENS
+from src.instrumentation import incr, observe
+from src.usage import USAGE, UsageLedger, usage_from_metadata
+from src.backends import ResourceExhausted, is_completion_llm
+
+# Errors worth another attempt (quota, overload, network, timeouts).
+# ResourceExhausted is the Google class when installed, else the stand-in the fake backend raises.
+TRANSIENT_ERRORS: Tuple[type, ...] = (
+    asyncio.TimeoutError,
+    TimeoutError,
+    ConnectionError,
+    ResourceExhausted,
+)
+try:
+    from google.api_core import exceptions as gexc
+except ImportError:  # offline installs without the Google client libraries
+    pass
+else:
+    TRANSIENT_ERRORS += (
+        gexc.TooManyRequests,
+        gexc.ServiceUnavailable,
+        gexc.DeadlineExceeded,
+        gexc.InternalServerError,
+        gexc.Aborted,
+    )
+
+
+class LLMScheduler:
+    """
+    Shared scheduler for one LLM client. The semaphore is per instance, so
+    every caller sharing the scheduler shares the same in-flight budget.
+    With a QuotaLimiter, each attempt also reserves request/token quota first.
+    """
+
+    def __init__(self, llm, max_concurrency: int = 8, timeout: float = 60.0, retries: int = 2,
+                 backoff_base: float = 1.0, backoff_max: float = 30.0,
+                 limiter: Optional[QuotaLimiter] = None, output_tokens: int = DEFAULT_OUTPUT_TOKENS,
+                 usage: Optional[UsageLedger] = None):
+        self.llm = llm
+        self.usage = usage if usage is not None else USAGE
+        self._completion_llm = is_completion_llm(llm)
+        self.limiter = limiter
+        self.output_tokens = output_tokens
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.timeout = timeout
+        self.retries = max(0, int(retries))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._sem = None
+        self._sem_loop = None
+        # counters
+        self.calls = 0
+        self.retried = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.aborted = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # One semaphore per event loop (Streamlit re-runs use a fresh asyncio.run)
+        loop = asyncio.get_running_loop()
+        if self._sem is None or self._sem_loop is not loop:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+            self._sem_loop = loop
+        return self._sem
+
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _complete(self, prompt: str) -> Tuple[Any, Optional[Tuple[int, int]]]:
+        """(response, reported (prompt, completion) tokens or None)."""
+        if self._completion_llm:
+            # agenerate keeps the generation info (incl. usage_metadata) that ainvoke drops
+            result = await self.llm.agenerate([prompt])
+            gen = result.generations[0][0]
+            return gen.text, usage_from_metadata(gen.generation_info)
+        resp = await self.llm.ainvoke(prompt)
+        meta = getattr(resp, "usage_metadata", None) or getattr(resp, "response_metadata", None)
+        return resp, usage_from_metadata(meta)
+
+    def _record_usage(self, prompt: str, resp: Any, tokens: Optional[Tuple[int, int]], seconds: float):
+        estimated = tokens is None
+        if estimated:
+            text = resp if isinstance(resp, str) else str(getattr(resp, "content", resp))
+            tokens = (estimate_tokens(prompt), estimate_tokens(text))
+        incr("llm.prompt_tokens", tokens[0])
+        incr("llm.completion_tokens", tokens[1])
+        self.usage.record_llm(tokens[0], tokens[1], seconds=seconds, estimated=estimated)
+
+    async def _stream(self, prompt: str, consume: Callable[[str], bool]) -> Tuple[str, None]:
+        """Stream one response into `consume`; stop as soon as it returns False."""
+        parts: List[str] = []
+        stream = self.llm.astream(prompt)
+        try:
+            async for chunk in stream:
+                text = chunk if isinstance(chunk, str) else getattr(chunk, "content", str(chunk))
+                parts.append(text)
+                if consume(text) is False:
+                    self.aborted += 1
+                    incr("llm.aborted")
+                    break
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        return "".join(parts), None
+
+    async def invoke(self, prompt: str, consumer_factory: Optional[Callable[[], Callable[[str], bool]]] = None) -> Any:
+        """
+        One request with per-request timeout and retries; returns the response or the last exception.
+        With consumer_factory, the response is streamed into consumer_factory() (a new consumer per attempt).
+        """
+        last_exc: BaseException = RuntimeError("LLM request not attempted")
+        for attempt in range(self.retries + 1):
+            if self.limiter is not None:
+                # wait for quota before taking a slot, so waiting calls don't block ready ones
+                await self.limiter.acquire(tokens=estimate_tokens(prompt) + self.output_tokens)
+            async with self._semaphore():
+                self.calls += 1
+                incr("llm.calls")
+                t0 = time.perf_counter()
+                try:
+                    if consumer_factory is not None:
+                        call = self._stream(prompt, consumer_factory())
+                    else:
+                        call = self._complete(prompt)
+                    resp, tokens = await asyncio.wait_for(call, timeout=self.timeout)
+                    seconds = time.perf_counter() - t0
+                    observe("llm.latency_s", seconds)
+                    self._record_usage(prompt, resp, tokens, seconds)
+                    return resp
+                except TRANSIENT_ERRORS as e:
+                    last_exc = e
+                    if isinstance(e, (asyncio.TimeoutError, TimeoutError)):
+                        self.timeouts += 1
+                        incr("llm.timeouts")
+                except Exception as e:  # not retryable (bad request, auth, ...)
+                    self.failures += 1
+                    incr("llm.failures")
+                    return e
+            if attempt < self.retries:
+                self.retried += 1
+                incr("llm.retries")
+                await asyncio.sleep(self._backoff(attempt))  # sleep without holding a slot
+        self.failures += 1
+        incr("llm.failures")
+        return last_exc
+
+    async def _indexed(self, idx: int, prompt: str) -> Tuple[int, Any]:
+        return idx, await self.invoke(prompt)
+
+    async def as_completed(self, prompts: List[str]) -> AsyncIterator[Tuple[int, Any]]:
+        """Yield (prompt_index, response_or_exception) in completion order."""
+        tasks = [asyncio.ensure_future(self._indexed(i, p)) for i, p in enumerate(prompts)]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                yield await fut
+        finally:
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+
+    async def map(self, prompts: List[str]) -> List[Any]:
+        """All responses, in prompt order."""
+        return await asyncio.gather(*(self.invoke(p) for p in prompts))
@@ -0,0 +1,96 @@
+"""
+Persistent RAG Index
+--------------------
+On-disk retriever index per document, so re-running extraction on the same
+upload (e.g. a Streamlit re-run) reopens the chunk index instead of
+re-chunking and re-embedding it.
+
+Layout (one directory per index key):
+  <index_dir>/<key>/embeddings.npy   pre-normalized float32 matrix, memory-mapped on open
+  <index_dir>/<key>/chunks.json      [[page, text], ...] in matrix row order
+
+The key is sha256 of the embedding model, the chunking parameters and the
+document content hash, so a changed document, chunker or model gets a new index.
+Least recently opened indexes are pruned beyond max_indexes.
+
+Config (env):
+  RAG_INDEX_DIR         index root (default: .cache/rag)
+  RAG_INDEX_MAX_DOCS    max indexes kept (default: 64)
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_RAG_INDEX_DIR = os.environ.get("RAG_INDEX_DIR", os.path.join(".cache", "rag"))
+DEFAULT_MAX_INDEXES = int(os.environ.get("RAG_INDEX_MAX_DOCS", "64"))
+
+
+def index_key(model: str, doc_hash: str, params: Dict[str, Any]) -> str:
+    payload = json.dumps({"model": model, "doc": doc_hash, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:40]
+
+
+class RagIndexStore:
+    """Saves and reopens (chunks, normalized embedding matrix) pairs by index key."""
+
+    def __init__(self, index_dir: str = DEFAULT_RAG_INDEX_DIR, max_indexes: int = DEFAULT_MAX_INDEXES):
+        self.index_dir = index_dir
+        self.max_indexes = max(1, int(max_indexes))
+        self._lock = threading.Lock()
+        os.makedirs(index_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.index_dir, key)
+
+    def load(self, key: str) -> Optional[Tuple[List[Dict[str, Any]], np.ndarray]]:
+        """(chunks, read-only memmapped matrix), or None if the key is not indexed."""
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, "chunks.json"), "r", encoding="utf-8") as f:
+                rows = json.load(f)
+            matrix = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"⚠️ RAG index {key} unreadable, rebuilding. Reason: {e}")
+            return None
+        if matrix.ndim != 2 or matrix.shape[0] != len(rows):
+            print(f"⚠️ RAG index {key} inconsistent, rebuilding.")
+            return None
+        os.utime(path)  # LRU by last open
+        return [{"page": page, "text": text} for page, text in rows], matrix
+
+    def save(self, key: str, chunks: List[Dict[str, Any]], matrix: np.ndarray):
+        """Write the index atomically (tmp dir + rename), then prune old indexes."""
+        path = self._path(key)
+        tmp = f"{path}.tmp{os.getpid()}_{threading.get_ident()}"
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            np.save(os.path.join(tmp, "embeddings.npy"), np.ascontiguousarray(matrix, dtype=np.float32))
+            with open(os.path.join(tmp, "chunks.json"), "w", encoding="utf-8") as f:
+                json.dump([[c["page"], c["text"]] for c in chunks], f, ensure_ascii=False)
+            with self._lock:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                os.replace(tmp, path)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self._prune()
+
+    def _prune(self):
+        with self._lock:
+            entries = [os.path.join(self.index_dir, d) for d in os.listdir(self.index_dir) if ".tmp" not in d]
+            entries = [p for p in entries if os.path.isdir(p)]
+            if len(entries) <= self.max_indexes:
+                return
+            entries.sort(key=os.path.getmtime)
+            for p in entries[:len(entries) - self.max_indexes]:
+                shutil.rmtree(p, ignore_errors=True)
+
+    def __len__(self) -> int:
+        return sum(1 for d in os.listdir(self.index_dir) if ".tmp" not in d)
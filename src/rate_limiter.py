@@ -0,0 +1,163 @@
+"""
+Vertex quota-aware rate limiting
+--------------------------------
+Token buckets for requests/minute and (estimated) tokens/minute, shared by
+every LLM and embedding call that targets the same model, so bursts from
+story generation, dedupe and compliance stay just under the project quota
+instead of bouncing off it with ResourceExhausted.
+
+Reservations may push a bucket into debt; the caller then sleeps until the
+debt is repaid. That keeps acquire() O(1) and FIFO-fair for async and
+threaded callers alike.
+
+Config (env, 0 disables a bucket):
+  VERTEX_LLM_RPM / VERTEX_LLM_TPM        (default: 300 / 1000000)
+  VERTEX_EMBED_RPM / VERTEX_EMBED_TPM    (default: 1200 / 0)
+  VERTEX_QUOTA_HEADROOM                  fraction of quota to use (default: 0.9)
+"""
+
+import os
+import math
+import time
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional
+
+QUOTA_HEADROOM = float(os.environ.get("VERTEX_QUOTA_HEADROOM", "0.9"))
+LLM_RPM = float(os.environ.get("VERTEX_LLM_RPM", "300"))
+LLM_TPM = float(os.environ.get("VERTEX_LLM_TPM", "1000000"))
+EMBED_RPM = float(os.environ.get("VERTEX_EMBED_RPM", "1200"))
+EMBED_TPM = float(os.environ.get("VERTEX_EMBED_TPM", "0"))
+
+# Budget reserved per LLM call for the completion (one UserStory JSON)
+DEFAULT_OUTPUT_TOKENS = 800
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars/token for English prose)."""
+    return len(text or "") // 4 + 1
+
+
+class TokenBucket:
+    """Classic token bucket: `capacity` tokens, refilled continuously at `rate` per second."""
+
+    def __init__(self, capacity: float, rate: float, clock=time.monotonic):
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self.tokens = float(capacity)
+        self._clock = clock
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` now; return seconds to wait before using it."""
+        with self._lock:
+            now = self._clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+            self._last = now
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class QuotaLimiter:
+    """
+    Requests-per-minute and tokens-per-minute buckets for one model.
+    Use `await acquire(tokens)` from async code and `acquire_sync(tokens)` from threads.
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 headroom: float = QUOTA_HEADROOM, burst_seconds: float = 1.0, name: str = ""):
+        self.name = name
+        self.requests = self._bucket(requests_per_minute, headroom, burst_seconds)
+        self.tokens = self._bucket(tokens_per_minute, headroom, burst_seconds)
+        self.waited_seconds = 0.0
+        self.throttled = 0
+
+    @staticmethod
+    def _bucket(per_minute: float, headroom: float, burst_seconds: float) -> Optional[TokenBucket]:
+        if not per_minute or per_minute <= 0:
+            return None
+        rate = per_minute * headroom / 60.0
+        # Small burst (default one second's worth, min 1) so we never front-load a minute of quota
+        return TokenBucket(capacity=max(1.0, rate * burst_seconds), rate=rate)
+
+    def reserve(self, tokens: int = 0, requests: int = 1) -> float:
+        wait = 0.0
+        if self.requests is not None and requests:
+            wait = max(wait, self.requests.reserve(requests))
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        if wait > 0:
+            self.throttled += 1
+            self.waited_seconds += wait
+        return wait
+
+    async def acquire(self, tokens: int = 0, requests: int = 1):
+        wait = self.reserve(tokens, requests)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self, tokens: int = 0, requests: int = 1):
+        wait = self.reserve(tokens, requests)
+        if wait > 0:
+            time.sleep(wait)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"throttled": self.throttled, "waited_seconds": round(self.waited_seconds, 3)}
+
+
+_LIMITERS: Dict[str, QuotaLimiter] = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def shared_limiter(model: str, requests_per_minute: float, tokens_per_minute: float = 0) -> QuotaLimiter:
+    """Process-wide limiter per model, so every client of that model shares one quota."""
+    with _LIMITERS_LOCK:
+        lim = _LIMITERS.get(model)
+        if lim is None:
+            lim = QuotaLimiter(requests_per_minute, tokens_per_minute, name=model)
+            _LIMITERS[model] = lim
+        return lim
+
+
+def llm_limiter(model: str) -> QuotaLimiter:
+    return shared_limiter(model, LLM_RPM, LLM_TPM)
+
+
+def embedding_limiter(model: str) -> QuotaLimiter:
+    return shared_limiter(model, EMBED_RPM, EMBED_TPM)
+
+
+class RateLimitedEmbeddings:
+    """
+    Wraps an embeddings client so each call first reserves quota.
+    Vertex batches embed_documents internally; texts_per_request mirrors that
+    so a large call is charged as the number of requests it really makes.
+    """
+
+    def __init__(self, embedder: Any, limiter: QuotaLimiter, texts_per_request: int = 250):
+        self.embedder = embedder
+        self.limiter = limiter
+        self.texts_per_request = max(1, texts_per_request)
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__["embedder"], name)
+
+    def _charge(self, texts: List[str]):
+        n_req = max(1, math.ceil(len(texts) / self.texts_per_request))
+        self.limiter.acquire_sync(tokens=sum(estimate_tokens(t) for t in texts), requests=n_req)
+
+    def embed_documents(self, texts: List[str], **kwargs) -> List[List[float]]:
+        if texts:
+            self._charge(texts)
+        return self.embedder.embed_documents(texts, **kwargs)
+
+    def embed_query(self, text: str, **kwargs) -> List[float]:
+        self._charge([text])
+        return self.embedder.embed_query(text, **kwargs)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.to_thread(self.embed_query, text)
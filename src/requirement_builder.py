@@ -17,17 +17,35 @@ import os
 import re
 import json
 import uuid
+import hashlib
 import asyncio
+import threading
 import docx
 import xml.etree.ElementTree as ET
+from itertools import islice
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import numpy as np
 from tqdm.auto import tqdm
 from PyPDF2 import PdfReader
-from typing import List, Iterable, Dict, Any, Optional
+from typing import TYPE_CHECKING, List, Iterable, Iterator, Dict, Any, Optional, Tuple
 from pydantic import BaseModel, Field, ValidationError
 
-from google.cloud import bigquery
-from langchain_google_vertexai import VertexAIEmbeddings, VertexAI
+if TYPE_CHECKING:  # Google SDKs are only needed for backend="vertex" / BigQuery export
+    from langchain_google_vertexai import VertexAIEmbeddings
+
+from src.embedding_cache import CachedEmbeddings, DEFAULT_CACHE_DIR
+from src.llm_scheduler import LLMScheduler
+from src.rate_limiter import RateLimitedEmbeddings, llm_limiter, embedding_limiter
+from src.llm_cache import ResponseCache, prompt_key, DEFAULT_LLM_CACHE_DIR
+from src.rag_index import RagIndexStore, index_key, DEFAULT_RAG_INDEX_DIR
+from src.lexical_index import BM25Index, LEXICAL_CONFIDENCE
+from src.chunking import PageChunker, sentence_chunks
+from src.backends import BACKENDS, DEFAULT_BACKEND, make_llm, make_embedder
+from src.stream_json import IncrementalJSONParser, parse_json_objects
+from src.instrumentation import span, timed, incr
+from src.usage import MeteredEmbeddings, attribute_to
 
 # ========================== Helpers & Schema ==========================
 
@@ -81,13 +99,77 @@ BULLET_RE = re.compile(r"^\s*(?:[-*•]|[0-9]+[.)])\s+")
 REQ_ID_RE  = re.compile(r"^(REQ[-\s]?\d+|[A-Z]{2,}\d+|[0-9]+(?:\.[0-9]+)*)\b")
 REQ_KEYWORDS = re.compile(r"\b(system shall|shall|must|should|ability to|capability to|enable|allow)\b", re.I)
 
-def parse_pdf_pages(path: str) -> List[Dict[str, Any]]:
-    """Return list of {'page': int, 'text': str} for PDFs."""
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", "0"))  # 0 = one per CPU
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "40"))
+# Repair pass for stories rejected by JSON/UserStory validation
+REPAIR_ROUNDS = int(os.environ.get("REPAIR_ROUNDS", "2"))            # repair prompts per failed requirement
+REPAIR_CONCURRENCY = int(os.environ.get("REPAIR_CONCURRENCY", "2"))  # in-flight repair prompts
+REPAIR_BUDGET = int(os.environ.get("REPAIR_BUDGET", "50"))           # repair prompts per document
+
+def _extract_page_range(path: str, start: int, stop: int) -> List[Dict[str, Any]]:
+    """Worker: open our own PdfReader and extract pages [start, stop)."""
+    reader = PdfReader(path)
+    return [{"page": i + 1, "text": reader.pages[i].extract_text() or ""} for i in range(start, stop)]
+
+def iter_pdf_pages(
+    path: str,
+    workers: Optional[int] = None,
+    max_pages: Optional[int] = None,
+    min_parallel_pages: int = PDF_PARALLEL_MIN_PAGES,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield {'page': int, 'text': str} for PDFs, in page order, as pages become available.
+    Large files are split into page ranges extracted by a process pool
+    (each worker opens its own PdfReader). Files under min_parallel_pages,
+    or workers=1, are parsed serially.
+    """
     reader = PdfReader(path)
-    pages = []
-    for idx, page in enumerate(reader.pages, start=1):
-        pages.append({"page": idx, "text": page.extract_text() or ""})
-    return pages
+    n_pages = len(reader.pages)
+    if max_pages is not None:
+        n_pages = min(n_pages, max_pages)
+    workers = workers or PDF_WORKERS or os.cpu_count() or 1
+
+    done = 0
+    if workers > 1 and n_pages >= min_parallel_pages:
+        # ~4 ranges per worker evens out pages that are slow to extract
+        step = max(1, -(-n_pages // (workers * 4)))
+        ranges = [(s, min(n_pages, s + step)) for s in range(0, n_pages, step)]
+        n_workers = min(workers, len(ranges))
+        try:
+            pool = ProcessPoolExecutor(max_workers=n_workers)
+        except OSError as e:
+            print(f"⚠️ Parallel PDF parsing unavailable, continuing serially. Reason: {e}")
+        else:
+            # Keep only ~2 ranges per worker submitted ahead of the consumer, so a caller that
+            # stops early (generator closed) does not wait for every page of the file.
+            todo = iter(ranges)
+            try:
+                pending = deque(pool.submit(_extract_page_range, path, *r) for r in islice(todo, 2 * n_workers))
+                while pending:
+                    part = pending.popleft().result()
+                    nxt = next(todo, None)
+                    if nxt is not None:
+                        pending.append(pool.submit(_extract_page_range, path, *nxt))
+                    for page in part:
+                        yield page
+                        done += 1
+                return
+            except (OSError, BrokenProcessPool) as e:
+                print(f"⚠️ Parallel PDF parsing unavailable, continuing serially. Reason: {e}")
+            finally:
+                pool.shutdown(cancel_futures=True)
+
+    for idx in range(done, n_pages):
+        yield {"page": idx + 1, "text": reader.pages[idx].extract_text() or ""}
+
+def parse_pdf_pages(
+    path: str,
+    workers: Optional[int] = None,
+    max_pages: Optional[int] = None,
+    min_parallel_pages: int = PDF_PARALLEL_MIN_PAGES,
+) -> List[Dict[str, Any]]:
+    """Return list of {'page': int, 'text': str} for PDFs (see iter_pdf_pages)."""
+    return list(iter_pdf_pages(path, workers=workers, max_pages=max_pages, min_parallel_pages=min_parallel_pages))
 
 def parse_docx(path: str) -> str:
     doc = docx.Document(path)
@@ -102,6 +184,7 @@ def parse_json_text(path: str) -> str:
     with open(path, "r", encoding="utf-8") as f:
         return json.dumps(json.load(f), indent=2, ensure_ascii=False)
 
+@timed("extract.parse")
 def parse_file_text_or_pages(path: str) -> Dict[str, Any]:
     """Return {'text': str} for non-PDFs, or {'pages': [{page, text}, ...]} for PDFs."""
     path_l = path.lower()
@@ -116,50 +199,56 @@ def parse_file_text_or_pages(path: str) -> Dict[str, Any]:
     with open(path, "r", encoding="utf-8", errors="ignore") as f:
         return {"text": f.read()}
 
-def normalize_text(text: str) -> str:
-    """Join soft-wrapped lines, preserve bullets/headings, keep paragraph breaks."""
-    lines = text.splitlines()
-    out = []
+_SENTENCE_END = (".", ":", ";")
+
+def normalized_lines(text: str) -> List[str]:
+    """normalize_text as a list of output lines (blank runs collapsed to one "")."""
+    out: List[str] = []
+    append = out.append
+    bullet, req_id = BULLET_RE.match, REQ_ID_RE.match
     buf = ""
-    for raw in lines:
+    last_blank = False
+    for raw in text.splitlines():
         line = raw.rstrip()
         # blank line => paragraph break
-        if not line.strip():
+        if not line:
             if buf:
-                out.append(buf)
+                append(buf)
                 buf = ""
-            out.append("")
+                last_blank = False
+            if not last_blank:
+                append("")
+                last_blank = True
             continue
         # new bullet or heading/ID => start new requirement block
-        if BULLET_RE.match(line) or REQ_ID_RE.match(line):
+        if bullet(line) or req_id(line):
             if buf:
-                out.append(buf)
+                append(buf)
+                last_blank = False
             buf = line.strip()
             continue
         # soft wrap: if buf doesn't end sentence punctuation, join
-        if buf and not buf.endswith((".", ":", ";")):
+        if buf and not buf.endswith(_SENTENCE_END):
             buf += " " + line.strip()
         else:
             if buf:
-                out.append(buf)
+                append(buf)
+                last_blank = False
             buf = line.strip()
     if buf:
-        out.append(buf)
-    # collapse consecutive blanks
-    cleaned = []
-    for s in out:
-        if s == "" and cleaned and cleaned[-1] == "":
-            continue
-        cleaned.append(s)
-    return "\n".join(cleaned)
+        append(buf)
+    return out
 
-def normalize_page_text(pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    return [{"page": p["page"], "text": normalize_text(p["text"])} for p in pages]
+def normalize_text(text: str) -> str:
+    """Join soft-wrapped lines, preserve bullets/headings, keep paragraph breaks."""
+    return "\n".join(normalized_lines(text))
 
-import re
-from typing import List, Dict
+def iter_normalized_pages(pages: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    for p in pages:
+        yield {"page": p["page"], "text": normalize_text(p["text"])}
 
-# ========================== Heading-based Epic Extraction ==========================
+def normalize_page_text(pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return list(iter_normalized_pages(pages))
 
 # ========================== Heading-based Epic Extraction ==========================
 
@@ -172,6 +261,16 @@ GENERIC_HEADINGS = {
     "references", "appendix"
 }
 
+def _match_heading(line: str):
+    """(sec_id, title) if the (stripped) line is a non-generic numbered heading, else None."""
+    m = HEADING_RE.match(line)
+    if m:
+        title = m.group(2).strip()
+        # Skip generic container titles
+        if title.lower() not in GENERIC_HEADINGS:
+            return m.group(1), title
+    return None
+
 def extract_headings(text: str) -> Dict[str, str]:
     """
     Extract headings like '2.1.2 Clinician Portal Development'
@@ -180,74 +279,171 @@ def extract_headings(text: str) -> Dict[str, str]:
     """
     headings = {}
     for line in text.splitlines():
-        m = HEADING_RE.match(line.strip())
-        if m:
-            sec_id = m.group(1)
-            title = m.group(2).strip()
-            # Skip generic container titles
-            if title.lower() not in GENERIC_HEADINGS:
-                headings[sec_id] = title
+        h = _match_heading(line.strip())
+        if h:
+            headings[h[0]] = h[1]
     return headings
 
-def assign_epic(req_id: str, headings: Dict[str, str]) -> str:
+class EpicIndex:
+    """
+    Section-number trie over heading ids, built once per document.
+    lookup() walks the dotted segments of a requirement id, so it costs
+    O(depth) and only matches whole segments ('2.1' is not a prefix of '2.10.3').
+    """
+
+    __slots__ = ("_root",)
+
+    def __init__(self, headings: Optional[Dict[str, str]] = None):
+        self._root: Dict[str, Any] = {}
+        for sec_id, title in (headings or {}).items():
+            self.add(sec_id, title)
+
+    def add(self, sec_id: str, title: str):
+        node = self._root
+        for seg in sec_id.split("."):
+            node = node.setdefault(seg, {})
+        node[None] = title  # None key holds the heading title
+
+    def lookup(self, req_id: str, default: str = "General") -> str:
+        best = default
+        node = self._root
+        for seg in req_id.split("."):
+            node = node.get(seg)
+            if node is None:
+                break
+            best = node.get(None, best)
+        return best
+
+
+def assign_epic(req_id: str, headings) -> str:
     """
-    Assign epic based on the closest heading prefix.
+    Assign epic based on the closest heading prefix (whole dotted segments).
     Example: req_id='2.1.2.5' → epic='Clinician Portal Development'
     Falls back to 'General' if none found.
+    Pass an EpicIndex when assigning many requirements against the same headings.
     """
-    for h in sorted(headings.keys(), key=lambda x: -len(x)):  # longest prefix first
-        if req_id.startswith(h):
-            return headings[h]
-    return "General"
+    index = headings if isinstance(headings, EpicIndex) else EpicIndex(headings)
+    return index.lookup(req_id)
 
+# ========================== Requirement Segmentation ==========================
 
+SEG_REQ_ID_RE = re.compile(r"^(REQ[-\s]?\d+|[0-9]+(?:\.[0-9]+)*)\b")
+SEG_BULLET_RE = re.compile(r"^\s*[-*•]\s+")
 
-def split_requirements_with_epics(text: str) -> List[Dict[str, str]]:
+class RequirementSegmenter:
     """
-    Segment into atomic requirements with IDs (AUTO-n fallback),
-    and attach inferred epics from document headings.
+    Incremental requirement segmentation: feed() text piece by piece (or
+    feed_line() stripped lines) and get each requirement as soon as the next
+    one starts. Headings are collected on the same pass.
+    With headings=None, epics are resolved from the headings seen so far
+    (streaming); pass the document's headings to reproduce the batch result,
+    or defer_epics=True to leave epic assignment to the caller.
     """
-    headings = extract_headings(text)
-    lines = [l.strip() for l in text.split("\n") if l.strip()]
-    requirements = []
-    cur = None
 
-    def flush():
-        nonlocal cur
-        if cur and cur["text"].strip():
-            cur["text"] = re.sub(r"\s+", " ", cur["text"]).strip()
+    def __init__(self, headings: Optional[Dict[str, str]] = None, defer_epics: bool = False):
+        self.headings: Dict[str, str] = dict(headings) if headings is not None else {}
+        self.epics = EpicIndex(self.headings)
+        self._learn_headings = headings is None
+        self._defer_epics = defer_epics
+        self._rid: Optional[str] = None
+        self._parts: List[str] = []
+        self.count = 0
+
+    def _flush(self) -> Optional[Dict[str, str]]:
+        rid, parts = self._rid, self._parts
+        self._rid, self._parts = None, []
+        if rid is None:
+            return None
+        text = " ".join(" ".join(parts).split())  # == re.sub(r"\s+", " ", ...).strip()
+        if not text:
+            return None
+        cur = {"req_id": rid, "text": text}
+        if not self._defer_epics:
             # Assign epic from headings
-            cur["epic"] = assign_epic(cur["req_id"], headings)
-            requirements.append(cur)
-        cur = None
-
-    for i, line in enumerate(lines):
-        rid = None
-        content = line
-        start_new = False
-
-        # Requirement ID pattern
-        m = re.match(r"^(REQ[-\s]?\d+|[0-9]+(?:\.[0-9]+)*)\b", line)
+            cur["epic"] = self.epics.lookup(rid)
+        self.count += 1
+        return cur
+
+    def feed_line(self, line: str) -> Optional[Dict[str, str]]:
+        """Consume one stripped, non-empty line; return the requirement it closed, if any."""
+        if self._learn_headings:
+            h = _match_heading(line)
+            if h:
+                self.headings[h[0]] = h[1]
+                self.epics.add(h[0], h[1])
+
+        m = SEG_REQ_ID_RE.match(line)
         if m:
-            rid = m.group(0)
-            start_new = True
-            content = line[m.end():].strip() or line.strip()
-        elif re.match(r"^\s*[-*•]\s+", line):  # bullet point
-            start_new = True
-            content = line.strip()
-
-        if start_new:
-            flush()
-            rid = rid or f"AUTO-{len(requirements)+1}"
-            cur = {"req_id": rid, "text": content}
-        else:
-            if cur:
-                cur["text"] += " " + content
-            else:
-                cur = {"req_id": f"AUTO-{len(requirements)+1}", "text": content}
+            done = self._flush()
+            self._rid = m.group(0)
+            self._parts = [line[m.end():].strip() or line]
+            return done
+        if SEG_BULLET_RE.match(line):  # bullet point
+            done = self._flush()
+            self._rid = f"AUTO-{self.count+1}"
+            self._parts = [line]
+            return done
+        if self._rid is None:
+            self._rid = f"AUTO-{self.count+1}"
+        self._parts.append(line)
+        return None
+
+    def feed(self, text: str) -> Iterator[Dict[str, str]]:
+        for raw in text.split("\n"):
+            line = raw.strip()
+            if line:
+                done = self.feed_line(line)
+                if done:
+                    yield done
+
+    def close(self) -> Iterator[Dict[str, str]]:
+        done = self._flush()
+        if done:
+            yield done
+
+
+def iter_requirements_with_epics(texts: Iterable[str], headings: Optional[Dict[str, str]] = None) -> Iterator[Dict[str, str]]:
+    """Stream requirements out of a sequence of text pieces (e.g. normalized pages)."""
+    seg = RequirementSegmenter(headings)
+    for text in texts:
+        yield from seg.feed(text)
+    yield from seg.close()
+
+
+@timed("extract.segment")
+def scan_document(pages: Iterable[Dict[str, Any]], normalize: bool = True) -> Dict[str, Any]:
+    """
+    Single-pass segmentation engine.
+    One scan over the lines produces the normalized pages, the heading map and
+    the requirement blocks (epics are attached afterwards from the complete
+    heading map, so results match normalize → extract_headings → split).
+    Returns {'pages': [...], 'headings': {...}, 'requirements': [...]}.
+    """
+    seg = RequirementSegmenter(defer_epics=True)
+    out_pages = []
+    requirements = []
+    feed_line = seg.feed_line
+    for p in pages:
+        lines = normalized_lines(p["text"]) if normalize else p["text"].split("\n")
+        for line in lines:
+            line = line.strip()
+            if line:
+                done = feed_line(line)
+                if done:
+                    requirements.append(done)
+        out_pages.append({"page": p["page"], "text": "\n".join(lines)})
+    requirements.extend(seg.close())
+    for r in requirements:
+        r["epic"] = seg.epics.lookup(r["req_id"])
+    return {"pages": out_pages, "headings": seg.headings, "requirements": requirements}
+
 
-    flush()
-    return requirements
+def split_requirements_with_epics(text: str) -> List[Dict[str, str]]:
+    """
+    Segment into atomic requirements with IDs (AUTO-n fallback),
+    and attach inferred epics from document headings.
+    """
+    return scan_document([{"page": 1, "text": text}], normalize=False)["requirements"]
 
 
 def chunked(seq: List[Any], n: int) -> Iterable[List[Any]]:
@@ -256,71 +452,274 @@ def chunked(seq: List[Any], n: int) -> Iterable[List[Any]]:
 
 # ========================== RAG Index & Retrieval ==========================
 
-def page_chunks(pages: List[Dict[str, Any]], max_chars=1500, overlap=200) -> List[Dict[str, Any]]:
-    """Create sliding-window chunks with page provenance."""
-    chunks = []
+def iter_page_chunks(pages: Iterable[Dict[str, Any]], max_chars=1500, overlap=200) -> Iterator[Dict[str, Any]]:
+    """Yield sliding-window chunks with page provenance."""
     for p in pages:
         t = p["text"]
         i = 0
         while i < len(t):
             j = min(len(t), i + max_chars)
             chunk = t[i:j]
-            chunks.append({"page": p["page"], "text": chunk})
+            yield {"page": p["page"], "text": chunk}
             if j == len(t): break
             i = j - overlap
-    return chunks
-
-def _cosines(query_emb, matrix):
-    sims = []
-    q = np.array(query_emb, dtype=float)
-    qn = np.linalg.norm(q)
-    for v in matrix:
-        v = np.array(v, dtype=float)
-        vn = np.linalg.norm(v)
-        sims.append(0.0 if qn == 0 or vn == 0 else float(np.dot(q, v) / (qn * vn)))
-    return sims
-
-def build_retriever(embedder: VertexAIEmbeddings, chunks: List[Dict[str, Any]]):
+
+def page_chunks(pages: List[Dict[str, Any]], max_chars=1500, overlap=200) -> List[Dict[str, Any]]:
+    """Create sliding-window chunks with page provenance."""
+    return list(iter_page_chunks(pages, max_chars=max_chars, overlap=overlap))
+
+CHUNKERS = {"sentence": sentence_chunks, "window": page_chunks}
+
+def chunk_pages(pages: List[Dict[str, Any]], chunking: str = "sentence", max_chars=1500, overlap=200) -> List[Dict[str, Any]]:
+    """
+    RAG chunks for a document.
+    chunking="sentence": sentence/bullet boundaries, boilerplate lines and duplicate chunks dropped.
+    chunking="window":   fixed character windows per page (page_chunks).
+    """
+    if chunking not in CHUNKERS:
+        raise ValueError(f"Unknown chunking: {chunking!r} (expected one of {tuple(CHUNKERS)})")
+    return CHUNKERS[chunking](pages, max_chars=max_chars, overlap=overlap)
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize rows in place; zero rows stay zero (cosine 0.0, as before)."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+def _as_matrix(embs: Any, n_rows: int) -> np.ndarray:
+    """float32 (n_rows, dim) copy of a list of embeddings; dim is 0 when there are none."""
+    matrix = np.array(embs, dtype=np.float32)
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(n_rows, -1 if matrix.size else 0)
+    return matrix
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores along the last axis, best first."""
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.intp)
+    if k < n:
+        part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        part = np.broadcast_to(np.arange(n), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, part, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(part, order, axis=-1)
+
+class ChunkRetriever:
+    """
+    Dense retriever over page chunks.
+    Chunk embeddings live in one pre-normalized float32 matrix, so a query is
+    a single matrix-vector product and a batch of queries a single matmul.
+    add() may run while queries run in worker threads: queries go through
+    snapshot(), which sees chunks, matrix and BM25 index at the same size.
+    """
+
+    def __init__(self, chunks: List[Dict[str, Any]], embs: Any):
+        self.chunks = chunks
+        self.matrix = _normalize_rows(_as_matrix(embs, len(chunks)))
+        self._lexical: Optional[BM25Index] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_matrix(cls, chunks: List[Dict[str, Any]], matrix: np.ndarray) -> "ChunkRetriever":
+        """Wrap an already-normalized matrix (e.g. memmapped from a RagIndexStore) without copying."""
+        self = cls.__new__(cls)
+        self.chunks = chunks
+        self.matrix = matrix
+        self._lexical = None
+        self._lock = threading.Lock()
+        return self
+
+    @classmethod
+    def lexical_only(cls, chunks: List[Dict[str, Any]]) -> "ChunkRetriever":
+        """Retriever with no embeddings at all; only BM25 lookups (offline)."""
+        return cls(chunks, np.zeros((len(chunks), 0), dtype=np.float32))
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    @property
+    def has_embeddings(self) -> bool:
+        return self.matrix.shape[1] > 0
+
+    @property
+    def lexical(self) -> BM25Index:
+        """BM25 index over the chunk texts, built on first use and kept in step with add()."""
+        if self._lexical is None:
+            with self._lock:
+                if self._lexical is None:
+                    self._lexical = BM25Index(c["text"] for c in self.chunks)
+        return self._lexical
+
+    def add(self, chunks: List[Dict[str, Any]], embs: Any):
+        """Append chunks (used while streaming pages); searches see them from now on."""
+        if not chunks:
+            return
+        more = _normalize_rows(_as_matrix(embs, len(chunks)))
+        with self._lock:
+            matrix = more if len(self.chunks) == 0 else np.vstack([self.matrix, more])
+            self.chunks = self.chunks + chunks  # copy-on-write: snapshots keep their list
+            self.matrix = matrix
+            if self._lexical is not None:
+                self._lexical.add(c["text"] for c in chunks)
+
+    def snapshot(self, lexical: bool = False) -> "ChunkRetriever":
+        """Read-only view of the current chunks/matrix (and BM25 index, when asked for)."""
+        if lexical:
+            self.lexical  # build before taking the lock
+        with self._lock:
+            view = ChunkRetriever.from_matrix(self.chunks, self.matrix)
+            if lexical:
+                view._lexical = self._lexical.snapshot()
+        return view
+
+    def _hits(self, scores: np.ndarray, idxs: np.ndarray) -> List[Dict[str, Any]]:
+        results = []
+        for i in idxs:
+            c = self.chunks[i]
+            results.append({"page": c["page"], "text": c["text"], "score": float(scores[i])})
+        return results
+
+    def search(self, query_emb, top_k: int = 3) -> List[Dict[str, Any]]:
+        """Top-k chunks for one query embedding."""
+        if not self.chunks:
+            return []
+        q = _normalize_rows(np.array(query_emb, dtype=np.float32).reshape(1, -1))[0]
+        scores = self.matrix @ q
+        return self._hits(scores, _top_k_indices(scores, top_k))
+
+    def search_batch(self, query_embs, top_k: int = 3) -> List[List[Dict[str, Any]]]:
+        """Top-k chunks for each of several query embeddings (one matmul)."""
+        if len(query_embs) == 0:
+            return []
+        if not self.chunks:
+            return [[] for _ in query_embs]
+        q = _normalize_rows(np.array(query_embs, dtype=np.float32).reshape(len(query_embs), -1))
+        scores = q @ self.matrix.T
+        idxs = _top_k_indices(scores, top_k)
+        return [self._hits(row_scores, row_idxs) for row_scores, row_idxs in zip(scores, idxs)]
+
+def build_retriever(embedder: "VertexAIEmbeddings", chunks: List[Dict[str, Any]]) -> ChunkRetriever:
     texts = [c["text"] for c in chunks]
     embs = embedder.embed_documents(texts)
-    return {"chunks": chunks, "embs": embs}
+    return ChunkRetriever(chunks, embs)
 
-def retrieve_context(retriever: Dict[str, Any], embedder: VertexAIEmbeddings, query: str, top_k=3):
+@timed("extract.index")
+def open_retriever(embedder: "VertexAIEmbeddings", pages: List[Dict[str, Any]], store: Optional[RagIndexStore],
+                   model: str, max_chars=1500, overlap=200, mode: str = "dense",
+                   chunking: str = "sentence") -> ChunkRetriever:
+    """
+    Retriever for a document, reopened from the on-disk index when this
+    document/chunking/model was indexed before; otherwise chunk, embed and save.
+    mode="lexical" only chunks: no embeddings, no on-disk index.
+    """
+    if mode == "lexical":
+        return ChunkRetriever.lexical_only(chunk_pages(pages, chunking, max_chars=max_chars, overlap=overlap))
+    if store is None:
+        return build_retriever(embedder, chunk_pages(pages, chunking, max_chars=max_chars, overlap=overlap))
+    doc_hash = fingerprint(json.dumps([[p["page"], p["text"]] for p in pages], ensure_ascii=False))
+    key = index_key(model, doc_hash, {"chunker": chunking, "max_chars": max_chars, "overlap": overlap})
+    loaded = store.load(key)
+    if loaded is not None:
+        chunks, matrix = loaded
+        print(f"📚 Reopened RAG index ({len(chunks)} chunks)")
+        return ChunkRetriever.from_matrix(chunks, matrix)
+    chunks = chunk_pages(pages, chunking, max_chars=max_chars, overlap=overlap)
+    print(f"🧩 {len(chunks)} chunks ({chunking} chunking)")
+    retriever = build_retriever(embedder, chunks)
+    store.save(key, retriever.chunks, retriever.matrix)
+    return retriever
+
+def retrieve_context(retriever: ChunkRetriever, embedder: "VertexAIEmbeddings", query: str, top_k=3):
     q_emb = embedder.embed_query(query)
-    sims = _cosines(q_emb, retriever["embs"])
-    idxs = np.argsort(sims)[::-1][:top_k]
-    results = []
-    for i in idxs:
-        c = retriever["chunks"][i]
-        results.append({"page": c["page"], "text": c["text"], "score": float(sims[i])})
+    return retriever.search(q_emb, top_k=top_k)
+
+def embed_queries(embedder: "VertexAIEmbeddings", queries: List[str]) -> List[List[float]]:
+    """Embed many queries in one embed_documents round trip (query task type when supported)."""
+    try:
+        return embedder.embed_documents(queries, embeddings_task_type="RETRIEVAL_QUERY")
+    except TypeError:  # embedders without task types
+        return embedder.embed_documents(queries)
+
+RETRIEVAL_MODES = ("dense", "hybrid", "lexical")
+
+def retrieve_contexts(retriever: ChunkRetriever, embedder: "VertexAIEmbeddings", queries: List[str], top_k=3,
+                      mode: str = "dense", alpha: float = 0.5, confidence: float = LEXICAL_CONFIDENCE):
+    """
+    Batched retrieve_context.
+    mode="dense":   one embedding call + one matmul for all queries.
+    mode="lexical": BM25 only, no embedding calls (works offline).
+    mode="hybrid":  queries whose top BM25 hit covers >= `confidence` of their
+                    idf mass are answered lexically; only the rest are embedded,
+                    and their chunks ranked by alpha*cosine + (1-alpha)*BM25/max.
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode: {mode!r} (expected one of {RETRIEVAL_MODES})")
+    if not queries:
+        return []
+    retriever = retriever.snapshot(lexical=not (mode == "dense" and retriever.has_embeddings))
+    if mode == "dense" and retriever.has_embeddings:
+        q_embs = embed_queries(embedder, queries)
+        return retriever.search_batch(q_embs, top_k=top_k)
+
+    results: List[Optional[List[Dict[str, Any]]]] = [None] * len(queries)
+    lexical: List[np.ndarray] = []
+    need_dense: List[int] = []
+    for i, q in enumerate(queries):
+        scores, coverage = retriever.lexical.scores(q)
+        top = scores.max() if scores.size else 0.0
+        scores = scores / top if top > 0 else scores  # BM25 → [0, 1] per query
+        lexical.append(scores)
+        idxs = _top_k_indices(scores, top_k)
+        confident = len(idxs) > 0 and top > 0 and coverage[idxs[0]] >= confidence
+        if mode == "lexical" or confident or not retriever.has_embeddings:
+            results[i] = retriever._hits(scores, idxs)
+        else:
+            need_dense.append(i)
+
+    if need_dense:
+        q = _normalize_rows(_as_matrix(embed_queries(embedder, [queries[i] for i in need_dense]), len(need_dense)))
+        dense = q @ retriever.matrix.T
+        for row, i in enumerate(need_dense):
+            fused = alpha * dense[row] + (1 - alpha) * lexical[i]
+            results[i] = retriever._hits(fused, _top_k_indices(fused, top_k))
     return results
 
+async def aretrieve_contexts(retriever: ChunkRetriever, embedder: "VertexAIEmbeddings", queries: List[str], top_k=3,
+                             mode: str = "dense"):
+    """retrieve_contexts off the event loop, so in-flight LLM calls keep progressing."""
+    return await asyncio.to_thread(retrieve_contexts, retriever, embedder, queries, top_k, mode)
+
 # ========================== LLM Utils ==========================
 
-async def safe_llm_batch_async(llm, prompts, timeout=60):
-    """Run multiple LLM calls concurrently with timeout handling."""
-    tasks = [llm.ainvoke(p) for p in prompts]  # VertexAI async call
-    try:
-        return await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), timeout=timeout)
-    except asyncio.TimeoutError:
-        print("⏳ Timeout reached, skipping batch.")
-        return ["{}" for _ in prompts]
+async def safe_llm_batch_async(llm, prompts, timeout=60, concurrency=None, retries=0):
+    """
+    Run multiple LLM calls concurrently with a per-request timeout.
+    A slow or failed request only loses itself: its slot holds the exception.
+    """
+    scheduler = LLMScheduler(llm, max_concurrency=concurrency or max(1, len(prompts)),
+                             timeout=timeout, retries=retries)
+    return await scheduler.map(prompts)
 
 FENCE_OPEN_RE = re.compile(r"^```(?:json|JSON)?\s*")
 FENCE_CLOSE_RE = re.compile(r"\s*```$")
 
+def response_text(resp) -> str:
+    """Raw text of a VertexAI response (str or message-like)."""
+    if isinstance(resp, str):
+        return resp
+    if hasattr(resp, "content") and isinstance(resp.content, str):
+        return resp.content
+    if hasattr(resp, "content"):
+        return str(resp.content)
+    return str(resp)
+
 def clean_response(resp) -> str:
     """Convert VertexAI response to a plain JSON string. Strips ```json fences."""
     if isinstance(resp, Exception):
         return "{}"
-    if isinstance(resp, str):
-        text = resp.strip()
-    elif hasattr(resp, "content") and isinstance(resp.content, str):
-        text = resp.content.strip()
-    elif hasattr(resp, "content"):
-        text = str(resp.content).strip()
-    else:
-        text = str(resp).strip()
+    text = response_text(resp).strip()
 
     # Strip code fences
     text = FENCE_OPEN_RE.sub("", text)
@@ -330,20 +729,21 @@ def clean_response(resp) -> str:
     return text.strip()
 
 def extract_json_object(text: str) -> str:
-    """Try to salvage the first balanced {...} block from text."""
+    """Try to salvage the first balanced {...} block from text (braces inside strings don't count)."""
     start = text.find("{")
     if start == -1:
         return text
-    depth = 0
-    for i in range(start, len(text)):
-        ch = text[i]
-        if ch == "{":
-            depth += 1
-        elif ch == "}":
-            depth -= 1
-            if depth == 0:
-                return text[start:i+1]
-    return text[start:]  # fallback
+    parser = IncrementalJSONParser(max_preamble=0)
+    parser.feed(text[start:])
+    return text[start:start + parser.end] if parser.done else text[start:]  # fallback
+
+def rejection_reason(e: BaseException) -> str:
+    """One-line reason a response was rejected (request error, bad JSON or failed UserStory fields)."""
+    if isinstance(e, ValidationError):
+        return "; ".join(f"{'.'.join(map(str, err['loc'])) or 'story'}: {err['msg']}" for err in e.errors())
+    if isinstance(e, json.JSONDecodeError):
+        return f"invalid JSON: {e.msg}"
+    return f"{type(e).__name__}: {e}"
 
 def cosine_similarity(a, b) -> float:
     a = np.array(a, dtype=float)
@@ -353,6 +753,153 @@ def cosine_similarity(a, b) -> float:
         return 0.0
     return float(np.dot(a, b) / denom)
 
+# ========================== Near-duplicate Engine ==========================
+
+_SIM_BLOCK_BYTES = 64 * 1024 * 1024  # cap for one similarity block (float64)
+_SIM_EPS = 1e-9                      # candidate slack; survivors are re-scored exactly
+
+def _source_labels(stories: List[Dict[str, Any]]):
+    """
+    Integer label per story for vectorized same-source masking.
+    Single-source stories share a label with stories of the same requirement;
+    stories with zero or several sources get a unique label and `multi` marks
+    the latter for an exact set check.
+    """
+    ids: Dict[str, int] = {}
+    labels = np.empty(len(stories), dtype=np.int64)
+    multi = np.zeros(len(stories), dtype=bool)
+    for i, s in enumerate(stories):
+        src = set(s.get("source_requirement_ids", []) or [])
+        if len(src) == 1:
+            labels[i] = ids.setdefault(next(iter(src)), len(ids))
+        else:
+            labels[i] = -(i + 1)
+            multi[i] = len(src) > 1
+    return labels, multi
+
+def _confirm_pairs(stories, mat, labels, multi, ii, jj, threshold: float):
+    """Drop same-source candidates and re-score the rest exactly (as the old loop did)."""
+    pairs = []
+    for i, j in zip(ii.tolist(), jj.tolist()):
+        if labels[i] == labels[j]:
+            continue
+        if (multi[i] or multi[j]) and (
+            set(stories[i].get("source_requirement_ids", []))
+            & set(stories[j].get("source_requirement_ids", []))
+        ):
+            continue
+        sim = cosine_similarity(mat[i], mat[j])
+        if sim >= threshold:
+            pairs.append((i, j, sim))
+    return pairs
+
+def _similar_pairs(stories: List[Dict[str, Any]], embeddings, threshold: float):
+    """
+    All (i, j, sim) with i < j, sim >= threshold and no shared source requirement,
+    in the same order (and with the same scores) as a nested i/j loop.
+    Similarity is computed in row blocks of the normalized matrix, so memory is bounded.
+    """
+    n = len(embeddings)
+    if n < 2:
+        return []
+    mat = np.array(embeddings, dtype=np.float64).reshape(n, -1)
+    unit = _normalize_rows(mat.copy())
+    labels, multi = _source_labels(stories)
+    block = max(1, _SIM_BLOCK_BYTES // (8 * n))
+
+    pairs = []
+    for start in tqdm(range(0, n, block), desc="Near-duplicate scan"):
+        stop = min(n, start + block)
+        sims = unit[start:stop] @ unit.T
+        mask = sims >= threshold - _SIM_EPS
+        mask &= labels[start:stop, None] != labels[None, :]
+        mask &= np.arange(start, stop)[:, None] < np.arange(n)[None, :]  # upper triangle
+        bi, jj = np.nonzero(mask)
+        pairs.extend(_confirm_pairs(stories, mat, labels, multi, bi + start, jj, threshold))
+    return pairs
+
+def _lsh_similar_pairs(stories: List[Dict[str, Any]], embeddings, threshold: float,
+                       n_tables: int = 8, n_bits: int = 12, seed: int = 0):
+    """
+    Approximate _similar_pairs via random-hyperplane LSH.
+    Each table hashes stories by the sign pattern of n_bits random projections;
+    only pairs sharing a bucket in some table are scored exactly.
+    More tables -> higher recall, more candidates; more bits -> smaller buckets.
+    """
+    n = len(embeddings)
+    if n < 2:
+        return []
+    mat = np.array(embeddings, dtype=np.float64).reshape(n, -1)
+    unit = _normalize_rows(mat.copy())
+    labels, multi = _source_labels(stories)
+    rng = np.random.default_rng(seed)
+    weights = (1 << np.arange(n_bits, dtype=np.int64))
+
+    cand = []
+    for _ in tqdm(range(n_tables), desc="LSH tables"):
+        planes = rng.standard_normal((unit.shape[1], n_bits))
+        codes = ((unit @ planes) > 0).astype(np.int64) @ weights
+        order = np.argsort(codes, kind="stable")
+        starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+        sizes = np.diff(np.r_[starts, n])
+        for st, sz in zip(starts[sizes > 1].tolist(), sizes[sizes > 1].tolist()):
+            bucket = np.sort(order[st:st + sz])
+            a, b = np.triu_indices(len(bucket), 1)
+            cand.append(bucket[a] * n + bucket[b])
+    if not cand:
+        return []
+
+    keys = np.unique(np.concatenate(cand))  # sorted -> nested-loop order
+    ii, jj = keys // n, keys % n
+    sims = np.einsum("ij,ij->i", unit[ii], unit[jj])
+    keep = sims >= threshold - _SIM_EPS
+    return _confirm_pairs(stories, mat, labels, multi, ii[keep], jj[keep], threshold)
+
+def _cluster_and_pick(stories: List[Dict[str, Any]], texts: List[str], pairs) -> List[Dict[str, Any]]:
+    """Union-find over duplicate pairs; keep the best representative per cluster."""
+    parent = list(range(len(stories)))
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    def union(a, b):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[rb] = ra
+
+    for i, j, _ in pairs:
+        union(i, j)
+
+    clusters = {}
+    for idx in range(len(stories)):
+        r = find(idx)
+        clusters.setdefault(r, []).append(idx)
+
+    # pick representative: more ACs, then longer text
+    def score(k):
+        ac_len = len(stories[k].get("acceptance_criteria", []) or [])
+        txt_len = len(texts[k])
+        return (ac_len, txt_len)
+
+    kept = []
+    dropped_pairs = []  # (kept_id, dropped_id, cluster_size)
+    for _, idxs in clusters.items():
+        if len(idxs) == 1:
+            kept.append(stories[idxs[0]])
+            continue
+        best = max(idxs, key=score)
+        kept.append(stories[best])
+        for other in idxs:
+            if other != best:
+                dropped_pairs.append((stories[best]["story_id"], stories[other]["story_id"], len(idxs)))
+
+    if dropped_pairs:
+        preview = [(k, d, int(n)) for k, d, n in dropped_pairs]
+        print("🧹 Dedupe kept/dropped:", preview)
+
+    return kept
+
 # ========================== Alignment Checks ==========================
 
 STOP = set(("the","and","of","to","in","a","for","on","with","by","is","be","as","at","or","an","from"))
@@ -379,37 +926,284 @@ import csv
 import csv
 
 
+# ========================== Incremental Manifest ==========================
+
+MANIFEST_DIR = os.environ.get("MANIFEST_DIR", os.path.join(".cache", "manifests"))
+
+def fingerprint(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+def requirement_fingerprint(req: Dict[str, str]) -> str:
+    """Stable identity of a segmented requirement (ID, epic and normalized text)."""
+    return fingerprint(f"{req.get('req_id','')}\0{req.get('epic','')}\0{req.get('text','')}")
+
+def requirement_keys(requirements: List[Dict[str, str]],
+                     contexts: Optional[List[List[Dict[str, Any]]]] = None) -> List[str]:
+    """
+    Manifest key per requirement: fingerprint plus its occurrence index, so repeated
+    requirements stay distinct, plus the hash of its prompt context (snippets and their
+    pages) when given, so edited or renumbered source pages invalidate it.
+    """
+    seen: Counter = Counter()
+    keys = []
+    for i, r in enumerate(requirements):
+        fp = requirement_fingerprint(r)
+        key = f"{fp}#{seen[fp]}"
+        if contexts is not None:
+            key += ":" + fingerprint(json.dumps(contexts[i], sort_keys=True, ensure_ascii=False))
+        keys.append(key)
+        seen[fp] += 1
+    return keys
+
+def page_fingerprints(pages: List[Dict[str, Any]]) -> Dict[str, str]:
+    """{page number: hash of its normalized text}."""
+    return {str(p["page"]): fingerprint(p["text"]) for p in pages}
+
+def default_manifest_path(file_path: str) -> str:
+    return os.path.join(MANIFEST_DIR, f"{os.path.basename(file_path)}.manifest.json")
+
+def load_manifest(path: str, settings: str = "") -> Dict[str, Any]:
+    """
+    Previous run's {'settings': hash, 'pages': {page: hash}, 'requirements': {key: {req_id,
+    pages, stories}}}; empty if there is none or it was generated with different settings
+    (model, prompts, retrieval).
+    """
+    empty = {"settings": settings, "pages": {}, "requirements": {}}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return empty
+    if manifest.get("settings") != settings:
+        print("ℹ️ Generation settings changed since the last run; regenerating every requirement.")
+        return empty
+    manifest.setdefault("pages", {})
+    manifest.setdefault("requirements", {})
+    return manifest
+
+def save_manifest(path: str, settings: str, page_hashes: Dict[str, str], req_entries: Dict[str, Dict[str, Any]]):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"settings": settings, "pages": page_hashes, "requirements": req_entries}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
 # ========================== Extractor ==========================
 
+STORY_GLOSSARY = {"EHR": "Electronic Health Record", "HL7": "Data exchange standard"}
+STORY_ACTORS = {"Doctor": "Reviews patient data", "Nurse": "Updates vitals", "Patient": "Views reports"}
+
+class StoryStream:
+    """
+    Streaming consumer for one story prompt (see LLMScheduler.invoke): parses
+    the response as it arrives and validates each story with UserStory as soon
+    as its JSON object closes. Returns False (stop streaming) once every
+    requirement has a story, the single story is invalid, or the output is not
+    JSON at all, so a malformed answer costs only the tokens already generated.
+    """
+
+    def __init__(self, extractor: "HealthcareStoryExtractor", reqs: List[Dict[str, Any]]):
+        self.extractor = extractor
+        self.reqs = reqs
+        self.by_id = {r["req_id"]: r for r in reqs}
+        self.parser = IncrementalJSONParser()
+        self.stories: Dict[str, Dict[str, Any]] = {}
+        self.invalid = 0
+        self.error: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        return self.parser.text
+
+    @property
+    def complete(self) -> bool:
+        return len(self.stories) == len(self.reqs)
+
+    def _accept(self, obj: Any):
+        if len(self.reqs) > 1:
+            for item in self.extractor._pack_items(obj):
+                if not self.extractor._add_pack_item(self.by_id, self.stories, item):
+                    self.invalid += 1
+            return
+        req = self.reqs[0]
+        try:
+            self.stories[req["req_id"]] = self.extractor._story_from_json(req, obj)
+        except (ValidationError, TypeError) as e:
+            self.invalid += 1
+            self.error = rejection_reason(e)
+
+    def __call__(self, chunk: str) -> bool:
+        for obj in self.parser.feed(chunk):
+            self._accept(obj)
+        if self.parser.error:
+            self.error = self.parser.error
+        single_done = len(self.reqs) == 1 and (self.stories or self.invalid)
+        return not (self.complete or single_done or self.parser.stopped)
+
+    def finish(self) -> Optional[str]:
+        """Error for an answer that yielded no story, or None."""
+        if self.stories:
+            return None
+        return self.error or "no complete JSON object in response"
+
+
 class HealthcareStoryExtractor:
     def __init__(self, project_id, location="us-central1",
                  embedding_model="text-embedding-005",
-                 classifier_model=LLM_MODEL):
+                 classifier_model=LLM_MODEL,
+                 embedding_cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+                 llm_concurrency: int = 8,
+                 llm_timeout: float = 60,
+                 llm_retries: int = 2,
+                 rate_limit: bool = True,
+                 llm_cache_dir: Optional[str] = DEFAULT_LLM_CACHE_DIR,
+                 rag_index_dir: Optional[str] = DEFAULT_RAG_INDEX_DIR,
+                 retrieval_mode: str = "dense",
+                 chunking: str = "sentence",
+                 backend: str = DEFAULT_BACKEND,
+                 llm: Any = None,
+                 embedder: Any = None,
+                 stream_responses: bool = False,
+                 repair_rounds: int = REPAIR_ROUNDS,
+                 repair_concurrency: int = REPAIR_CONCURRENCY,
+                 repair_budget: int = REPAIR_BUDGET):
+        """
+        backend="vertex" builds VertexAI/VertexAIEmbeddings; backend="fake" builds the
+        offline stand-ins from src.backends. An explicit llm/embedder overrides either;
+        embedding_model/classifier_model should then name it, as they key the caches.
+        stream_responses=True streams story answers (llm.astream) and validates each
+        story as its JSON object closes, stopping malformed answers early.
+        Requirements whose story is rejected get up to repair_rounds repair prompts
+        (at most repair_budget per document, repair_concurrency in flight); the ones
+        still failing are listed in self.failed_requirements with the reason.
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown model backend: {backend!r} (expected one of {BACKENDS})")
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode!r} (expected one of {RETRIEVAL_MODES})")
+        if chunking not in CHUNKERS:
+            raise ValueError(f"Unknown chunking: {chunking!r} (expected one of {tuple(CHUNKERS)})")
         self.project_id = project_id
         self.location = location
-        self.embedder = VertexAIEmbeddings(
-            model=embedding_model,
-            project=project_id,
-            location=location
+        self.backend = backend
+        if backend == "fake":
+            # Separate cache namespaces: fake vectors/answers must never be served to real runs
+            embedding_model, classifier_model = f"fake:{embedding_model}", f"fake:{classifier_model}"
+        self.embedding_model = embedding_model
+        self.embedder = embedder if embedder is not None else make_embedder(backend, embedding_model, project_id, location)
+        # Innermost wrapper: counts the characters of requests that really reach the API
+        self.embedder = MeteredEmbeddings(self.embedder)
+        if rate_limit:
+            # Shared per-model quota (also used by ComplianceRetriever)
+            self.embedder = RateLimitedEmbeddings(self.embedder, embedding_limiter(embedding_model))
+        if embedding_cache_dir:
+            # Persistent cache: unchanged chunks/stories/queries are never re-embedded
+            self.embedder = CachedEmbeddings(self.embedder, model_name=embedding_model, cache_dir=embedding_cache_dir)
+        self.llm_model = classifier_model
+        self.llm_params = {
+            "temperature": 0.2,   # slight diversity, still stable JSON
+            "top_p": 0.9,
+            "top_k": 40,
+        }
+        self.llm = llm if llm is not None else make_llm(backend, classifier_model, project_id, location, **self.llm_params)
+        # "dense", "hybrid" (BM25 first, embed only unsure queries) or "lexical" (no embedding calls)
+        self.retrieval_mode = retrieval_mode
+        # "sentence" (boundary-aware, deduplicated) or "window" (fixed 1500-char windows)
+        self.chunking = chunking
+        # Per-document RAG index on disk: re-runs on the same upload skip chunking/embedding
+        self.rag_index = RagIndexStore(rag_index_dir) if rag_index_dir else None
+        # Prompt-level response cache: warm re-runs skip unchanged Gemini calls
+        self.response_cache = ResponseCache(llm_cache_dir) if llm_cache_dir else None
+        # Stream story answers into StoryStream instead of waiting for the full text
+        self.stream_responses = stream_responses
+        # Shared in-flight budget for every LLM call made by this extractor
+        self.scheduler = LLMScheduler(
+            self.llm, max_concurrency=llm_concurrency, timeout=llm_timeout, retries=llm_retries,
+            limiter=llm_limiter(classifier_model) if rate_limit else None,
         )
-        self.llm = VertexAI(
-            model_name=classifier_model,
-            temperature=0.2,   # slight diversity, still stable JSON
-            top_p=0.9,
-            top_k=40,
-            project=project_id,
-            location=location,
+        # Smaller pass for rejected stories: same model quota, fewer requests in flight
+        self.repair_scheduler = LLMScheduler(
+            self.llm, max_concurrency=repair_concurrency, timeout=llm_timeout, retries=llm_retries,
+            limiter=self.scheduler.limiter,
         )
-
-    async def generate_user_stories_batch(
-        self,
-        requirements,
-        glossary,
-        actors,
-        constraints,
-        batch_size=5,
-        retriever: Optional[Dict[str, Any]] = None,
-    ):
+        self.repair_rounds = max(0, int(repair_rounds))
+        self.repair_budget = max(0, int(repair_budget))
+        self._repair_left = self.repair_budget
+        # Failure queue of the last run: [{"req_id", "reason", "repair_attempts"}]
+        self.failed_requirements: List[Dict[str, Any]] = []
+
+    @staticmethod
+    def _story_from_json(req: Dict[str, Any], story_json: Any) -> Dict[str, Any]:
+        """Validate parsed JSON into a UserStory dict (raises ValidationError/TypeError)."""
+        us = UserStory(**story_json)
+
+        # Force unique story_id & keep provenance
+        us.story_id = str(uuid.uuid4())
+        if not us.source_requirement_ids:
+            us.source_requirement_ids = [req["req_id"]]
+
+        return us.model_dump()  # pydantic v2
+
+    def _validate_story(self, req: Dict[str, Any], resp) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """(UserStory dict, None) for a valid response, else (None, rejection reason)."""
+        if isinstance(resp, Exception):
+            return None, rejection_reason(resp)
+        raw_text = clean_response(resp)
+        try:
+            try:
+                story_json = json.loads(raw_text)
+            except json.JSONDecodeError:
+                story_json = json.loads(extract_json_object(raw_text))
+            return self._story_from_json(req, story_json), None
+        except (json.JSONDecodeError, ValidationError, TypeError) as e:
+            return None, rejection_reason(e)
+
+    def _parse_story(self, req: Dict[str, Any], resp, log_errors: bool = False) -> Optional[Dict[str, Any]]:
+        """Validate one LLM response into a UserStory dict, or None if it isn't one."""
+        story, reason = self._validate_story(req, resp)
+        if story is None and log_errors:
+            print(f"❌ Invalid JSON for {req['req_id']}: {reason}\nRaw output:\n{clean_response(resp)}\n")
+        return story
+
+    @staticmethod
+    def _pack_items(items) -> List[Dict[str, Any]]:
+        """Story objects of a packed answer: a JSON array, {"stories": [...]} or a bare object."""
+        if isinstance(items, dict):
+            items = items.get("stories") or [items]
+        return [item for item in items if isinstance(item, dict)] if isinstance(items, list) else []
+
+    def _add_pack_item(self, by_id: Dict[str, Dict[str, Any]], out: Dict[str, Dict[str, Any]],
+                       item: Dict[str, Any]) -> bool:
+        """Validate one packed item into out[req_id]; False if unknown, repeated or invalid."""
+        rid = str(item.pop("req_id", ""))
+        if rid not in by_id or rid in out:
+            return False
+        try:
+            out[rid] = self._story_from_json(by_id[rid], item)
+        except (ValidationError, TypeError):
+            return False
+        return True
+
+    def _parse_pack(self, reqs: List[Dict[str, Any]], resp) -> Dict[str, Dict[str, Any]]:
+        """Validate a packed response (JSON array keyed by req_id) into {req_id: story}."""
+        raw_text = clean_response(resp)
+        try:
+            items = json.loads(raw_text)
+        except json.JSONDecodeError:
+            # Keep every object that closed (a truncated or streamed-and-stopped answer still counts)
+            items, _ = parse_json_objects(raw_text)
+            if len(items) == 1:
+                items = items[0]
+        by_id = {r["req_id"]: r for r in reqs}
+        out: Dict[str, Dict[str, Any]] = {}
+        for item in self._pack_items(items):
+            self._add_pack_item(by_id, out, item)
+        return out
+
+    @staticmethod
+    def _prompt_parts(glossary, actors, constraints) -> Dict[str, str]:
+        """System prompts (single and packed) and the shared glossary/actors/constraints block."""
         # Use dumps to avoid quote-escaping hell in long strings
         abstain = {
             "epic": "",
@@ -424,149 +1218,387 @@ class HealthcareStoryExtractor:
             "open_questions": ["Need clarification"],
             "citations": [],
         }
+        return {
+            "single": (
+                "You are a senior BA in healthcare software.\n"
+                "Use ONLY the provided glossary, actors, constraints, and CONTEXT SNIPPETS.\n"
+                "Cite which page(s) you used in the 'citations' field; include a short snippet from each page.\n"
+                "If the context is insufficient or unrelated, return EXACTLY this JSON:\n"
+                f"{json.dumps(abstain, indent=2)}\n"
+                "Return ONLY valid JSON with this schema (no markdown, no commentary):\n"
+                f"{json.dumps(SCHEMA, indent=2)}"
+            ),
+            "packed": (
+                "You are a senior BA in healthcare software.\n"
+                "Use ONLY the provided glossary, actors, constraints, and each requirement's CONTEXT SNIPPETS.\n"
+                "Cite which page(s) you used in the 'citations' field; include a short snippet from each page.\n"
+                "You will get several requirements. Return ONLY a JSON array (no markdown, no commentary) "
+                "with exactly one object per requirement, each carrying that requirement's ID in \"req_id\".\n"
+                "If a requirement's context is insufficient or unrelated, its object is EXACTLY this JSON plus \"req_id\":\n"
+                f"{json.dumps(abstain, indent=2)}\n"
+                "Otherwise each object follows this schema plus \"req_id\":\n"
+                f"{json.dumps(SCHEMA, indent=2)}"
+            ),
+            "shared": (
+                f"GLOSSARY: {glossary}\n"
+                f"ACTORS: {actors}\n"
+                f"CONSTRAINTS: {constraints}\n"
+            ),
+        }
 
-        system_prompt = (
-            "You are a senior BA in healthcare software.\n"
-            "Use ONLY the provided glossary, actors, constraints, and CONTEXT SNIPPETS.\n"
-            "Cite which page(s) you used in the 'citations' field; include a short snippet from each page.\n"
-            "If the context is insufficient or unrelated, return EXACTLY this JSON:\n"
-            f"{json.dumps(abstain, indent=2)}\n"
-            "Return ONLY valid JSON with this schema (no markdown, no commentary):\n"
-            f"{json.dumps(SCHEMA, indent=2)}"
+    @staticmethod
+    def _single_prompt(parts: Dict[str, str], req: Dict[str, Any], context: List[Dict[str, Any]]) -> str:
+        return (
+            f"{parts['single']}\n\n{parts['shared']}"
+            f"CONTEXT SNIPPETS: {json.dumps(context, ensure_ascii=False)}\n"
+            f"REQUIREMENT (ID: {req['req_id']}): {req['text']}"
         )
 
-        stories = []
-        for i in tqdm(range(0, len(requirements), batch_size), desc="LLM batches"):
-            batch_reqs = requirements[i:i + batch_size]
-            prompts = []
-            for req in batch_reqs:
-                ctx = []
-                if retriever is not None:
-                    hits = retrieve_context(retriever, self.embedder, req["text"], top_k=3)
-                    ctx = [{"page": h["page"], "snippet": h["text"][:500]} for h in hits]  # cap snippet
-
-                user_prompt = (
-                    f"GLOSSARY: {glossary}\n"
-                    f"ACTORS: {actors}\n"
-                    f"CONSTRAINTS: {constraints}\n"
-                    f"CONTEXT SNIPPETS: {json.dumps(ctx, ensure_ascii=False)}\n"
-                    f"REQUIREMENT (ID: {req['req_id']}): {req['text']}"
-                )
-                prompts.append(f"{system_prompt}\n\n{user_prompt}")
-
-            responses = await safe_llm_batch_async(self.llm, prompts)
-
-            for req, resp in zip(batch_reqs, responses):
-                raw_text = clean_response(resp)
-                try:
-                    try:
-                        story_json = json.loads(raw_text)
-                    except json.JSONDecodeError:
-                        story_json = json.loads(extract_json_object(raw_text))
-
-                    us = UserStory(**story_json)
-
-                    # Force unique story_id & keep provenance
-                    us.story_id = str(uuid.uuid4())
-                    if not us.source_requirement_ids:
-                        us.source_requirement_ids = [req["req_id"]]
-
-                    stories.append(us.model_dump())  # pydantic v2
-                except (json.JSONDecodeError, ValidationError) as e:
-                    print(f"❌ Invalid JSON for {req['req_id']}: {e}\nRaw output:\n{raw_text}\n")
+    @staticmethod
+    def _packed_prompt(parts: Dict[str, str], reqs: List[Dict[str, Any]], contexts: List[List[Dict[str, Any]]]) -> str:
+        blocks = [
+            f"REQUIREMENT (ID: {req['req_id']}): {req['text']}\n"
+            f"CONTEXT SNIPPETS: {json.dumps(ctx, ensure_ascii=False)}"
+            for req, ctx in zip(reqs, contexts)
+        ]
+        return f"{parts['packed']}\n\n{parts['shared']}\n" + "\n\n".join(blocks)
+
+    def _stream_consumer(self, job: Dict[str, Any], reqs: List[Dict[str, Any]]):
+        """consumer_factory for one streamed job: each attempt gets a fresh StoryStream, the last one wins."""
+        def factory() -> StoryStream:
+            job["stream"] = StoryStream(self, reqs)
+            return job["stream"]
+        return factory
 
+    async def generate_user_stories_batch(
+        self,
+        requirements,
+        glossary,
+        actors,
+        constraints,
+        batch_size=5,
+        retriever: Optional[ChunkRetriever] = None,
+        pack_size: int = 1,
+    ):
+        """
+        Generate one story per requirement.
+        batch_size is kept for existing call sites only; how many requests are
+        in flight is decided by self.scheduler (llm_concurrency).
+        pack_size > 1 sends that many requirements per prompt (system prompt and
+        shared context paid once); items missing from a packed answer are
+        retried as single-requirement prompts.
+        Each call starts a fresh repair budget and self.failed_requirements.
+        """
+        self._reset_failures()
+        return await self._generate_batch(requirements, glossary, actors, constraints,
+                                          retriever=retriever, pack_size=pack_size)
+
+    async def _generate_batch(self, requirements, glossary, actors, constraints,
+                              retriever: Optional[ChunkRetriever] = None, pack_size: int = 1):
+        """generate_user_stories_batch within the current document's repair budget."""
+        by_req = await self._generate_by_requirement(
+            requirements, glossary, actors, constraints, retriever=retriever, pack_size=pack_size
+        )
+        # Keep requirement order regardless of completion order
+        stories = [s for s in by_req if s is not None]
         self._last_requirements = requirements
         return stories
 
+    @timed("extract.generate")
+    async def _generate_by_requirement(
+        self,
+        requirements,
+        glossary,
+        actors,
+        constraints,
+        retriever: Optional[ChunkRetriever] = None,
+        pack_size: int = 1,
+        chunk_size: Optional[int] = None,
+        prefetch: int = 2,
+        contexts: Optional[List[List[Dict[str, Any]]]] = None,
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        Story (or None) for each requirement, by position.
+        Producer/consumer pipeline over asyncio queues, so no stage waits for a
+        whole chunk to finish:
+          retrieve  RAG context per chunk of chunk_size requirements (up to
+                    `prefetch` chunks ahead of prompt building), unless
+                    `contexts` already holds it per requirement
+          build     single or packed prompts; response-cache hits skip the LLM
+          invoke    llm_concurrency workers calling the shared scheduler
+          validate  parse into UserStory dicts (already done while streaming with
+                    stream_responses), fill the cache, and re-queue
+                    requirements missing from a packed answer as single prompts
+        """
+        n = len(requirements)
+        by_req: List[Optional[Dict[str, Any]]] = [None] * n
+        if n == 0:
+            return by_req
+        chunk_size = chunk_size or n
+        parts = self._prompt_parts(glossary, actors, constraints)
+        given = contexts
+        contexts: Dict[int, List[Dict[str, Any]]] = {}
+
+        q_ctx: asyncio.Queue = asyncio.Queue(maxsize=max(1, prefetch))
+        q_jobs: asyncio.Queue = asyncio.Queue(maxsize=2 * self.scheduler.max_concurrency)
+        q_done: asyncio.Queue = asyncio.Queue()
+        state = {"outstanding": 0, "built": False}
+        # index -> (reason, raw output or None when the request itself failed), for the repair pass
+        failures: Dict[int, Tuple[str, Optional[str]]] = {}
+        pbar = tqdm(total=n, desc="Requirements")
+
+        def job_for(idxs: List[int]) -> Dict[str, Any]:
+            if len(idxs) > 1:
+                prompt = self._packed_prompt(parts, [requirements[i] for i in idxs], [contexts[i] for i in idxs])
+            else:
+                prompt = self._single_prompt(parts, requirements[idxs[0]], contexts[idxs[0]])
+            return {"idxs": idxs, "prompt": prompt, "key": None}
+
+        async def enqueue(job: Dict[str, Any]) -> bool:
+            """Count the job; True if it still needs the LLM (False: served from the response cache)."""
+            state["outstanding"] += 1
+            if self.response_cache is not None:
+                job["key"] = prompt_key(self.llm_model, self.llm_params, job["prompt"])
+                cached = await self.response_cache.aget(job["key"])
+                if cached is not None:
+                    q_done.put_nowait((job, cached, False))
+                    return False
+            return True
+
+        async def retrieve():
+            for idxs in chunked(list(range(n)), chunk_size):
+                if given is not None:
+                    ctxs = [given[i] for i in idxs]
+                else:
+                    ctxs = await self._prompt_contexts(retriever, [requirements[i] for i in idxs])
+                await q_ctx.put((idxs, ctxs))
+            await q_ctx.put(None)
+
+        async def build():
+            while (item := await q_ctx.get()) is not None:
+                idxs, ctxs = item
+                contexts.update(zip(idxs, ctxs))
+                step = pack_size if pack_size > 1 and len(idxs) > 1 else 1
+                for k in range(0, len(idxs), step):
+                    job = job_for(idxs[k:k + step])
+                    if await enqueue(job):
+                        await q_jobs.put(job)
+            state["built"] = True
+            q_done.put_nowait(None)  # wake validate() so it can notice the pipeline has drained
+
+        async def invoke():
+            while True:
+                job = await q_jobs.get()
+                reqs = [requirements[i] for i in job["idxs"]]
+                consumer = self._stream_consumer(job, reqs) if self.stream_responses else None
+                try:
+                    with attribute_to(requirements[i]["req_id"] for i in job["idxs"]):
+                        resp = await self.scheduler.invoke(job["prompt"], consumer_factory=consumer)
+                except Exception as e:  # a lost job would stall validate()
+                    resp = e
+                q_done.put_nowait((job, resp, True))
+
+        async def validate():
+            while not (state["built"] and state["outstanding"] == 0):
+                item = await q_done.get()
+                if item is None:
+                    continue
+                job, resp, fresh = item
+                idxs = job["idxs"]
+                stream = job.get("stream") if not isinstance(resp, Exception) else None
+                if len(idxs) > 1:
+                    if stream is not None:
+                        got = stream.stories
+                    else:
+                        got = self._parse_pack([requirements[i] for i in idxs], resp)
+                    for i in idxs:
+                        by_req[i] = got.get(requirements[i]["req_id"])
+                    missing = [i for i in idxs if by_req[i] is None]
+                    if missing:
+                        print(f"↩️ {len(missing)} requirement(s) missing from packed answer, retrying singly")
+                    for i in missing:
+                        retry = job_for([i])
+                        if await enqueue(retry):
+                            # never block validation on a full queue
+                            workers.append(asyncio.ensure_future(q_jobs.put(retry)))
+                    ok = bool(got)
+                    pbar.update(len(idxs) - len(missing))
+                elif stream is not None:
+                    req = requirements[idxs[0]]
+                    by_req[idxs[0]] = stream.stories.get(req["req_id"])
+                    ok = by_req[idxs[0]] is not None
+                    if not ok:
+                        failures[idxs[0]] = (stream.finish(), stream.text)
+                        print(f"❌ Invalid JSON for {req['req_id']}: {failures[idxs[0]][0]}\nRaw output:\n{stream.text}\n")
+                    pbar.update(1)
+                else:
+                    req = requirements[idxs[0]]
+                    by_req[idxs[0]], reason = self._validate_story(req, resp)
+                    ok = by_req[idxs[0]] is not None
+                    if not ok:
+                        raw = None if isinstance(resp, Exception) else clean_response(resp)
+                        failures[idxs[0]] = (reason, raw)
+                        if fresh and raw is None:
+                            print(f"❌ Request failed for {req['req_id']}: {reason}")
+                        elif fresh:
+                            print(f"❌ Invalid JSON for {req['req_id']}: {reason}\nRaw output:\n{raw}\n")
+                    pbar.update(1)
+                if ok and fresh and job["key"] is not None:
+                    await self.response_cache.aput(job["key"], response_text(resp))
+                state["outstanding"] -= 1
+
+        workers = [asyncio.ensure_future(invoke()) for _ in range(self.scheduler.max_concurrency)]
+        stages = [asyncio.ensure_future(stage()) for stage in (retrieve, build, validate)]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            # A failed (or cancelled) stage must not leave its siblings blocked on a queue forever
+            for t in stages + workers:
+                t.cancel()
+            await asyncio.gather(*stages, *workers, return_exceptions=True)
+            pbar.close()
+        if failures:
+            await self._repair_failed(requirements, by_req, failures, parts, contexts)
+        if self.response_cache is not None:
+            await asyncio.to_thread(self.response_cache.flush)  # buffered LRU access times
+        incr("requirements.generated", n)
+        incr("stories.generated", sum(1 for s in by_req if s is not None))
+        return by_req
+
+    async def _prompt_contexts(self, retriever: Optional[ChunkRetriever],
+                               requirements: List[Dict[str, str]]) -> List[List[Dict[str, Any]]]:
+        """Prompt context per requirement: top RAG chunks as {page, snippet} (empty without an index)."""
+        if retriever is None:
+            return [[] for _ in requirements]
+        texts = [r["text"] for r in requirements]
+        with attribute_to([r["req_id"] for r in requirements], texts=texts):
+            hits = await aretrieve_contexts(retriever, self.embedder, texts, top_k=3, mode=self.retrieval_mode)
+        return [[{"page": h["page"], "snippet": h["text"][:500]} for h in hs]  # cap snippet
+                for hs in hits]
+
+    def generation_fingerprint(self, constraints: str, pack_size: int) -> str:
+        """Hash of every setting that shapes a generated story; manifests from other settings are not reused."""
+        return fingerprint(json.dumps({
+            "model": self.llm_model, "llm_params": self.llm_params, "embedding_model": self.embedding_model,
+            "retrieval_mode": self.retrieval_mode, "chunking": self.chunking,
+            "pack_size": pack_size, "constraints": constraints,
+        }, sort_keys=True))
+
+    def _reset_failures(self):
+        """Start a new document: fresh failure queue and repair budget."""
+        self.failed_requirements = []
+        self._repair_left = self.repair_budget
+
+    @staticmethod
+    def _repair_prompt(parts: Dict[str, str], req: Dict[str, Any], context: List[Dict[str, Any]],
+                       reason: str, raw: str) -> str:
+        return (
+            f"{HealthcareStoryExtractor._single_prompt(parts, req, context)}\n\n"
+            f"YOUR PREVIOUS ANSWER WAS REJECTED: {reason}\n"
+            f"PREVIOUS ANSWER (truncated): {raw[:1500]}\n"
+            "Return ONLY the corrected JSON object, with every schema field and the right types."
+        )
 
-
-    def check_duplicates(self, stories, threshold=0.99):
-        """Return list of (story_id_i, story_id_j, similarity) for near-duplicates across different source reqs."""
-        texts = [_story_text_for_embedding(s) for s in stories if s.get("user_story")]
-        if not texts:
-            return []
-
-        embeddings = self.embedder.embed_documents(texts)
-        flagged = []
-
-        total_pairs = (len(embeddings) * (len(embeddings) - 1)) // 2
-        pbar = tqdm(total=total_pairs, desc="Duplicate check")
-        for i in range(len(embeddings)):
-            for j in range(i + 1, len(embeddings)):
-                # provenance-aware: skip same-source pairs
-                src_i = set(stories[i].get("source_requirement_ids", []))
-                src_j = set(stories[j].get("source_requirement_ids", []))
-                if not (src_i & src_j):
-                    sim = cosine_similarity(embeddings[i], embeddings[j])
-                    if sim >= threshold:
-                        flagged.append((stories[i]["story_id"], stories[j]["story_id"], sim))
-                pbar.update(1)
-        pbar.close()
-        return flagged
-
-    def dedupe_stories(self, stories, threshold=0.99):
-        """Cluster near-duplicates and keep the best representative per cluster."""
+    async def _repair_failed(self, requirements, by_req, failures: Dict[int, Tuple[str, Optional[str]]],
+                             parts: Dict[str, str], contexts: Dict[int, List[Dict[str, Any]]]):
+        """
+        Re-issue only the failed requirements on the smaller repair scheduler, for
+        up to repair_rounds rounds within the document's repair budget. Rejected
+        answers get a repair prompt (rejection reason and previous output
+        included); failed requests (raw None: timeout, transport error) have no
+        previous answer and get the plain prompt again.
+        Requirements still failing go to self.failed_requirements.
+        """
+        attempts = dict.fromkeys(failures, 0)
+
+        async def repair(i: int):
+            req = requirements[i]
+            reason, raw = failures[i]
+            context = contexts.get(i, [])
+            if raw is None:
+                prompt = self._single_prompt(parts, req, context)
+            else:
+                prompt = self._repair_prompt(parts, req, context, reason, raw)
+            key = prompt_key(self.llm_model, self.llm_params, prompt) if self.response_cache is not None else None
+            cached = await self.response_cache.aget(key) if key is not None else None
+            if cached is not None:
+                resp = cached
+            else:
+                with attribute_to([req["req_id"]]):
+                    resp = await self.repair_scheduler.invoke(prompt)
+            attempts[i] += 1
+            story, reason = self._validate_story(req, resp)
+            if story is None:
+                failures[i] = (reason, None if isinstance(resp, Exception) else clean_response(resp))
+                return
+            by_req[i] = story
+            del failures[i]
+            incr("stories.repaired")
+            if cached is None and key is not None:
+                await self.response_cache.aput(key, response_text(resp))
+
+        for rnd in range(self.repair_rounds):
+            todo = sorted(failures)[:self._repair_left]
+            if not todo:
+                break
+            self._repair_left -= len(todo)
+            incr("llm.repair_prompts", len(todo))
+            print(f"🔧 Repair round {rnd + 1}: re-issuing {len(todo)} failed requirement(s)")
+            await asyncio.gather(*(repair(i) for i in todo))
+
+        incr("stories.dropped_invalid", len(failures))
+        for i in sorted(failures):
+            self.failed_requirements.append({
+                "req_id": requirements[i]["req_id"],
+                "reason": failures[i][0],
+                "repair_attempts": attempts[i],
+            })
+        if failures:
+            print(f"⚠️ {len(failures)} requirement(s) still rejected after repair:",
+                  [requirements[i]["req_id"] for i in sorted(failures)])
+
+    @timed("extract.dedupe")
+    def find_near_duplicates(self, stories, threshold=0.99, mode="exact", lsh_tables=8, lsh_bits=12):
+        """
+        Single near-duplicate pass: embed every story once, score every pair once.
+        mode="exact" compares all pairs; mode="lsh" only scores pairs sharing a
+        random-hyperplane bucket (near-linear; raise lsh_tables for more recall).
+        Returns (flagged, kept):
+          flagged: [(story_id_i, story_id_j, similarity)] across different source reqs
+          kept:    stories with each duplicate cluster reduced to its best representative
+        """
         if not stories:
-            return stories
+            return [], stories
 
         texts = [_story_text_for_embedding(s) for s in stories]
         embeddings = self.embedder.embed_documents(texts)
+        if mode == "lsh":
+            pairs = _lsh_similar_pairs(stories, embeddings, threshold, n_tables=lsh_tables, n_bits=lsh_bits)
+        elif mode == "exact":
+            pairs = _similar_pairs(stories, embeddings, threshold)
+        else:
+            raise ValueError(f"Unknown dedupe mode: {mode!r} (expected 'exact' or 'lsh')")
+
+        # Stories without a user_story are clustered but never reported
+        flagged = [
+            (stories[i]["story_id"], stories[j]["story_id"], sim)
+            for i, j, sim in pairs
+            if stories[i].get("user_story") and stories[j].get("user_story")
+        ]
+        kept = _cluster_and_pick(stories, texts, pairs)
+        incr("stories.dropped_duplicate", len(stories) - len(kept))
+        return flagged, kept
+
+    def check_duplicates(self, stories, threshold=0.99, mode="exact", **lsh_kwargs):
+        """Return list of (story_id_i, story_id_j, similarity) for near-duplicates across different source reqs."""
+        return self.find_near_duplicates(stories, threshold=threshold, mode=mode, **lsh_kwargs)[0]
 
-        # Union-Find with progress
-        parent = list(range(len(stories)))
-        def find(x):
-            while parent[x] != x:
-                parent[x] = parent[parent[x]]
-                x = parent[x]
-            return x
-        def union(a, b):
-            ra, rb = find(a), find(b)
-            if ra != rb:
-                parent[rb] = ra
-
-        total_pairs = (len(embeddings) * (len(embeddings) - 1)) // 2
-        pbar = tqdm(total=total_pairs, desc="Clustering dupes")
-        for i in range(len(embeddings)):
-            for j in range(i + 1, len(embeddings)):
-                src_i = set(stories[i].get("source_requirement_ids", []))
-                src_j = set(stories[j].get("source_requirement_ids", []))
-                if not (src_i & src_j):
-                    sim = cosine_similarity(embeddings[i], embeddings[j])
-                    if sim >= threshold:
-                        union(i, j)
-                pbar.update(1)
-        pbar.close()
-
-        clusters = {}
-        for idx in range(len(stories)):
-            r = find(idx)
-            clusters.setdefault(r, []).append(idx)
-
-        # pick representative: more ACs, then longer text
-        def score(k):
-            ac_len = len(stories[k].get("acceptance_criteria", []) or [])
-            txt_len = len(texts[k])
-            return (ac_len, txt_len)
-
-        kept = []
-        dropped_pairs = []  # (kept_id, dropped_id, cluster_size)
-        for _, idxs in clusters.items():
-            if len(idxs) == 1:
-                kept.append(stories[idxs[0]])
-                continue
-            best = max(idxs, key=score)
-            kept.append(stories[best])
-            for other in idxs:
-                if other != best:
-                    dropped_pairs.append((stories[best]["story_id"], stories[other]["story_id"], len(idxs)))
-
-        if dropped_pairs:
-            preview = [(k, d, int(n)) for k, d, n in dropped_pairs]
-            print("🧹 Dedupe kept/dropped:", preview)
-
-        return kept
+    def dedupe_stories(self, stories, threshold=0.99, mode="exact", **lsh_kwargs):
+        """Cluster near-duplicates and keep the best representative per cluster."""
+        return self.find_near_duplicates(stories, threshold=threshold, mode=mode, **lsh_kwargs)[1]
 
 
+    @timed("extract.total")
     async def extract_from_file(
         self,
         file_path,
@@ -576,62 +1608,213 @@ class HealthcareStoryExtractor:
         dedupe=True,
         dup_threshold=0.99,
         min_alignment=0.15,
-        TEST=False
+        TEST=False,
+        dedupe_mode="exact",
+        pack_size=1,
+        streaming=False,
+        incremental=False,
+        manifest_path: Optional[str] = None,
+        lsh_tables=8,
+        lsh_bits=12,
     ):
+        self._reset_failures()
+        if streaming and incremental:
+            print("ℹ️ Incremental mode needs the full page set; streaming disabled for this run.")
+            streaming = False
+        if streaming and file_path.lower().endswith(".pdf"):
+            requirements, stories = await self._generate_streaming(
+                file_path, constraints, batch_llm_size, llm_inner_batch, pack_size,
+                max_requirements=10 if TEST else None,
+            )
+            return self._postprocess(stories, requirements, dedupe, dup_threshold, min_alignment, dedupe_mode,
+                                     lsh_tables, lsh_bits)
+
         print("📥 Parsing document...")
         parsed = parse_file_text_or_pages(file_path)
 
-        retriever = None
+        # One scan: normalize (PDF only), collect headings, segment requirements
+        norm_pages = None
         if "pages" in parsed:
-            print("🧹 Normalizing PDF pages & building RAG index...")
-            norm_pages = normalize_page_text(parsed["pages"])
-            chunks = page_chunks(norm_pages, max_chars=1500, overlap=200)
-            retriever = build_retriever(self.embedder, chunks)
+            print("🧹 Normalizing + segmenting PDF pages...")
+            scan = scan_document(parsed["pages"], normalize=True)
+            norm_pages = scan["pages"]
             full_text = "\n".join([p["text"] for p in norm_pages])
         else:
+            print("🧩 Segmenting requirements...")
             full_text = parsed["text"]
-
-        print("🧩 Segmenting requirements...")
-        requirements = split_requirements_with_epics(full_text)
+            scan = scan_document([{"page": 1, "text": full_text}], normalize=False)
+        requirements = scan["requirements"]
         print(f"📌 Found requirements: {len(requirements)}")
+        incr("requirements.found", len(requirements))
 
         # ✅ Limit for test mode
         if TEST:
             requirements = requirements[:10]
             print(f"⚡ TEST mode active → using only {len(requirements)} requirements")
 
-        glossary = {"EHR": "Electronic Health Record", "HL7": "Data exchange standard"}
-        actors = {"Doctor": "Reviews patient data", "Nurse": "Updates vitals", "Patient": "Views reports"}
+        # RAG index (unchanged chunks hit the embedding cache)
+        retriever = None
+        if norm_pages is not None and requirements:
+            print("📚 Building RAG index...")
+            retriever = open_retriever(self.embedder, norm_pages, self.rag_index, self.embedding_model,
+                                       max_chars=1500, overlap=200, mode=self.retrieval_mode,
+                                       chunking=self.chunking)
+
+        # Incremental mode: carry over stories of requirements whose text, prompt context
+        # and cited pages are all unchanged since the last run
+        carried: Dict[int, List[Dict[str, Any]]] = {}
+        contexts = None
+        if incremental:
+            manifest_path = manifest_path or default_manifest_path(file_path)
+            settings = self.generation_fingerprint(constraints, pack_size)
+            manifest = load_manifest(manifest_path, settings)
+            page_hashes = page_fingerprints(norm_pages or [{"page": 1, "text": full_text}])
+            changed_pages = {pg for pg, h in manifest["pages"].items() if page_hashes.get(pg) != h}
+            contexts = []
+            for part in chunked(requirements, batch_llm_size):
+                contexts.extend(await self._prompt_contexts(retriever, part))
+            req_keys = requirement_keys(requirements, contexts)
+            for i, key in enumerate(req_keys):
+                entry = manifest["requirements"].get(key)
+                if entry is not None and not changed_pages.intersection(entry.get("pages", [])):
+                    carried[i] = entry["stories"]
+            print(f"♻️ Incremental: {len(changed_pages)}/{len(manifest['pages'])} page(s) changed, "
+                  f"{len(carried)}/{len(requirements)} requirement(s) unchanged")
+        todo = [i for i in range(len(requirements)) if i not in carried]
+        incr("requirements.carried", len(carried))
+
+        per_req: Dict[int, List[Dict[str, Any]]] = {}
+        print("🧠 Generating stories (LLM)...")
+        # One pipeline across all chunks: chunk N+1's retrieval and prompts overlap chunk N's LLM calls
+        by_req = await self._generate_by_requirement(
+            [requirements[i] for i in todo], STORY_GLOSSARY, STORY_ACTORS, constraints,
+            retriever=retriever, pack_size=pack_size, chunk_size=batch_llm_size,
+            contexts=[contexts[i] for i in todo] if contexts is not None else None,
+        )
+        for i, story in zip(todo, by_req):
+            per_req[i] = [story] if story is not None else []
 
         stories: List[Dict[str, Any]] = []
-        print("🧠 Generating stories (LLM)...")
-        for batch in tqdm(list(chunked(requirements, batch_llm_size)), desc="Requirement chunks"):
-            part = await self.generate_user_stories_batch(
-                batch, glossary, actors, constraints, batch_size=llm_inner_batch, retriever=retriever
-            )
+        for i in range(len(requirements)):
+            stories.extend(per_req[i] if i in per_req else json.loads(json.dumps(carried[i])))
+
+        if incremental:
+            # Snapshot before alignment/dedupe mutate the story dicts; failed requirements
+            # are left out so the next run retries them. "pages" lists the pages the stories
+            # depend on (context and citations): editing any of them regenerates the requirement.
+            entries = {}
+            for i, key in enumerate(req_keys):
+                kept = per_req[i] if i in per_req else carried.get(i, [])
+                if kept:
+                    pages = {str(c["page"]) for c in contexts[i]}
+                    pages.update(str(c.get("page")) for s in kept for c in s.get("citations") or [])
+                    entries[key] = {"req_id": requirements[i]["req_id"], "pages": sorted(pages), "stories": kept}
+            save_manifest(manifest_path, settings, page_hashes, json.loads(json.dumps(entries)))
+
+        self._last_requirements = requirements
+        return self._postprocess(stories, requirements, dedupe, dup_threshold, min_alignment, dedupe_mode,
+                                 lsh_tables, lsh_bits)
+
+    async def _generate_streaming(self, file_path, constraints, batch_llm_size, llm_inner_batch,
+                                  pack_size, max_requirements=None):
+        """
+        Streaming PDF path: pages are parsed, normalized, chunked, indexed and
+        segmented one at a time (in a worker thread), and every batch_llm_size
+        requirements are sent to the LLM while later pages are still parsing.
+        Context for a requirement is retrieved from the pages indexed so far,
+        which always includes its own page.
+        """
+        print("📥 Streaming document (parse → index → segment → LLM)...")
+        retriever = ChunkRetriever([], [])
+        segmenter = RequirementSegmenter()
+        pages = iter_normalized_pages(iter_pdf_pages(file_path))
+        chunker = PageChunker(max_chars=1500, overlap=200) if self.chunking == "sentence" else None
+        pending_chunks: List[Dict[str, Any]] = []
+        requirements: List[Dict[str, str]] = []
+        ready: List[Dict[str, str]] = []
+        tasks: List[asyncio.Task] = []
+
+        async def index_pending():
+            if pending_chunks:
+                if self.retrieval_mode == "lexical":
+                    embs = np.zeros((len(pending_chunks), 0), dtype=np.float32)
+                else:
+                    embs = await asyncio.to_thread(self.embedder.embed_documents, [c["text"] for c in pending_chunks])
+                retriever.add(list(pending_chunks), embs)
+                pending_chunks.clear()
+
+        async def dispatch(batch):
+            await index_pending()  # the batch's own pages must be searchable
+            # One document, one repair budget: batches must not reset each other's failures
+            tasks.append(asyncio.create_task(self._generate_batch(
+                batch, STORY_GLOSSARY, STORY_ACTORS, constraints, retriever=retriever, pack_size=pack_size,
+            )))
+
+        pbar = tqdm(desc="Pages streamed", unit="page")
+        while True:
+            page = await asyncio.to_thread(next, pages, None)
+            if page is None:
+                ready.extend(segmenter.close())
+                if chunker is not None:
+                    pending_chunks.extend(chunker.close())
+                break
+            pbar.update(1)
+            if chunker is not None:
+                pending_chunks.extend(chunker.feed(page))  # boilerplate learned from pages seen so far
+            else:
+                pending_chunks.extend(iter_page_chunks([page], max_chars=1500, overlap=200))
+            ready.extend(segmenter.feed(page["text"]))
+            if max_requirements is not None and len(requirements) + len(ready) >= max_requirements:
+                ready = ready[:max_requirements - len(requirements)]
+                if chunker is not None:
+                    pending_chunks.extend(chunker.close())  # held tail sentence
+                break
+            while len(ready) >= batch_llm_size:
+                batch, ready = ready[:batch_llm_size], ready[batch_llm_size:]
+                requirements.extend(batch)
+                await dispatch(batch)
+        pbar.close()
+        pages.close()
+
+        for batch in chunked(ready, batch_llm_size):
+            requirements.extend(batch)
+            await dispatch(batch)
+        print(f"📌 Found requirements: {len(requirements)}")
+        incr("requirements.found", len(requirements))
+
+        stories: List[Dict[str, Any]] = []
+        for part in await asyncio.gather(*tasks):
             stories.extend(part)
+        self._last_requirements = requirements
+        return requirements, stories
 
+    def _postprocess(self, stories, requirements, dedupe, dup_threshold, min_alignment, dedupe_mode,
+                     lsh_tables=8, lsh_bits=12):
+        """Alignment check + near-duplicate removal over generated stories."""
         print(f"🧾 Generated stories (pre-alignment, pre-dedupe): {len(stories)}")
 
         # Alignment pass
         print("🔎 Checking alignment with citations...")
         req_map = {r["req_id"]: r for r in requirements}
         aligned, needs_review = [], []
-        for s in stories:
-            rid = (s.get("source_requirement_ids") or [None])[0]
-            req = req_map.get(rid, {"text": ""})
-            ok, score = validate_alignment(req, s, min_score=min_alignment)
-            s["alignment_score"] = round(score, 3)
-            s["needs_review"] = not ok
-            (aligned if ok else needs_review).append(s)
+        with span("extract.align"):
+            for s in stories:
+                rid = (s.get("source_requirement_ids") or [None])[0]
+                req = req_map.get(rid, {"text": ""})
+                ok, score = validate_alignment(req, s, min_score=min_alignment)
+                s["alignment_score"] = round(score, 3)
+                s["needs_review"] = not ok
+                (aligned if ok else needs_review).append(s)
+        incr("stories.needs_review", len(needs_review))
         print(f"✅ Aligned: {len(aligned)} | 🚩 Needs review: {len(needs_review)}")
 
         final_stories = aligned + needs_review
         if dedupe and final_stories:
-            dups = self.check_duplicates(final_stories, threshold=dup_threshold)
+            dups, final_stories = self.find_near_duplicates(
+                final_stories, threshold=dup_threshold, mode=dedupe_mode, lsh_tables=lsh_tables, lsh_bits=lsh_bits
+            )
             if dups:
                 print("⚠️ Near-duplicate pairs:", [(a, b, round(sim, 3)) for a, b, sim in dups])
-            final_stories = self.dedupe_stories(final_stories, threshold=dup_threshold)
             print(f"✅ Final stories after dedupe: {len(final_stories)}")
         else:
             print("⏭️ Skipping dedupe.")
@@ -764,6 +1947,7 @@ class HealthcareStoryExtractor:
 
     def _infer_bq_schema(self, sample_row: dict):
         """Infer BigQuery schema dynamically from a sample story dict."""
+        from google.cloud import bigquery
         schema = []
         for key, val in sample_row.items():
             if isinstance(val, list) and val and isinstance(val[0], dict):
@@ -783,6 +1967,7 @@ class HealthcareStoryExtractor:
             print("No stories to export")
             return
 
+        from google.cloud import bigquery
         client = bigquery.Client(project=self.project_id)
         table_ref = f"{self.project_id}.{dataset_id}.{table_id}"
 
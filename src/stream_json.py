@@ -0,0 +1,108 @@
+"""
+Incremental JSON Object Parser
+------------------------------
+Consumes LLM output chunk by chunk and hands back each JSON object as soon
+as it closes: the root object, or every object element of a root array.
+Only structural characters are visited (one regex scan per chunk), and
+braces inside strings (including escaped quotes) are ignored.
+
+Text before the first '{' or '[' (code fences, "Here is the JSON:") is
+skipped, as is everything after the root value closes. The parser gives up
+early (sets .error) when:
+  - no JSON starts within max_preamble characters (the model is writing prose);
+  - brackets are unbalanced or mismatched;
+  - a closed object is not valid JSON.
+"""
+
+import re
+import json
+from typing import Any, List, Optional, Tuple
+
+MAX_PREAMBLE = 200
+
+_STRUCT_RE = re.compile(r'[{}\[\]"\\]')
+_START_RE = re.compile(r"[{\[]")
+_PAIRS = {"}": "{", "]": "["}
+
+
+class IncrementalJSONParser:
+    def __init__(self, max_preamble: int = MAX_PREAMBLE):
+        self.max_preamble = max_preamble
+        self.text = ""
+        self.root: Optional[str] = None   # "{" or "[" once the root value has started
+        self.done = False                 # root value closed
+        self.end = -1                     # offset just past the root value, once done
+        self.error: Optional[str] = None
+        self.objects = 0
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_str = False
+        self._skip = -1                   # index of an escaped character inside a string
+        self._obj_start = -1
+
+    @property
+    def stopped(self) -> bool:
+        return self.done or self.error is not None
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Append a chunk; return the objects that closed in it."""
+        if self.stopped or not chunk:
+            return []
+        self.text += chunk
+        if self.root is None and not self._find_start():
+            return []
+        out: List[Any] = []
+        for m in _STRUCT_RE.finditer(self.text, self._pos):
+            i, ch = m.start(), m.group()
+            if self._in_str:
+                if i == self._skip:
+                    continue
+                if ch == "\\":
+                    self._skip = i + 1
+                elif ch == '"':
+                    self._in_str = False
+                continue
+            if ch == '"':
+                self._in_str = True
+            elif ch in "{[":
+                self._stack.append(ch)
+                if ch == "{" and len(self._stack) == (1 if self.root == "{" else 2):
+                    self._obj_start = i
+            elif ch in "}]":
+                if not self._stack or self._stack[-1] != _PAIRS[ch]:
+                    self.error = f"unbalanced {ch!r} at offset {i}"
+                    break
+                self._stack.pop()
+                if ch == "}" and len(self._stack) == (0 if self.root == "{" else 1):
+                    try:
+                        out.append(json.loads(self.text[self._obj_start:i + 1]))
+                    except json.JSONDecodeError as e:
+                        self.error = f"invalid JSON object at offset {self._obj_start}: {e.msg}"
+                        break
+                    self.objects += 1
+                if not self._stack:
+                    self.done, self.end = True, i + 1
+                    break
+            # a backslash outside a string is left for json.loads to reject
+        else:
+            self._pos = len(self.text)
+            return out
+        self._pos = i + 1
+        return out
+
+    def _find_start(self) -> bool:
+        m = _START_RE.search(self.text, self._pos)
+        if m is None:
+            self._pos = len(self.text)
+            if len(self.text) > self.max_preamble:
+                self.error = f"no JSON within the first {self.max_preamble} characters"
+            return False
+        self.root = m.group()
+        self._pos = m.start()
+        return True
+
+
+def parse_json_objects(text: str) -> Tuple[List[Any], IncrementalJSONParser]:
+    """Objects in a complete text (no preamble limit), plus the parser for .error/.done/.root."""
+    parser = IncrementalJSONParser(max_preamble=len(text))
+    return parser.feed(text), parser
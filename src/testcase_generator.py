@@ -13,6 +13,8 @@ from pathlib import Path
 from collections import defaultdict
 from typing import List, Dict, Any, Tuple
 
+from src.instrumentation import timed, incr
+
 _SAFE = re.compile(r"[^A-Za-z0-9._-]+")
 
 def _safe_name(s: str, default: str = "item") -> str:
@@ -73,6 +75,7 @@ class TestCaseGenerator:
         return f"priority_{p}"
 
     # ------------------------ feature files ------------------------
+    @timed("testgen.features")
     def export_gherkin_features(
         self,
         stories: List[Dict[str, Any]],
@@ -193,6 +196,7 @@ def step_impl_then(context):
     pass
 """
 
+    @timed("testgen.steps")
     def export_step_stubs(
         self,
         stories: List[Dict[str, Any]],
@@ -270,6 +274,7 @@ def step_impl_then(context):
                 ])
         return rows
 
+    @timed("testgen.rtm")
     def export_traceability_csv(self, stories: List[Dict[str, Any]], path: str = "traceability.csv") -> Path:
         rows = self._build_rtm_rows(stories)
         with open(path, "w", newline="", encoding="utf-8") as f:
@@ -290,6 +295,7 @@ def step_impl_then(context):
         return sorted([rid for rid, n in req_to_scen.items() if n == 0])
 
     # ------------------------ Orchestrator ------------------------
+    @timed("testgen.generate")
     def generate(
         self,
         stories: List[Dict[str, Any]],
@@ -308,6 +314,9 @@ def step_impl_then(context):
         )
         rtm_file = self.export_traceability_csv(stories, path=traceability_csv)
         gaps = self.flag_requirements_with_no_scenarios(stories)
+        incr("testgen.feature_files", len(feature_files))
+        incr("testgen.scenarios", sum(len(self._story_scenarios(s)) for s in stories))
+        incr("testgen.requirements_without_scenarios", len(gaps))
 
         if gaps:
             print(f"⚠️ Requirements with 0 scenarios: {gaps}")
@@ -2,6 +2,8 @@ import csv
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 
+from src.instrumentation import timed, incr
+
 class ToolChainConnector:
     """
     A class to handle exporting stories and scenarios to CSV files
@@ -74,6 +76,7 @@ class ToolChainConnector:
         return rows
 
 
+    @timed("exports.jira")
     def export_to_jira_csv(
         self,
         stories: List[Dict[str, Any]],
@@ -122,10 +125,12 @@ class ToolChainConnector:
                     r["epic"],
                 ])
 
+        incr("exports.jira_rows", len(rows))
         print(f"🗂️  Wrote Jira-friendly CSV to {path}")
         return Path(path)
 
 
+    @timed("exports.ado")
     def export_to_ado_csv(
         self,
         stories: List[Dict[str, Any]],
@@ -166,5 +171,6 @@ class ToolChainConnector:
                     iteration_path or "",
                 ])
 
+        incr("exports.ado_rows", len(rows))
         print(f"🗂️  Wrote ADO-friendly CSV to {path}")
         return Path(path)
\ No newline at end of file
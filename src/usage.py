@@ -0,0 +1,221 @@
+"""
+Token & cost accounting
+-----------------------
+Records prompt/completion tokens of every LLM call and the characters of
+every embedding request that reaches the API, attributes them to
+requirements (and, through their epics, to epics), and prices them.
+
+Attribution uses a context variable: wrap work for some requirements in
+`with attribute_to(req_ids):` and every call made inside it (including in
+worker threads started with asyncio.to_thread) is charged to them. An LLM
+call shared by several requirements (a packed prompt) is split evenly.
+Embedded texts are charged to their own requirement: pass the requirements'
+texts as attribute_to(req_ids, texts=...) when a batch embeds them (only the
+cache misses of a batch reach the ledger). Calls outside any scope (index
+building, dedupe), and texts a multi-requirement scope cannot place, are
+charged to the run only.
+
+Token counts come from the model's usage metadata when the client returns
+it, and are otherwise estimated (~4 chars/token); the report says which.
+
+Config (env, USD):
+  LLM_PRICE_INPUT_PER_1M       per 1M prompt tokens (default: 0.10)
+  LLM_PRICE_OUTPUT_PER_1M      per 1M completion tokens (default: 0.40)
+  EMBED_PRICE_PER_1M_CHARS     per 1M embedded characters (default: 0.025)
+"""
+
+import os
+import json
+import time
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+LLM_PRICE_INPUT_PER_1M = float(os.environ.get("LLM_PRICE_INPUT_PER_1M", "0.10"))
+LLM_PRICE_OUTPUT_PER_1M = float(os.environ.get("LLM_PRICE_OUTPUT_PER_1M", "0.40"))
+EMBED_PRICE_PER_1M_CHARS = float(os.environ.get("EMBED_PRICE_PER_1M_CHARS", "0.025"))
+
+_scope: contextvars.ContextVar = contextvars.ContextVar("usage_scope", default=())
+_text_owners: contextvars.ContextVar = contextvars.ContextVar("usage_text_owners", default=None)
+
+
+@contextmanager
+def attribute_to(req_ids: Iterable[str], texts: Optional[Iterable[str]] = None):
+    """
+    Charge LLM/embedding usage inside the block to these requirement ids.
+    texts (one per id) maps each embedded text to the id(s) it came from.
+    """
+    ids = tuple(str(r) for r in req_ids)
+    owners = None
+    if texts is not None:
+        owners = defaultdict(list)
+        for rid, text in zip(ids, texts):
+            owners[text].append(rid)
+    token = _scope.set(ids)
+    owners_token = _text_owners.set(owners)
+    try:
+        yield
+    finally:
+        _text_owners.reset(owners_token)
+        _scope.reset(token)
+
+
+def usage_from_metadata(meta: Any) -> Optional[Tuple[int, int]]:
+    """(prompt_tokens, completion_tokens) from Vertex/LangChain usage metadata, or None."""
+    if not isinstance(meta, dict):
+        return None
+    meta = meta.get("usage_metadata", meta)
+    if not isinstance(meta, dict):
+        return None
+    for p_key, c_key in (("prompt_token_count", "candidates_token_count"), ("input_tokens", "output_tokens")):
+        if p_key in meta:
+            return int(meta.get(p_key) or 0), int(meta.get(c_key) or 0)
+    return None
+
+
+def _empty() -> Dict[str, float]:
+    return {"llm_calls": 0, "prompt_tokens": 0.0, "completion_tokens": 0.0, "embed_chars": 0.0}
+
+
+class UsageLedger:
+    """Thread-safe usage totals for the run and per requirement id."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.run = _empty()
+            self.run["estimated_calls"] = 0
+            self.by_req: Dict[str, Dict[str, float]] = defaultdict(_empty)
+            self._llm_start: Optional[float] = None
+            self._llm_end: Optional[float] = None
+
+    def record_llm(self, prompt_tokens: int, completion_tokens: int, seconds: float = 0.0, estimated: bool = False):
+        ids = _scope.get()
+        now = time.perf_counter()
+        with self._lock:
+            self.run["llm_calls"] += 1
+            self.run["prompt_tokens"] += prompt_tokens
+            self.run["completion_tokens"] += completion_tokens
+            self.run["estimated_calls"] += int(estimated)
+            start = now - seconds
+            self._llm_start = start if self._llm_start is None else min(self._llm_start, start)
+            self._llm_end = now if self._llm_end is None else max(self._llm_end, now)
+            for rid in ids:
+                rec = self.by_req[rid]
+                rec["llm_calls"] += 1 / len(ids)
+                rec["prompt_tokens"] += prompt_tokens / len(ids)
+                rec["completion_tokens"] += completion_tokens / len(ids)
+
+    def record_embedding(self, texts: List[str]):
+        ids = _scope.get()
+        owners = _text_owners.get()
+        chars = [len(t or "") for t in texts]
+        with self._lock:
+            self.run["embed_chars"] += sum(chars)
+            for text, n in zip(texts, chars):
+                rids = owners.get(text) if owners else None
+                if rids is None and len(ids) == 1:
+                    rids = ids
+                for rid in rids or ():  # identical texts of several requirements are embedded once
+                    self.by_req[rid]["embed_chars"] += n / len(rids)
+
+    # ------------------------------ reporting ------------------------------
+
+    @staticmethod
+    def cost(rec: Dict[str, float]) -> float:
+        return (rec["prompt_tokens"] * LLM_PRICE_INPUT_PER_1M
+                + rec["completion_tokens"] * LLM_PRICE_OUTPUT_PER_1M
+                + rec["embed_chars"] * EMBED_PRICE_PER_1M_CHARS) / 1_000_000
+
+    @staticmethod
+    def _rounded(rec: Dict[str, float]) -> Dict[str, Any]:
+        out = {k: round(v, 2) for k, v in rec.items()}
+        out["cost_usd"] = round(UsageLedger.cost(rec), 6)
+        return out
+
+    def report(self, requirements: Optional[List[Dict[str, Any]]] = None,
+               stories: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        Run totals, throughput and cost, plus per-requirement and per-epic
+        rollups (epics from the requirements' "epic" field, else "General").
+        """
+        with self._lock:
+            run = dict(self.run)
+            by_req = {rid: dict(rec) for rid, rec in self.by_req.items()}
+            llm_seconds = (self._llm_end - self._llm_start) if self._llm_start is not None else 0.0
+        epic_of = {r["req_id"]: (r.get("epic") or "General") for r in requirements or []}
+        by_epic: Dict[str, Dict[str, float]] = defaultdict(_empty)
+        for rid, rec in by_req.items():
+            epic = by_epic[epic_of.get(rid, "General")]
+            for k, v in rec.items():
+                epic[k] += v
+
+        n_stories = len(stories) if stories is not None else None
+        tokens = run["prompt_tokens"] + run["completion_tokens"]
+        total_cost = self.cost(run)
+        return {
+            "pricing_usd_per_1m": {
+                "prompt_tokens": LLM_PRICE_INPUT_PER_1M,
+                "completion_tokens": LLM_PRICE_OUTPUT_PER_1M,
+                "embed_chars": EMBED_PRICE_PER_1M_CHARS,
+            },
+            "run": dict(self._rounded(run), **{
+                "tokens_estimated": run["estimated_calls"] > 0,
+                "llm_seconds": round(llm_seconds, 3),
+                "tokens_per_s": round(tokens / llm_seconds, 1) if llm_seconds else None,
+                "requirements": len(by_req),
+                "requirements_per_min": round(len(by_req) / llm_seconds * 60, 1) if llm_seconds else None,
+                "stories": n_stories,
+                "cost_per_story_usd": round(total_cost / n_stories, 8) if n_stories else None,
+            }),
+            "by_epic": {epic: self._rounded(rec) for epic, rec in sorted(by_epic.items())},
+            "by_requirement": {rid: dict(self._rounded(rec), epic=epic_of.get(rid, "General"))
+                               for rid, rec in by_req.items()},
+        }
+
+    def write_report(self, path: str, requirements=None, stories=None) -> str:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        report = self.report(requirements, stories)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        run = report["run"]
+        print(f"💰 Usage: {int(run['prompt_tokens'])} prompt + {int(run['completion_tokens'])} completion tokens"
+              f"{' (estimated)' if run['tokens_estimated'] else ''}, {int(run['embed_chars'])} embedded chars "
+              f"→ ${run['cost_usd']:.4f} ({path})")
+        return path
+
+
+class MeteredEmbeddings:
+    """Wraps an embeddings client and records the characters of every request in a UsageLedger."""
+
+    def __init__(self, embedder: Any, ledger: Optional[UsageLedger] = None):
+        self.embedder = embedder
+        self.ledger = ledger if ledger is not None else USAGE
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__["embedder"], name)
+
+    def embed_documents(self, texts: List[str], **kwargs) -> List[List[float]]:
+        if texts:
+            self.ledger.record_embedding(list(texts))
+        return self.embedder.embed_documents(texts, **kwargs)
+
+    def embed_query(self, text: str, **kwargs) -> List[float]:
+        self.ledger.record_embedding([text])
+        return self.embedder.embed_query(text, **kwargs)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.to_thread(self.embed_query, text)
+
+
+# Process-wide ledger (like instrumentation.METRICS); reset() it per run
+USAGE = UsageLedger()
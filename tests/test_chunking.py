@@ -0,0 +1,35 @@
+import os
+import sys
+import json
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Pairs of pages one word apart (shingle Jaccard 55/61 = 0.90, right at the
+# near-duplicate cut-off), so which pages count as near duplicates depends on
+# the shingle hashes
+_SCRIPT = r"""
+import json
+from src.chunking import sentence_chunks
+pages = []
+for p in range(2000):
+    words = [f"w{p}x{i}" for i in range(60)]
+    pages.append({"page": 2 * p + 1, "text": " ".join(words) + "."})
+    words[30] = f"edit{p}"
+    pages.append({"page": 2 * p + 2, "text": " ".join(words) + "."})
+print(json.dumps(sentence_chunks(pages, max_chars=5000, overlap=0)))
+"""
+
+
+def _chunks_with_seed(seed: str):
+    env = dict(os.environ, PYTHONHASHSEED=seed)
+    out = subprocess.run([sys.executable, "-c", _SCRIPT], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout)
+
+
+def test_sentence_chunks_independent_of_hash_seed():
+    first = _chunks_with_seed("1")
+    assert len(first) >= 2000
+    assert _chunks_with_seed("2") == first
+    assert _chunks_with_seed("3") == first